@@ -0,0 +1,46 @@
+"""
+bench_latex.py
+--------------
+
+Measures the throughput of the Unicode to LaTeX conversion used for BibLaTeX
+citations, on the metadata of a synthetic library. This compares
+latex.encode_all() against running one str.replace() per table entry, which
+is how citations used to be converted. The output itself is checked by
+tests/test_latex.py, not here.
+
+    python benchmarks/bench_latex.py [n_articles]
+"""
+
+import sys
+from time import time
+
+from cygnet import latex
+from synthetic import make_library
+
+
+def replace_each(s, table):
+    for char, replacement in table.items():
+        s = s.replace(char, replacement)
+    return s
+
+
+def main(n):
+    # The parts of each citation which may contain non-ASCII characters.
+    texts = [" and ".join(a.format_authors("bib")) + f"\n{a.title}\n"
+             + a.journal_short for a in make_library(n)]
+    nchars = sum(len(t) for t in texts)
+    table = latex._table
+
+    for name, fn in [
+            ("str.replace per entry",
+             lambda: [replace_each(t, table) for t in texts]),
+            ("encode_all()", lambda: latex.encode_all(texts))]:
+        now = time()
+        fn()
+        elapsed = time() - now
+        print(f"{name:>22}: {elapsed:.3f} s, "
+              f"{nchars / elapsed / 1e6:.1f} M chars/s")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5_000)
@@ -0,0 +1,93 @@
+"""
+bench_list_output.py
+--------------------
+
+Times 'l all' on synthetic libraries of 1,000 and 10,000 articles, comparing
+the single write which listprint.print_list() does against printing each row
+separately, as it used to (best of three runs). The output goes to a line-buffered file (like a
+terminal), both directly and through prompt_toolkit's patch_stdout(), which
+is how the prompt runs commands.
+
+    python benchmarks/bench_list_output.py [n_articles ...]
+"""
+
+import os
+import sys
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import time
+
+from prompt_toolkit.patch_stdout import patch_stdout
+
+from cygnet import listprint
+from cygnet._shared import _g
+from synthetic import make_library
+
+
+def print_rows(articles, refnos):
+    # The same as print_list(), but with a print() for every row.
+    field_sizes = listprint.get_field_sizes(articles, refnos)
+    rows = [listprint.make_row(article, refno)
+            for article, refno in zip(articles, refnos)]
+    for line in listprint.format_list_head(field_sizes):
+        print(line)
+    for row in rows:
+        for line in listprint.format_list_article(row, field_sizes,
+                                                  max_auth=5):
+            print(line)
+
+
+def write_once(articles, refnos):
+    listprint.print_list(articles, refnos)
+
+
+def timed(fn, articles, refnos, patched):
+    # prompt_toolkit writes to the real stdout, so the file descriptor has to
+    # be redirected, not just sys.stdout.
+    sys.stdout.flush()
+    saved_fd = os.dup(1)
+    saved_stdout = sys.stdout
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    sys.stdout = open(1, "w", buffering=1, closefd=False)
+    try:
+        now = time()
+        if patched:
+            with patch_stdout(raw=True):
+                fn(articles, refnos)
+        else:
+            fn(articles, refnos)
+        return time() - now
+    finally:
+        sys.stdout.close()
+        sys.stdout = saved_stdout
+        os.dup2(saved_fd, 1)
+        os.close(saved_fd)
+        os.close(devnull)
+
+
+def main(sizes):
+    # The output is thrown away, so there might not be a terminal to measure.
+    os.get_terminal_size = lambda *args: os.terminal_size((160, 50))
+
+    with TemporaryDirectory() as tmpdir:
+        _g.currentPath = Path(tmpdir)
+        for n in sizes:
+            articles = make_library(n)
+            refnos = list(range(1, n + 1))
+            # Warm up the caches on the articles, so that only the output is
+            # compared.
+            timed(write_once, articles, refnos, False)
+            for patched in (False, True):
+                label = "patch_stdout" if patched else "plain stdout"
+                rows = min(timed(print_rows, articles, refnos, patched)
+                           for _ in range(3))
+                once = min(timed(write_once, articles, refnos, patched)
+                           for _ in range(3))
+                print(f"l all ({n} articles, {label}): "
+                      f"print per row {rows:.3f} s, "
+                      f"single write {once:.3f} s")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [1_000, 10_000])
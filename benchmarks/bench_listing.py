@@ -0,0 +1,63 @@
+"""
+bench_listing.py
+----------------
+
+Times listing (the l command) and searching (the s command) on a synthetic
+library. The first run of each starts with nothing cached on the articles;
+later runs show the effect of caching the formatted author and journal names.
+
+    python benchmarks/bench_listing.py [n_articles]
+"""
+
+import io
+import os
+import re
+import sys
+from contextlib import redirect_stdout
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import time
+
+from cygnet import listprint
+from cygnet._shared import _g
+from synthetic import make_library
+
+
+def list_all(articles):
+    with redirect_stdout(io.StringIO()):
+        listprint.print_list(articles, list(range(1, len(articles) + 1)))
+
+
+def search_all(articles, query):
+    # The same search as cli_search() does.
+    queries = [re.compile(query, flags=re.IGNORECASE)]
+    return [refno for refno, article in enumerate(articles, start=1)
+            if all(article.search(*queries))]
+
+
+def timed(fn, *args, repeats=3):
+    """
+    Returns the time taken by the first call, and the best of the next few.
+    """
+    times = []
+    for _ in range(1 + repeats):
+        now = time()
+        fn(*args)
+        times.append(time() - now)
+    return times[0], min(times[1:])
+
+
+def main(n):
+    # The output is thrown away, so there might not be a terminal to measure.
+    os.get_terminal_size = lambda *args: os.terminal_size((160, 50))
+
+    with TemporaryDirectory() as tmpdir:
+        _g.currentPath = Path(tmpdir)
+        first, rest = timed(list_all, make_library(n))
+        print(f"l ({n} articles): first {first:.3f} s, then {rest:.3f} s")
+        first, rest = timed(search_all, make_library(n), "keeler")
+        print(f"s ({n} articles): first {first:.3f} s, then {rest:.3f} s")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5_000)
@@ -0,0 +1,56 @@
+"""
+bench_memory.py
+---------------
+
+Measures the memory used per article when a synthetic library is loaded,
+comparing Article against a plain class which keeps a __dict__ and stores
+authors as dictionaries (which is how articles used to be stored).
+
+    python benchmarks/bench_memory.py [n_articles]
+"""
+
+import gc
+import sys
+import tracemalloc
+
+from cygnet import fileio
+from cygnet.cygcls import Article
+from synthetic import make_library
+
+
+class DictArticle():
+    """
+    An article stored the old way, for comparison.
+    """
+    def __init__(self, **kwargs):
+        for name, value in kwargs.items():
+            setattr(self, name, value)
+
+
+def measure(cls, text):
+    """
+    Returns the number of bytes still allocated after loading the articles in
+    text as instances of cls. The strings come straight from the YAML parser,
+    so (unless they are interned) nothing is shared between articles.
+    """
+    gc.collect()
+    tracemalloc.start()
+    articles = [cls(**d) for d in fileio._load_all(text)]
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del articles
+    return size
+
+
+def main(n):
+    text = fileio._dump_all([a.to_dict() for a in make_library(n)])
+    old = measure(DictArticle, text)
+    new = measure(Article, text)
+    print(f"{n} articles: dict-based {old / n:.0f} bytes/article, "
+          f"Article {new / n:.0f} bytes/article "
+          f"({100 * (1 - new / old):.0f}% less)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50_000)
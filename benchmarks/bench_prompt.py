@@ -0,0 +1,55 @@
+"""
+bench_prompt.py
+---------------
+
+Measures the latency of the command loop, by piping 1,000 trivial commands
+('pee') through peepPrompt.loop() and timing how long it takes to get through
+them. This is the overhead of showing the prompt and dispatching a command,
+which used to be at least 100 ms per command because of a fixed sleep
+(tests/test_prompt.py makes sure that it doesn't come back).
+
+    python benchmarks/bench_prompt.py [n_commands]
+"""
+
+import asyncio
+import io
+import sys
+from contextlib import redirect_stdout
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import time
+
+import prompt_toolkit as pt
+from prompt_toolkit.application import create_app_session
+from prompt_toolkit.input import create_pipe_input
+from prompt_toolkit.output import DummyOutput
+
+from cygnet import prompt
+from cygnet._shared import _g
+
+
+async def run(n):
+    with create_pipe_input() as pipe:
+        with create_app_session(input=pipe, output=DummyOutput()):
+            pmt = prompt.peepPrompt()
+            pmt.session = pt.PromptSession()
+            pipe.send_text("pee\n" * n + "q\n")
+            with redirect_stdout(io.StringIO()) as f:
+                now = time()
+                await pmt.loop()
+                elapsed = time() - now
+    # Check that every command really was run.
+    assert f.getvalue().count("zzzpee...") == n
+    return elapsed
+
+
+def main(n):
+    with TemporaryDirectory() as tmpdir:
+        _g.currentPath = Path(tmpdir)
+        elapsed = asyncio.run(run(n))
+    print(f"{n} commands: {elapsed:.3f} s, "
+          f"{elapsed / n * 1000:.2f} ms per command")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000)
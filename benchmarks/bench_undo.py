@@ -0,0 +1,90 @@
+"""
+bench_undo.py
+-------------
+
+Times saving history before a command and undoing it, on a synthetic
+library: deleting one article, and sorting the whole library. This is
+compared against deep copying the library, which is what saving history used
+to do. The memory held by the history for a sort is also measured.
+
+    python benchmarks/bench_undo.py [n_articles]
+"""
+
+import gc
+import io
+import sys
+import tracemalloc
+from contextlib import redirect_stdout
+from copy import deepcopy
+from time import time
+
+from cygnet import index
+from cygnet._shared import _g, _sort, _record, _saveHist, _clearHist, _undo
+from synthetic import make_library
+
+
+def delete_one():
+    # The same as cli_delete() does for one article.
+    article = _g.articleList[0]
+    _record("insert", 0, article)
+    del _g.articleList[0]
+    index.remove(article)
+
+
+def sort_all():
+    _sort.sort("year", reverse=True, set_mode=False)
+
+
+def timed_undo(command):
+    now = time()
+    _saveHist("bench", [])
+    command()
+    with redirect_stdout(io.StringIO()):
+        _undo()
+    return time() - now
+
+
+def timed_deepcopy():
+    now = time()
+    deepcopy(_g.articleList)
+    return time() - now
+
+
+def history_size(command):
+    _clearHist()
+    gc.collect()
+    tracemalloc.start()
+    _saveHist("bench", [])
+    command()
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    with redirect_stdout(io.StringIO()):
+        _undo()
+    return size
+
+
+def main(n):
+    _g.articleList = make_library(n)
+    index.rebuild(_g.articleList)
+    _sort.sort("time_added", set_mode=False)
+
+    copy_time = min(timed_deepcopy() for _ in range(3))
+    delete_time = min(timed_undo(delete_one) for _ in range(3))
+    sort_time = min(timed_undo(sort_all) for _ in range(3))
+    print(f"{n} articles: deepcopy {copy_time * 1000:.1f} ms, "
+          f"delete + undo {delete_time * 1000:.2f} ms, "
+          f"sort + undo {sort_time * 1000:.1f} ms")
+
+    gc.collect()
+    tracemalloc.start()
+    copied = deepcopy(_g.articleList)
+    copy_size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del copied
+    print(f"history per command: deepcopy {copy_size / 1e6:.2f} MB, "
+          f"sort {history_size(sort_all) / 1e6:.2f} MB")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000)
@@ -0,0 +1,55 @@
+"""
+bench_yaml.py
+-------------
+
+Compares reading and writing a synthetic library with the pure-Python PyYAML
+loader/dumper against the serialisation layer in fileio, which uses libyaml
+where possible.
+
+    python benchmarks/bench_yaml.py [n_articles]
+"""
+
+import sys
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import time
+
+import yaml
+
+from cygnet import fileio
+from synthetic import make_library
+
+
+def timed(fn, *args):
+    now = time()
+    rval = fn(*args)
+    return rval, time() - now
+
+
+def main(n):
+    article_dicts = [a.to_dict() for a in make_library(n)]
+    print(f"libyaml available: {fileio._CDumper is not None}, "
+          f"C dumper in use: {fileio._use_cdumper}")
+
+    py_text, py_dump = timed(yaml.dump_all, article_dicts)
+    c_text, c_dump = timed(fileio._dump_all, article_dicts)
+    print(f"dump ({n} articles): pure Python {py_dump:.3f} s, "
+          f"fileio {c_dump:.3f} s ({py_dump / c_dump:.1f}x)")
+    print(f"output byte-identical: {py_text == c_text}")
+
+    py_dicts, py_load = timed(lambda s: list(yaml.safe_load_all(s)), py_text)
+    c_dicts, c_load = timed(fileio._load_all, py_text)
+    print(f"load ({n} articles): pure Python {py_load:.3f} s, "
+          f"fileio {c_load:.3f} s ({py_load / c_load:.1f}x)")
+    print(f"loaded data identical: {py_dicts == c_dicts}")
+
+    with TemporaryDirectory() as tmpdir:
+        fname = Path(tmpdir) / "peep.yaml"
+        articles = [fileio.Article(**d) for d in article_dicts]
+        _, t_write = timed(fileio.write_articles, articles, fname)
+        _, t_read = timed(fileio.read_articles, fname)
+        print(f"write_articles: {t_write:.3f} s, read_articles: {t_read:.3f} s")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000)
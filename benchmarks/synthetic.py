@@ -0,0 +1,76 @@
+"""
+synthetic.py
+------------
+
+Generates synthetic libraries for the benchmarks in this folder.
+"""
+
+import random
+from datetime import datetime, timedelta, timezone
+
+from cygnet.cygcls import Article
+
+_journals = [
+    ("Journal of Magnetic Resonance", "J. Magn. Reson."),
+    ("The Journal of Chemical Physics", "J. Chem. Phys."),
+    ("Angewandte Chemie International Edition", "Angew. Chem. Int. Ed."),
+    ("Journal of the American Chemical Society", "J. Am. Chem. Soc."),
+    ("Chemical Physics Letters", "Chem. Phys. Lett."),
+    ("Progress in Nuclear Magnetic Resonance Spectroscopy",
+     "Prog. Nucl. Magn. Reson. Spectrosc."),
+    ("Nature Communications", "Nat. Commun."),
+    ("Magnetic Resonance in Chemistry", "Magn. Reson. Chem."),
+]
+_families = ["Yong", "Keeler", "Smith", "Müller", "Nilsson", "Morris",
+             "Foroozandeh", "Kupče", "Freeman", "Castañar", "Jeannerat",
+             "Parella", "Adams", "Bodenhausen", "Brown", "Ernst"]
+_givens = ["Jonathan R. J.", "James", "Mathias", "Gareth A.", "Ēriks",
+           "Jean-Baptiste", "Ray", "Laura", "Damien", "Teodor", "Ralph W.",
+           "Geoffrey", "Richard R.", "Steven P."]
+_words = ["pure", "shift", "NMR", "spectroscopy", "broadband", "homonuclear",
+          "decoupling", "fast", "acquisition", "multidimensional", "spin",
+          "relaxation", "diffusion", "β-lactam", "proteins", "small",
+          "molecules", "sensitivity", "enhanced", "selective", "excitation",
+          "J-coupling", "chirp", "pulses", "in", "of", "for", "with", "the"]
+
+
+def make_article(i, rng):
+    """
+    Makes one synthetic Article with DOI 10.5555/synthetic.{i}.
+    """
+    journal_long, journal_short = rng.choice(_journals)
+    time = (datetime(2015, 1, 1, tzinfo=timezone.utc)
+            + timedelta(minutes=rng.randint(0, 3_000_000)))
+    # Drawn in the order of the fields, which keeps the articles made from a
+    # given seed the same.
+    title = " ".join(rng.choice(_words)
+                     for _ in range(rng.randint(4, 20))).capitalize()
+    authors = [{"family": rng.choice(_families),
+                "given": rng.choice(_givens)}
+               for _ in range(rng.randint(1, 12))]
+    year = rng.randint(1970, 2020)
+    volume = rng.randint(1, 400)
+    issue = rng.choice([None, rng.randint(1, 24)])
+    first_page = rng.randint(1, 9000)
+    return Article(
+        title=title,
+        authors=authors,
+        journal_long=journal_long,
+        journal_short=journal_short,
+        year=year,
+        volume=volume,
+        issue=issue,
+        pages=f"{first_page}-{first_page + rng.randint(1, 20)}",
+        doi=f"10.5555/synthetic.{i}",
+        time_added=time,
+        time_opened=time + timedelta(minutes=rng.randint(0, 100_000)),
+    )
+
+
+def make_library(n, seed=0):
+    """
+    Makes a list of n synthetic Articles. The same seed always gives the same
+    library.
+    """
+    rng = random.Random(seed)
+    return [make_article(i, rng) for i in range(n)]
@@ -1,7 +1,9 @@
 __all__ = ["_g", "_sort", "_ret",
            "_helpdeco", "_timedeco",
            "_error", "_debug", "_p",
-           "_copy", "_saveHist", "_clearHist", "_undo",
+           "_copy", "_journal", "_record", "_saveHist", "_endHist",
+           "_clearHist",
+           "_undo",
            ]
 """
 This module stores all the global variables (state variables) as well
@@ -19,13 +21,14 @@ from enum import Enum
 from pathlib import Path
 from functools import wraps
 from time import time
-from copy import deepcopy
 from operator import itemgetter, attrgetter
 from collections import deque
+from array import array
 
 import aiohttp
 
 from ._version import __version__
+from . import index
 
 
 class _g():
@@ -38,11 +41,18 @@ class _g():
     previousPath = None
     # Changes made to articleList that haven't been autosaved.
     changes = []
-
-    # History which allows undo.
-    maxHistory = 5
-    articleListHistory = deque(maxlen=maxHistory)
-    cmdHistory = deque(maxlen=maxHistory)
+    # Journal records describing those changes (see _journal()). Autosave
+    # appends these to the journal file instead of rewriting peep.yaml.
+    journal = []
+
+    # History which allows undo. Each entry is a tuple of (command, list of
+    # undo records); see _record() for the format. Since only the changes are
+    # stored, not the whole articleList, many commands can be kept.
+    maxHistory = 100
+    history = deque(maxlen=maxHistory)
+    # The undo records of the command currently being run, or None if it
+    # isn't being recorded.
+    undoRecords = None
 
     # Default headers to use
     httpHeaders = {"user-agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_4) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/83.0.4103.61 Safari/537.36",
@@ -89,41 +99,6 @@ class _g():
     # System preferred encoding. Probably UTF-8.
     gpe = getpreferredencoding()
 
-    # Conversion of Unicode characters to LaTeX equivalents.
-    unicodeLatexDict = {
-        '\u00c0': '{\\`A}', '\u00c1': "{\\'A}", '\u00c2': '{\\^A}', '\u00c3': '{\\~A}',
-        '\u00c4': '{\\"A}', '\u00c5': '{\\AA}', '\u00c6': '{\\AE}', '\u00c7': '{\\cC}',
-        '\u00c8': '{\\`E}', '\u00c9': "{\\'E}", '\u00ca': '{\\^E}', '\u00cb': '{\\"E}',
-        '\u00cc': '{\\`I}', '\u00cd': "{\\'I}", '\u00ce': '{\\^I}', '\u00cf': '{\\"I}',
-        '\u00d0': '{\\DH}', '\u00d1': '{\\~N}', '\u00d2': '{\\`O}', '\u00d3': "{\\'O}",
-        '\u00d4': '{\\^O}', '\u00d5': '{\\~O}', '\u00d6': '{\\"O}', '\u00d7': '\\(\\times\\)',
-        '\u00d8': '{\\O}',  '\u00d9': '{\\`U}', '\u00da': "{\\'U}", '\u00db': '{\\^U}',
-        '\u00dc': '{\\"U}', '\u00dd': "{\\'Y}", '\u00de': '{\\TH}', '\u00df': '{\\ss}',
-
-        '\u00e0': '{\\`a}', '\u00e1': "{\\'a}", '\u00e2': '{\\^a}', '\u00e3': '{\\~a}',
-        '\u00e4': '{\\"a}', '\u00e5': '{\\aa}', '\u00e6': '{\\ae}', '\u00e7': '{\\cc}',
-        '\u00e8': '{\\`e}', '\u00e9': "{\\'e}", '\u00ea': '{\\^e}', '\u00eb': '{\\"e}',
-        '\u00ec': '{\\`i}', '\u00ed': "{\\'i}", '\u00ee': '{\\^i}', '\u00ef': '{\\"i}',
-        '\u00f0': '{\\dh}', '\u00f1': '{\\~n}', '\u00f2': '{\\`o}', '\u00f3': "{\\'o}",
-        '\u00f4': '{\\^o}', '\u00f5': '{\\~o}', '\u00f6': '{\\"o}', '\u00f7': '\\(\\div\\)',
-        '\u00f8': '{\\o}',  '\u00f9': '{\\`u}', '\u00fa': "{\\'u}", '\u00fb': '{\\^u}',
-        '\u00fc': '{\\"u}', '\u00fd': "{\\'y}", '\u00fe': '{\\th}', '\u00ff': '{\\"y}',
-
-        # Stray characters which I've needed but aren't systematically handled
-        # https://www.johndcook.com/unicode_latex.html is really useful
-        '\u0106': "{\\'C}",
-        '\u0107': "{\\'c}",
-        '\u010d': '{\\v{c}}',
-        '\u0112': '{\\=E}',
-        '\u0141': '{\\L{}}',
-        '\u0142': '{\\l{}}',
-        '\u0143': "{\\'N}",
-        '\u0144': "{\\'n}",
-        '\u2010': '-',
-        '\u2013': '--',
-        '\u2014': '---',
-    }
-
     # Convert Greek letters to Unicode.
     greek2Unicode = {
         "Alpha": "\u0391", "Beta": "\u0392", "Gamma": "\u0393", "Delta": "\u0394",
@@ -188,14 +163,21 @@ class _sort():
         if mode == "year":
             # Year alone isn't enough to distinguish: so we use a combination
             # of year, then journal title, then first author surname
-            _g.articleList.sort(key=lambda a: (a.year,
-                                               a.journal_long,
-                                               a.authors[0]["family"]),
-                                     reverse=reverse)
+            key = lambda a: (a.year, a.journal_long, a.authors[0].family)
         elif mode in ["time_opened", "time_added"]:
-            _g.articleList.sort(key=attrgetter(mode), reverse=reverse)
+            key = attrgetter(mode)
         else:
             raise ValueError(f"invalid sort mode '{mode}' given")
+        # Sort the positions rather than the articles, so that the old order
+        # can be recorded for undo.
+        articles = _g.articleList
+        order = sorted(range(len(articles)),
+                       key=lambda i: key(articles[i]), reverse=reverse)
+        if order != list(range(len(articles))):
+            articles[:] = [articles[i] for i in order]
+            order = array("I", order)
+            _record("order", order)
+            _journal("order", order)
         # Update the class attributes if necessary
         if set_mode:
             cls.mode, cls.reverse = mode, reverse
@@ -294,15 +276,64 @@ async def _copy(s):
         return _error("_copy: unsupported OS, not copied to clipboard")
 
 
+def _journal(*record):
+    """
+    Records a change to _g.articleList so that autosave can append it to the
+    journal. The possible records are:
+
+        ("put", doi, article)  - article replaces the article with the given
+                                 DOI, or is appended if there isn't one.
+        ("insert", i, article) - article is inserted at position i.
+        ("delete", doi)        - the article with the given DOI is removed.
+        ("order", order)       - _g.articleList was reordered, such that the
+                                 article at position j used to be at
+                                 position order[j].
+
+    DOIs are compared case-insensitively.
+    """
+    _g.journal.append(record)
+
+
+def _record(*record):
+    """
+    Records how to reverse a change to _g.articleList, so that the command
+    which made it can be undone. The possible records are:
+
+        ("insert", i, article) - article was removed from position i.
+        ("remove", i)          - an article was inserted at position i.
+        ("replace", i, old)    - the article at position i replaced old.
+        ("order", order)       - _g.articleList was reordered, such that the
+                                 article at position j used to be at
+                                 position order[j].
+
+    Articles are never modified in place, so the old ones don't need to be
+    copied.
+    """
+    if _g.undoRecords is not None:
+        _g.undoRecords.append(record)
+
+
 def _saveHist(cmd, args):
     """
-    Saves the articleList just before applying the command cmd.
+    Starts recording the changes made by the command cmd, so that it can be
+    undone. This must be called just before the command is run; the command
+    loop stops the recording once it has finished (see _endHist()).
     """
     cmd = cmd + " " + " ".join(args)
     if _g.debug is True:
         _debug("saving history before command {}".format(cmd))
-    _g.cmdHistory.append(cmd)
-    _g.articleListHistory.append(deepcopy(_g.articleList))
+    _g.undoRecords = []
+    _g.history.append((cmd, _g.undoRecords))
+
+
+def _endHist():
+    """
+    Stops recording changes, once a command has finished. This is done after
+    every command, whether or not it saved history or succeeded. The changes
+    already recorded stay in the history, so a command which failed partway
+    can still be undone.
+    """
+    _g.undoRecords = None
 
 
 def _clearHist():
@@ -310,20 +341,44 @@ def _clearHist():
     Wipes the history. To be done just before loading a new file.
     If we don't do that, weesa may be in big doo doo.
     """
-    _g.cmdHistory.clear()
-    _g.articleListHistory.clear()
+    _g.history.clear()
+    _g.undoRecords = None
 
 
 @_helpdeco
 def _undo():
     """
-    Tries to rewind history.
+    Tries to rewind history, by reversing the changes made by the last
+    command in the opposite order to which they were made.
     """
     try:
-        _g.articleList = _g.articleListHistory.pop()
-        _g.changes += ["undo"]
-        print("undid command: {}".format(_g.cmdHistory.pop()))
+        cmd, records = _g.history.pop()
     except IndexError:
         return _error("undo: no more history")
-    else:
-        return _ret.SUCCESS
+    _g.undoRecords = None
+    articles = _g.articleList
+    for record in reversed(records):
+        if record[0] == "insert":
+            _, i, article = record
+            articles.insert(i, article)
+            index.add(article)
+            _journal("insert", i, article)
+        elif record[0] == "remove":
+            article = articles.pop(record[1])
+            index.remove(article)
+            _journal("delete", article.doi)
+        elif record[0] == "replace":
+            _, i, old = record
+            new, articles[i] = articles[i], old
+            index.replace(new, old)
+            _journal("put", new.doi, old)
+        elif record[0] == "order":
+            # The inverse of the permutation puts everything back.
+            order = array("I", [0]) * len(articles)
+            for j, i in enumerate(record[1]):
+                order[i] = j
+            articles[:] = [articles[j] for j in order]
+            _journal("order", order)
+    _g.changes += ["undo"]
+    print("undid command: {}".format(cmd))
+    return _ret.SUCCESS
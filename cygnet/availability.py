@@ -0,0 +1,112 @@
+"""
+availability.py
+---------------
+
+Keeps track of which PDFs and SIs are stored in the database, so that listing
+articles doesn't have to check for every file separately (which is slow on
+network filesystems).
+
+Each folder is read with a single scan, and only scanned again once its
+modification time has changed; refresh() checks for this. Changes made by
+cygnet itself are recorded directly by changing(), so they don't cause a
+rescan.
+"""
+
+import os
+from contextlib import contextmanager
+
+from ._shared import *
+
+# The folders which have been scanned. Each folder (a Path) maps to a tuple of
+# (modification time of the folder when it was scanned, or None if it didn't
+# exist; set of the names of the files in it).
+_folders = {}
+
+
+def _mtime(folder):
+    try:
+        return os.stat(folder).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _scan(folder):
+    """
+    Reads the names of the files in a folder.
+
+    Returns:
+        The set of names.
+    """
+    # The time must be read before the folder is, so that anything which
+    # changes in between is picked up by the next refresh().
+    mtime = _mtime(folder)
+    names = set()
+    if mtime is not None:
+        try:
+            with os.scandir(folder) as entries:
+                names = {entry.name for entry in entries if entry.is_file()}
+        except OSError as e:
+            _debug(f"availability: could not scan {folder}: {str(e)}")
+    _folders[folder] = (mtime, names)
+    return names
+
+
+def refresh(dirname):
+    """
+    Scans the pdf and si folders of a database again if they have been
+    modified since they were last scanned. Commands which check the
+    availability of many files should call this first.
+    """
+    for folder in (dirname / "pdf", dirname / "si"):
+        if folder in _folders and _folders[folder][0] != _mtime(folder):
+            _scan(folder)
+
+
+def exists(fname):
+    """
+    Checks whether a file in the pdf or si folder exists.
+    """
+    folder = fname.parent
+    if folder in _folders:
+        names = _folders[folder][1]
+    else:
+        names = _scan(folder)
+    return fname.name in names
+
+
+@contextmanager
+def changing(*fnames):
+    """
+    Context manager for creating, removing, or renaming files in the pdf or
+    si folders, e.g.
+
+        with availability.changing(fname):
+            fname.unlink()
+
+    Afterwards, the files are checked and the names recorded for their
+    folders are updated, so that the change doesn't cause a rescan. If a
+    folder had already been changed by something else since it was last
+    scanned, it is scanned again when it is next needed instead, as that
+    change would otherwise never be picked up.
+    """
+    before = {fname.parent: _mtime(fname.parent) for fname in fnames}
+    try:
+        yield
+    finally:
+        for folder, mtime in before.items():
+            # If the folder hasn't been scanned yet, the files will be picked
+            # up when it is.
+            if folder not in _folders:
+                continue
+            old_mtime, names = _folders[folder]
+            if old_mtime != mtime:
+                del _folders[folder]
+                continue
+            for fname in fnames:
+                if fname.parent != folder:
+                    continue
+                if fname.is_file():
+                    names.add(fname.name)
+                else:
+                    names.discard(fname.name)
+            _folders[folder] = (_mtime(folder), names)
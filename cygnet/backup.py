@@ -7,19 +7,41 @@ Autosave and backup functions which try to make sure that changes are not lost.
 
 import asyncio
 import filecmp
+import shutil
 from pathlib import Path
 from datetime import datetime
 from operator import attrgetter
 
 from . import commands
 from . import fileio
+from . import shards
 from ._shared import *
 
 
+def save():
+    """
+    Saves the changes made to _g.articleList since it was last saved.
+
+    Wherever possible, the changes are appended to the journal (see
+    fileio.append_journal()) instead of writing the whole file again; the
+    file is only written in full if it doesn't exist yet.
+    """
+    fname = fileio.library_path(_g.currentPath)
+    if not fname.exists():
+        fileio.write_articles(_g.articleList, fname)
+    elif _g.journal:
+        fileio.append_journal(_g.journal, _g.articleList, fname)
+    _g.changes = []
+    _g.journal = []
+
+
 async def autosave():
     """
     Checks every interval seconds for changes. If changes have been made, saves
-    _g.articleList to _g.currentPath.
+    them to _g.currentPath.
+
+    The journal is compacted back into peep.yaml once it grows too big (see
+    fileio.append_journal()), as well as on exit.
     """
     interval = 2
     try:
@@ -29,13 +51,14 @@ async def autosave():
             if len(_g.articleList) != 0 and l != 0:
                 _debug(f"autosave: found {l} change{_p(l)}: "
                        f"{' '.join(_g.changes)}")
-                fileio.write_articles(_g.articleList, _g.currentPath / "peep.yaml")
+                save()
                 _debug("autosave complete")
-                _g.changes = []
     except asyncio.CancelledError:
         # If the program is quit, save one last time before exiting
         if len(_g.articleList) != 0:
-            fileio.write_articles(_g.articleList, _g.currentPath / "peep.yaml")
+            save()
+            fileio.compact(_g.articleList,
+                           fileio.library_path(_g.currentPath))
             _debug("exit save complete, exiting autosave task")
 
 
@@ -43,6 +66,10 @@ def create_backup():
     """
     Saves _g.articleList to the backups folder if it's different from the
     previous backup.
+
+    Sharded databases are backed up as sharded databases too. Shards which
+    are the same as in the previous backup are hard-linked to it, so only the
+    shards which changed take up any time or space.
     """
     max_backups = 5
 
@@ -56,23 +83,56 @@ def create_backup():
             backup_folder.mkdir()
         # Create the backup file
         now = datetime.now().strftime(".%y%m%d_%H%M%S")
-        backup_fname = backup_folder / (dbName + now)
-        fileio.write_articles(_g.articleList, backup_fname)
+        if fileio.library_path(_g.currentPath).suffix == ".shards":
+            backup_fname = backup_folder / (dbName + now + ".shards")
+            # Link unchanged shards to the most recent sharded backup
+            base = max((p for p in backup_folder.iterdir() if p.is_dir()),
+                       key=attrgetter('name'), default=None)
+            shards.write_articles(_g.articleList, backup_fname, base=base)
+        else:
+            backup_fname = backup_folder / (dbName + now)
+            fileio.write_articles(_g.articleList, backup_fname)
         _debug("created backup file")
 
         # Create list of all backup files; most recent is last
         backups = sorted([p for p in backup_folder.iterdir()],
                          key=attrgetter('name'))
+
         # Check if the new backup is identical to the previous one. If so, we
         # delete the newest one instead of the oldest one.
-        if len(backups) >= 2 and filecmp.cmp(backups[-1], backups[-2]):
+        if len(backups) >= 2 and _same_backup(backups[-1], backups[-2]):
             # They are the same, delete the newest one
-            backups[-1].unlink()
+            _delete_backup(backups[-1])
             backups.pop(-1)
             _debug("new backup is same, deleting it")
         # Otherwise, delete the oldest backup(s) until there are only
         # max_backups backup files.
         while len(backups) > max_backups:
             _debug(f"deleting old backup {backups[0]}")
-            backups[0].unlink()
+            _delete_backup(backups[0])
             backups.pop(0)
+
+
+def _same_backup(p, q):
+    """
+    Checks whether two backups are identical. For sharded backups, it's
+    enough to compare the manifests (which contain hashes of the shards) and
+    the orders.
+    """
+    if p.is_dir() and q.is_dir():
+        return all(filecmp.cmp(p / f, q / f, shallow=False)
+                   for f in ["manifest.yaml", "order"])
+    elif p.is_file() and q.is_file():
+        return filecmp.cmp(p, q)
+    else:
+        return False
+
+
+def _delete_backup(p):
+    """
+    Deletes a backup, which may be a file or a sharded backup folder.
+    """
+    if p.is_dir():
+        shutil.rmtree(p)
+    else:
+        p.unlink()
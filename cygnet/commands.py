@@ -12,7 +12,7 @@ import subprocess
 import shutil
 import asyncio
 from pathlib import Path
-from copy import deepcopy
+from copy import copy, deepcopy
 from datetime import datetime, timezone
 from tempfile import NamedTemporaryFile
 from operator import attrgetter
@@ -23,6 +23,10 @@ import prompt_toolkit as pt
 from . import fileio
 from . import listprint
 from . import backup
+from . import index
+from . import fulltext
+from . import query
+from . import availability
 from .cygcls import Article, DOI, Spinner
 from ._shared import *
 
@@ -39,7 +43,7 @@ def cli_cd(args):
     Description
     -----------
     Changes the current working directory to the given directory, then attempts
-    to read in a database from a peep.yaml file.
+    to read in a database from a peep.yaml (or peep.sqlite) file.
 
     When a new database is read in, the references will be sorted by year. The
     undo history will also be cleared.
@@ -68,26 +72,32 @@ def cli_cd(args):
         return
 
     # Otherwise, save the previous article list first (if there is any)
-    if _g.articleList and _g.currentPath and _g.changes != []:
-        _g.changes = []
-        fileio.write_articles(_g.articleList, _g.currentPath / "peep.yaml")
+    if _g.articleList and _g.currentPath:
+        if _g.changes != []:
+            backup.save()
+        fileio.compact(_g.articleList, fileio.library_path(_g.currentPath))
+    _g.changes = []
+    _g.journal = []
 
     # Change the path
     _g.previousPath, _g.currentPath = _g.currentPath, p.resolve()
 
     # Try to read in the yaml file, if it exists
+    fname = fileio.library_path(p)
     try:
-        new_articles = fileio.read_articles(p / "peep.yaml")
+        new_articles = fileio.read_articles(fname, cache=True)
     except yaml.YAMLError:
-        _error(f"cd: A peep.yaml file was found in {p}, "
-               "but it contained invalid YAML.")
+        _error(f"cd: A {fname.name} file was found in {p}, "
+               "but it contained invalid data.")
     except FileNotFoundError:
         # Clear out existing articles, if any
         _g.articleList = []
+        index.rebuild(_g.articleList)
     else:
         # Load those new articles
         _g.articleList = new_articles
-        backup.createBackup()
+        index.rebuild(_g.articleList)
+        backup.create_backup()
         _sort.sort()  # sort according to currently active mode
     finally:
         _clearHist()
@@ -101,20 +111,47 @@ def cli_write(args):
 
     Usage
     -----
-    w[rite]
+    w[rite] [format]
 
     Description
     -----------
     Saves the current database to the current working directory.
 
     Note that changes are automatically saved every few seconds. This means
-    that in practice the need for this function should not arise often.
+    that in practice the need for this function should not arise often. Any
+    changes which were autosaved to the journal (peep.journal) are merged
+    into peep.yaml.
+
+    If a format ('yaml', 'sqlite', or 'shards') is given, the database is
+    converted to that format instead, i.e. it is saved to peep.yaml,
+    peep.sqlite, or the peep.shards folder, and the file in the old format is
+    removed. SQLite and shards are better suited to very large databases, as
+    autosaving only needs to write the articles (or shards) which were
+    changed.
     """
-    if _g.articleList != []:
-        fileio.write_articles(_g.articleList, _g.currentPath / "peep.yaml")
-        _g.changes = []
-    else:
+    if _g.articleList == []:
         return _error("write: no articles loaded")
+
+    old_fname = fileio.library_path(_g.currentPath)
+    if args == []:
+        new_fname = old_fname
+    elif args[0] in ["yaml", "sqlite", "shards"]:
+        new_fname = _g.currentPath / f"peep.{args[0]}"
+    else:
+        return _error(f"write: invalid format '{args[0]}' given")
+
+    fileio.write_articles(_g.articleList, new_fname)
+    if new_fname != old_fname:
+        for fname in [old_fname,
+                      fileio.journal_path(old_fname),
+                      fileio.cache_path(old_fname)]:
+            if fname.is_dir():
+                shutil.rmtree(fname)
+            else:
+                fname.unlink(missing_ok=True)
+        print(f"write: converted {old_fname.name} to {new_fname.name}")
+    _g.changes = []
+    _g.journal = []
     return _ret.SUCCESS
 
 
@@ -136,10 +173,15 @@ def cli_list(args):
     Reference numbers may be specified as a comma- or space-separated series of
     integers or ranges (low-high, inclusive). For example, 'l 41-43' lists
     articles 41 through 43. 'l 4, 9, 21-24' lists articles 4, 9, and 21 through
-    24. 'all' can be used as a shortcut for every reference number.
+    24. 'all' can be used as a shortcut for every reference number. A DOI can
+    also be used in place of a reference number.
 
     By default, the list of authors in each article is truncated such that they
     occupy at most 5 lines. To prevent this behaviour, pass the "-l" flag.
+
+    Lists which don't fit in the terminal are shown in a scrollable view: use
+    j/k or the arrow keys to scroll, space/b to move by a page, g/G to go to
+    the top or bottom, and q to quit. The same applies to 'search'.
     """
     if _g.articleList == []:
         return _error("list: no articles found")
@@ -159,7 +201,7 @@ def cli_list(args):
         refnos = set(range(1, len(_g.articleList) + 1))
 
     # Pick out the desired references. No need to make a copy because
-    # print_list() does it for us.
+    # print_list() doesn't modify them.
     articles = [_g.articleList[r - 1] for r in refnos]
 
     # Now print it
@@ -176,7 +218,8 @@ def cli_search(args):
 
     Usage
     -----
-    s[earch] query[...]
+    s[earch] [--top N] query[...]
+    s[earch] -f word[...]
 
     Description
     -----------
@@ -189,34 +232,89 @@ def cli_search(args):
     ALL queries. If none are found, then will return a list of articles
     containing at least one of the queries.
 
+    The articles found are listed with the most relevant first: those in
+    which the words searched for are rarest in the library, appear most often,
+    and are in the authors rather than the title or journal. With '--top N',
+    only the N most relevant articles are listed. Searches which only use
+    regexes, years, or volumes list articles in the usual order.
+
+    A query starting with '~' is matched fuzzily, so that misspellings are
+    tolerated: for example, 's ~keelr' finds articles by Keeler.
+
+    Queries can also be restricted to one field, with 'author:', 'title:',
+    'journal:', 'doi:', 'year:' or 'volume:'. Years and volumes can be given
+    as ranges, and phrases can be quoted. Queries can be combined with AND,
+    OR and NOT, and grouped with parentheses. For example:
+
+        s author:keeler year:2015..2019 (journal:JMR OR journal:"Angew")
+        s "pure shift" NOT year:..2010
+
+    The same kind of query can be used to select articles in any command
+    which takes reference numbers, e.g. 'l author:keeler year:2019..'.
+
+    With the -f flag, searches the full text of the stored PDFs and SIs
+    instead, for files containing all of the given words. Matching files are
+    listed together with a snippet of the text around the first word. The
+    text of new PDFs is extracted in the background, so PDFs which were only
+    just added may not be found yet.
+
     VERY crude.
     """
+    if _g.articleList == []:
+        return _error("search: no articles have been loaded")
+    if "-f" in args:
+        return _search_fulltext([arg for arg in args if arg != "-f"])
     result_flag = "NONE"   # means no articles were found.
 
-    # the arguments are entered by the user. We use re.compile() to turn them
-    # into regexes.
-    queries = [re.compile(arg, flags=re.IGNORECASE) for arg in args]
-    found_refnos = []
-    for refno, article in enumerate(_g.articleList, start=1):
-        if all(article.search(*queries)):
-            # all queries were found.
-            found_refnos.append(refno)
-            result_flag = "ALL"
-            # means articles were found matching all queries
-
-    if found_refnos == [] and len(queries) > 1:
+    # Check for the --top option
+    top = None
+    if "--top" in args:
+        i = args.index("--top")
+        try:
+            top = int(args[i + 1])
+        except (IndexError, ValueError):
+            return _error("search: --top must be followed by a number")
+        if top < 1:
+            return _error("search: --top must be followed by a positive"
+                          " number")
+        args = args[:i] + args[i + 2:]
+
+    try:
+        node = query.parse(args)
+    except ValueError as e:
+        return _error(f"search: {str(e)}")
+    # The top-level queries, for the fallback below.
+    if node is None:
+        queries = []
+    elif isinstance(node, query.And) and node.implicit:
+        queries = node.children
+    else:
+        queries = [node]
+    found = _run_query(node)
+    if found:
+        result_flag = "ALL"   # means articles were found matching all queries
+    elif len(queries) > 1:
         # loosen search criteria. Just look for at least one query, instead of
         # all.
-        for refno, article in enumerate(_g.articleList, start=1):
-            if any(article.search(*queries)):
-                found_refnos.append(refno)
-                result_flag = "ANY"
-                # means articles were found matching at least one query
+        found = set.union(*(_run_query(q) for q in queries))
+        if found:
+            result_flag = "ANY"
+            # means articles were found matching at least one query
+    found_refnos = [refno for refno, article in enumerate(_g.articleList,
+                                                          start=1)
+                    if id(article) in found]
+    # Rank the results. sort() is stable, so equally relevant articles stay
+    # in the usual order.
+    scores = query.rank(node, [_g.articleList[r - 1] for r in found_refnos])
+    if scores is not None:
+        found_refnos.sort(
+            key=lambda r: -scores[id(_g.articleList[r - 1])])
+    shown_refnos = found_refnos[:top]
 
     # if any articles were found...
-    if len(found_refnos) > 0:
-        found_articles = [_g.articleList[r - 1] for r in found_refnos]
-        listprint.print_list(found_articles, found_refnos, max_auth=0)
+    if len(shown_refnos) > 0:
+        found_articles = [_g.articleList[r - 1] for r in shown_refnos]
+        listprint.print_list(found_articles, shown_refnos, max_auth=0)
     # let the user know accordingly
     if result_flag == "NONE":
         print(f"{_g.ansiTitleBlue}search: no articles matching the search"
@@ -233,6 +331,80 @@ def cli_search(args):
         print(f"{_g.ansiTitleBlue}search: {len(found_refnos)}"
               f" article{_p(found_refnos)} matching the search query"
               f" {_p(found_refnos, 'was', 'were')} found{_g.ansiReset}")
+    if len(shown_refnos) < len(found_refnos):
+        print(f"{_g.ansiTitleBlue}search: showing the {len(shown_refnos)}"
+              f" most relevant{_g.ansiReset}")
+
+
+def _run_query(node):
+    """
+    Finds the articles in _g.articleList which match a query (see query.py).
+    If node is None, all articles match.
+
+    Returns:
+        The set of ids of the matching articles.
+    """
+    if node is None:
+        return {id(article) for article in _g.articleList}
+    # The haystacks are persisted between sessions, as computing them is
+    # most of the cost of building the indexes. Only the articles which were
+    # added since the last search need to be looked at.
+    fname = fileio.library_path(_g.currentPath)
+    unread = index.haystacks.unread()
+    if unread:
+        index.haystacks.saved(fileio.read_haystacks(unread, fname))
+    result = query.run(node, _g.articleList)
+    new = index.haystacks.unsaved()
+    if new:
+        try:
+            fileio.write_haystacks(new, fname)
+        except OSError as e:
+            _debug(f"search: could not save haystacks: {str(e)}")
+        else:
+            index.haystacks.saved(new)
+    return result
+
+
+def _search_fulltext(args):
+    """
+    Does the full-text search for cli_search().
+    """
+    if args == []:
+        return _error("search: no words to search for")
+    results = []
+    refnos = None
+    found, pending = fulltext.search(_g.currentPath, " ".join(args))
+    for name, snippet in found:
+        # Ignore PDFs which don't belong to any article.
+        article = index.dois.get(fulltext.doi_of(name))
+        if article is not None:
+            if refnos is None:
+                refnos = _refno_map()
+            results.append((refnos[id(article)], name.split("/")[0],
+                            snippet))
+    results.sort()
+
+    last = None
+    for refno, fmt, snippet in results:
+        if refno != last:
+            article = _g.articleList[refno - 1]
+            print(f"{_g.ansiBold}({refno}) {article.authors[0].family} "
+                  f"{article.year}:{_g.ansiReset} {article.title}")
+            last = refno
+        print(f"    {fmt.upper()}: ...{snippet}...")
+    refnos = sorted(set(r for r, _, _ in results))
+    if refnos == []:
+        print(f"{_g.ansiTitleBlue}search: no PDFs containing the search"
+              f" words were found{_g.ansiReset}")
+    else:
+        print(f"{_g.ansiTitleBlue}search: {len(refnos)}"
+              f" article{_p(refnos)} with PDFs containing the search words"
+              f" {_p(refnos, 'was', 'were')} found{_g.ansiReset}")
+    if pending:
+        print(f"{_g.ansiTitleBlue}search: {pending} PDF{_p(pending)}"
+              f" {_p(pending, 'is', 'are')} still being indexed and"
+              f" {_p(pending, 'was', 'were')} not searched{_g.ansiReset}")
+    return _ret.SUCCESS
 
 
 @_helpdeco
@@ -310,8 +482,15 @@ def cli_open(args):
                 no += 1
             else:
                 yes += 1
-                # Update time opened of article.
-                article.time_opened = datetime.now(timezone.utc)
+                # Update time opened of article. Articles in the list are
+                # replaced instead of modified, as the undo history may refer
+                # to the old one. Opening an article can't be undone, though.
+                opened = copy(article)
+                opened.time_opened = datetime.now(timezone.utc)
+                _g.articleList[refno - 1] = opened
+                index.replace(article, opened)
+                _journal("put", article.doi, opened)
+                article = opened
 
     print(f"open: {yes} references opened, {no} failed")
     _g.changes += ["open"] * yes
@@ -376,9 +555,14 @@ async def cli_cite(args):
     if formats == []:
         formats = ['b']
 
+    # Citations are cached on the articles, and persisted between sessions.
+    articles = [_g.articleList[refno - 1] for refno in refnos]
+    fname = fileio.library_path(_g.currentPath)
+    fileio.read_citations(articles, fname)
+    ncached = [len(article._citations) for article in articles]
+
     cite_list = []
-    for refno in refnos:
-        article = _g.articleList[refno - 1]
+    for article in articles:
         for format in formats:
             try:
                 citation = article.to_citation(format)
@@ -388,6 +572,14 @@ async def cli_cite(args):
             else:
                 cite_list.append(citation)
 
+    new = [article for article, n in zip(articles, ncached)
+           if len(article._citations) > n]
+    if new:
+        try:
+            fileio.write_citations(new, fname)
+        except OSError as e:
+            _debug(f"cite: could not save citations: {str(e)}")
+
     citations = "\n\n".join(cite_list)
     if citations.strip() != "":
         print(citations)
@@ -453,8 +645,12 @@ def cli_edit(args):
             new_fnames = [edited_article.to_fname(t) for t in types]
             for old_fname, new_fname in zip(old_fnames, new_fnames):
                 if old_fname.is_file():
-                    old_fname.rename(new_fname)
+                    with availability.changing(old_fname, new_fname):
+                        old_fname.rename(new_fname)
             # Ok, now we can replace it
+            _journal("put", _g.articleList[refno - 1].doi, edited_article)
+            _record("replace", refno - 1, _g.articleList[refno - 1])
+            index.replace(_g.articleList[refno - 1], edited_article)
             _g.articleList[refno - 1] = edited_article
             _g.changes += ["edit"]
         return _ret.SUCCESS
@@ -487,12 +683,8 @@ async def cli_add(args):
     # Check if any are already in the library
     dois = []
     for doi in args:
-        found = False
-        for refno, article in enumerate(_g.articleList, start=1):
-            if doi == article.doi:
-                found = True
-                break
-        if found:
+        if doi in index.dois:
+            refno = _refno_of(index.dois.get(doi))
             _error(f"add: DOI '{doi}' already in library.\n"
                    f"            Use 'u[pdate] {refno}' to refresh metadata.")
             no += 1
@@ -530,7 +722,10 @@ async def cli_add(args):
             except (EOFError, KeyboardInterrupt):
                 ans = "no"
             if ans.strip().lower() in ["", "y", "yes"]:
+                _record("remove", len(_g.articleList))
                 _g.articleList.append(article)
+                index.add(article)
+                _journal("put", article.doi, article)
                 print(f"add: added DOI {article.doi}")
                 yes += 1
             else:
@@ -679,7 +874,10 @@ async def cli_update(args):
             except (EOFError, KeyboardInterrupt):
                 ans = "no"
             if ans.strip().lower() in ["", "y", "yes"]:
+                _record("replace", refno - 1, old_article)
                 _g.articleList[refno - 1] = new_article
+                index.replace(old_article, new_article)
+                _journal("put", old_article.doi, new_article)
                 print(f"update: ref {refno}: successfully updated")
                 yes += 1
             else:  # ok, it isn't really (y/n), it's (y/not y)
@@ -734,9 +932,13 @@ async def cli_delete(args):
             # Delete the PDFs first
             pdf_paths = [article.to_fname(type) for type in ("pdf", "si")]
             for pdf in pdf_paths:
-                pdf.unlink(missing_ok=True)
+                with availability.changing(pdf):
+                    pdf.unlink(missing_ok=True)
             # Then delete the article
+            _record("insert", refno - 1, article)
             del _g.articleList[refno - 1]
+            index.remove(article)
+            _journal("delete", article.doi)
             yes += 1
         print(f"delete: {yes} ref{_p(yes)} deleted")
         _g.changes += ["delete"] * yes
@@ -787,12 +989,11 @@ async def cli_import(args=None):
             doi = doi.doi
             print(f"import: detected DOI {doi} for PDF '{file}'")
             # Check whether it's already in the database
-            for refno, article in enumerate(_g.articleList, start=1):
-                if doi == article.doi:
-                    _error(f"import: DOI {doi} already in database. Use 'ap "
-                           f"{refno}' to associate this PDF with it.")
-                    no += 1
-                    break
+            if doi in index.dois:
+                refno = _refno_of(index.dois.get(doi))
+                _error(f"import: DOI {doi} already in database. Use 'ap "
+                       f"{refno}' to associate this PDF with it.")
+                no += 1
             else:
                 # Prompt user whether they want to add it
                 # The fastest way is to call cli_add.
@@ -806,7 +1007,8 @@ async def cli_import(args=None):
                     # mkdir -p the folder if it doesn't already exist.
                     if not pdest.parent.exists():
                         pdest.parent.mkdir(parents=True)
-                    shutil.copy2(psrc, pdest)
+                    with availability.changing(pdest):
+                        shutil.copy2(psrc, pdest)
     # Trigger autosave
     _g.changes += ["import"] * yes
     return yes, no
@@ -856,6 +1058,7 @@ async def cli_addpdf(args):
     for k, v in abbrevs.items():
         if v in formats:
             long_formats.append(k)
+    availability.refresh(_g.currentPath)
 
     yes, no = 0, 0
     # We wrap the whole thing in try/except to catch Ctrl-C, which will get us
@@ -869,14 +1072,13 @@ async def cli_addpdf(args):
                 print()  # Just a bit easier to read.
             # Print the header to tell the user which article they're adding
             # to, as well as whether the PDFs are already available.
-            print(f"{_g.ansiBold}({r}) {article.authors[0]['family']} "
+            print(f"{_g.ansiBold}({r}) {article.authors[0].family} "
                   f"{article.year}:{_g.ansiReset} {article.title}", end="   ")
-            availability = article.get_availability()
             print(article.get_availability_string())
 
             style = pt.styles.Style.from_dict({"prompt": _g.ptBlue,
                                                "": _g.ptGreen})
-            for fmt, avail in zip(["pdf", "si"], availability):
+            for fmt, avail in zip(["pdf", "si"], article.get_availability()):
                 # Check whether the format was requested
                 if fmt not in long_formats:
                     continue
@@ -953,7 +1155,8 @@ async def cli_deletepdf(args):
             fname = article.to_fname(f)
             if fname.exists():
                 yes += 1
-                fname.unlink()
+                with availability.changing(fname):
+                    fname.unlink()
     print(f"deletepdf: {yes} files deleted")
     return _ret.SUCCESS
 
@@ -1075,6 +1278,9 @@ def parse_refnos(args):
           "all"    -> every refno in the full article list
           "last"   -> the most recently opened reference
           "latest" -> the most recently opened reference
+          a DOI    -> the reference with that DOI, e.g. '10.1002/anie.201915278'
+          a query  -> every reference matching it (see cli_search()), e.g.
+                      ['author:keeler', 'year:2015..']
 
     Used by cli_list().
 
@@ -1090,6 +1296,16 @@ def parse_refnos(args):
     # make sure that it's split by all commas.
     s = ','.join(args)
     strs = s.split(",")
+    # Queries have to be parsed as a whole.
+    if args and query.selection_length(args) > 0:
+        try:
+            found = _run_query(query.parse(args))
+        except ValueError as e:
+            raise ArgumentError(str(e))
+        if not found:
+            raise ArgumentError(f"no articles matching {' '.join(args)}")
+        return [refno for refno, article in enumerate(_g.articleList, start=1)
+                if id(article) in found]
     # The easy way out
     if strs == ["all"]:
         return set(range(1, len(_g.articleList) + 1))
@@ -1102,11 +1318,19 @@ def parse_refnos(args):
         return {argmax}
     # Otherwise we've got to parse it.
     refnos = set()   # to avoid duplicates
+    doi_refnos = None
     try:
         for i in strs:
             if i == "":
                 continue
-            if "-" in i:
+            if _is_doi(i):
+                article = index.dois.get(i)
+                if article is None:
+                    raise ArgumentError(f"no article with DOI {i}")
+                if doi_refnos is None:
+                    doi_refnos = _refno_map()
+                refnos.add(doi_refnos[id(article)])
+            elif "-" in i:
                 # Parse the range.
                 rmin, rmax = i.split("-")   # ValueError if too many entries
                 rmin = int(rmin)
@@ -1130,6 +1354,33 @@ def parse_refnos(args):
     return list(refnos)
 
 
+def _is_doi(s):
+    """
+    Checks whether a string looks like a DOI (rather than a refno).
+    """
+    return s.startswith("10.") and "/" in s
+
+
+def _refno_of(article):
+    """
+    Returns the refno of an article in _g.articleList, or None if it isn't
+    there. Articles are compared by identity, which is much faster than ==.
+    """
+    for refno, a in enumerate(_g.articleList, start=1):
+        if a is article:
+            return refno
+    return None
+
+
+def _refno_map():
+    """
+    Returns a dictionary mapping id(article) to the refno of each article in
+    _g.articleList. Commands which need the refnos of many articles should
+    build this once instead of calling _refno_of() for each of them.
+    """
+    return {id(a): refno for refno, a in enumerate(_g.articleList, start=1)}
+
+
 def parse_formats(args, abbrevs=None):
     """
     Parses command-line arguments as a series of formats.
@@ -1187,6 +1438,17 @@ def parse_refnos_formats(args, abbrevs=None):
     if args[0] in ["all", "last", "latest"]:
         arg_refno = args[:1]
         arg_format = args[1:]
+    # So do queries, which may contain letters
+    elif query.selection_length(args) > 0:
+        x = query.selection_length(args)
+        arg_refno = args[:x]
+        arg_format = args[x:]
+    # DOIs contain letters, so they have to be picked out as whole arguments
+    elif _is_doi(args[0]):
+        x = next((i for i, arg in enumerate(args) if not _is_doi(arg)),
+                 len(args))
+        arg_refno = args[:x]
+        arg_format = args[x:]
     # Otherwise we have to do it the proper way
     else:
         # Preprocess args
@@ -15,19 +15,77 @@ from pathlib import Path
 from unicodedata import normalize
 from operator import attrgetter
 from itertools import cycle
+from collections import namedtuple
 
 import aiohttp
 from unidecode import unidecode
 
+from . import latex
+from . import availability
 from ._shared import *
 
 
+class Author(namedtuple("Author", ("family", "given"), defaults=(None,))):
+    """
+    An author of an article. This is immutable, and much smaller than the
+    {"family": ..., "given": ...} dictionaries which are stored on disk.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_dict(cls, d):
+        """
+        Creates an Author from a dictionary with the keys "family" and
+        (optionally) "given", or from another Author. Family names are
+        interned, since the same names crop up over and over again in a large
+        database.
+
+        Raises
+        ------
+        TypeError if the dictionary contains other keys.
+        """
+        author = d if isinstance(d, cls) else cls(**d)
+        if isinstance(author.family, str):
+            author = author._replace(family=sys.intern(author.family))
+        return author
+
+    def to_dict(self):
+        """
+        Returns the author as a dictionary, in the form stored on disk.
+        """
+        if self.given is None:
+            return {"family": self.family}
+        return {"family": self.family, "given": self.given}
+
+
 class Article():
+    # The attributes which are saved to disk.
+    _fields = ("title", "authors", "journal_long", "journal_short", "year",
+               "volume", "issue", "pages", "doi", "time_added", "time_opened")
+    # The fields which the values cached in _derived are computed from.
+    _derived_from = ("authors", "journal_long", "journal_short", "title",
+                     "volume", "issue", "pages")
+    # The fields which citations are made from.
+    _cited_from = ("title", "authors", "journal_long", "journal_short",
+                   "year", "volume", "issue", "pages", "doi")
+    # _shard and _shard_index are only used by shards.py.
+    __slots__ = _fields + ("_fragment", "_derived", "_citations", "_shard",
+                           "_shard_index")
+
     def __init__(self, title=None, authors=None,
                  journal_long=None, journal_short=None,
                  year=None, volume=None, issue=None,
                  pages=None, doi=None,
                  time_added=None, time_opened=None):
+        # Cached YAML serialisation of the article, used by
+        # fileio.write_articles(). None means that it needs to be regenerated.
+        self._fragment = None
+        # Cached results of format_authors(), format_short_journalname(), and
+        # make_haystack(), keyed by style. None means that nothing has been
+        # cached yet.
+        self._derived = None
+        # Cached citations, keyed by type (see to_citation()).
+        self._citations = None
         self.title = title
         self.authors = authors
         self.journal_long = journal_long
@@ -40,6 +98,53 @@ class Article():
         self.time_added = time_added
         self.time_opened = time_opened
 
+    def __setattr__(self, name, value):
+        # Authors are stored as a tuple of Author records, and journal names
+        # are interned, to keep large databases small in memory.
+        if name == "authors" and value is not None:
+            value = tuple(Author.from_dict(author) for author in value)
+        elif name in ("journal_long", "journal_short") and isinstance(value,
+                                                                      str):
+            value = sys.intern(value)
+        # Any change to the metadata makes the cached YAML out of date.
+        # Note that this doesn't catch in-place modifications; Articles should
+        # be replaced wholesale instead.
+        super().__setattr__(name, value)
+        if name in self._fields:
+            super().__setattr__("_fragment", None)
+            if name in self._derived_from:
+                super().__setattr__("_derived", None)
+            if name in self._cited_from:
+                super().__setattr__("_citations", None)
+
+    def __getstate__(self):
+        # Articles have no __dict__, so copy and pickle need this. Slots which
+        # were never set are left out.
+        state = {}
+        for cls in type(self).__mro__:
+            for name in getattr(cls, "__slots__", ()):
+                try:
+                    state[name] = object.__getattribute__(self, name)
+                except AttributeError:
+                    pass
+        return state
+
+    def __copy__(self):
+        # The cached values are still valid for the copy, but it gets its own
+        # dictionaries of them, so that the two don't share any state.
+        new = type(self).__new__(type(self))
+        new.__setstate__(self.__getstate__())
+        for name in ("_derived", "_citations"):
+            value = object.__getattribute__(new, name)
+            if value is not None:
+                object.__setattr__(new, name, dict(value))
+        return new
+
+    def __setstate__(self, state):
+        # Bypasses __setattr__(), which would throw away the cached values.
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
+
     def __eq__(self, other):
         if not isinstance(other, Article):
             return NotImplemented
@@ -55,6 +160,37 @@ class Article():
                 and self.pages == other.pages
                 and self.doi == other.doi)
 
+    def to_dict(self):
+        """
+        Returns the metadata of the article as a dictionary, suitable for
+        serialisation. Article(**article.to_dict()) gives back an equivalent
+        Article.
+        """
+        d = {field: getattr(self, field) for field in self._fields}
+        if self.authors is not None:
+            d["authors"] = [author.to_dict() for author in self.authors]
+        return d
+
+    def _memo(self, key, compute):
+        """
+        Returns the cached value for key, calling compute() to calculate it if
+        it hasn't been cached yet. See _derived_from for what can be cached.
+        """
+        if self._derived is None:
+            super().__setattr__("_derived", {})
+        try:
+            return self._derived[key]
+        except KeyError:
+            value = self._derived[key] = compute()
+            return value
+
+    def _cached(self, key):
+        """
+        Returns the value cached by _memo() for key, or None if there isn't
+        one.
+        """
+        return self._derived.get(key) if self._derived else None
+
     def format_authors(self, style):
         """
         Convert author names to a suitable format.
@@ -72,7 +208,8 @@ class Article():
         Returns
         -------
         A list of appropriately formatted strings, one for each author, or None
-        if self.authors is None.
+        if self.authors is None. The result is cached until the authors
+        change.
         """
         def format_one_author(author, style):
             """
@@ -81,32 +218,35 @@ class Article():
             # Check If there's no given name.
             # We should probably try to handle the no family name case, but
             # I'm not sure when we will actually come across an example...
-            if "given" not in author or author["given"] == []:
-                return author["family"]
+            if not author.given:
+                return author.family
             # Otherwise...
-            family_name = author["family"]
-            given_names = author["given"]
+            family_name = author.family
+            given_names = author.given
             if style == "display":
                 return ("".join(n[0] for n in re.split(r"[\s-]", given_names))
-                        + " " + author["family"])
+                        + " " + author.family)
             elif style == "acs":
                 # "Jean-Baptiste Simon" -> [["Jean", "Baptiste"], ["Simon"]]
                 split_both = [name.split('-') for name in given_names.split()]
                 # [["Jean", "Baptiste"], ["Simon"]] -> "J.-B. S"
                 joined_both = ". ".join([".-".join(n[0] for n in names)][0]
                                          for names in split_both)
-                return (author["family"] + ", " + joined_both + ".")
+                return (author.family + ", " + joined_both + ".")
             elif style == "bib":
-                s = author["family"] + ", " + author["given"]
+                s = author.family + ", " + author.given
                 return s.replace(". ", ".\\ ")  # Must use control spaces
             elif style == "full":
-                return author["given"] + " " + author["family"]
+                return author.given + " " + author.family
             # Otherwise, grumble.
             else:
                 raise ValueError(f"Invalid value '{style}' for style.")
 
         if self.authors is not None:
-            return [format_one_author(author, style) for author in self.authors]
+            return list(self._memo(
+                ("authors", style),
+                lambda: tuple(format_one_author(author, style)
+                              for author in self.authors)))
 
     def format_short_journalname(self):
         """
@@ -116,16 +256,20 @@ class Article():
 
         Returns
         -------
-        A string with the shortest possible form.
+        A string with the shortest possible form. This is cached until the
+        short journal name changes.
         """
         abbrevs = {
             "Nucl Magn Reson": "NMR",
         }
 
-        name = self.journal_short.replace(".", "")
-        for long, short in abbrevs.items():
-            name = name.replace(long, short)
-        return name
+        def shorten():
+            name = self.journal_short.replace(".", "")
+            for long, short in abbrevs.items():
+                name = name.replace(long, short)
+            return name
+
+        return self._memo("short_journalname", shorten)
 
     def get_volume_info(self):
         """
@@ -144,13 +288,16 @@ class Article():
 
     def get_availability(self):
         """
-        Checks whether the PDF and SI are available for a given article.
+        Checks whether the PDF and SI are available for a given article. This
+        uses the contents of the pdf and si folders as they were last scanned
+        (see availability.py).
 
         Returns
         -------
         List of (bool, bool) corresponding to PDF and SI availability.
         """
-        return [self.to_fname(type).is_file() for type in ("pdf", "si")]
+        return [availability.exists(self.to_fname(type))
+                for type in ("pdf", "si")]
 
     def get_availability_string(self):
         """
@@ -204,7 +351,20 @@ class Article():
 
         Returns
         -------
-        The citation as a string.
+        The citation as a string. This is cached until the article's metadata
+        changes.
+        """
+        if self._citations is None:
+            super().__setattr__("_citations", {})
+        try:
+            return self._citations[type]
+        except KeyError:
+            citation = self._citations[type] = self._make_citation(type)
+            return citation
+
+    def _make_citation(self, type):
+        """
+        Does the actual work for to_citation().
         """
         acs_authors = "; ".join(self.format_authors("acs"))
         # Some articles don't come with pages. :-(
@@ -221,7 +381,7 @@ class Article():
         # BibLaTeX
         if type in ["bib", "b"]:
             # Create (hopefully) unique identifier
-            author_decoded = unidecode(self.authors[0]["family"])
+            author_decoded = unidecode(self.authors[0].family)
             journal_initials = "".join(c for c in self.journal_short
                                        if c.isupper())
             ref_identifier = f"{author_decoded}{self.year}{journal_initials}"
@@ -248,9 +408,7 @@ class Article():
                 s += f"    pages = {{{self.pages.replace('-', '--')}}},\n"
             s += close
             # Replace Unicode characters with their LaTeX equivalents
-            for char in _g.unicodeLatexDict:
-                s = s.replace(char, _g.unicodeLatexDict[char])
-            return s
+            return latex.encode(s)
 
         # Just DOI
         if type in ["doi", "d"]:
@@ -322,7 +480,7 @@ class Article():
             return 0
 
         # Compare all attributes except for time added and opened
-        attribs = sorted(set(vars(self)) - {"time_added", "time_opened"})
+        attribs = sorted(set(self._fields) - {"time_added", "time_opened"})
         # Get field width (for pretty printing)
         maxlen = max(len(attrib) for attrib in attribs)
         # Check individual keys
@@ -402,7 +560,8 @@ class Article():
             if not psrc.is_file():
                 return _error("The specified PDF was not found.")
             else:
-                shutil.copy2(psrc, pdest)
+                with availability.changing(pdest):
+                    shutil.copy2(psrc, pdest)
 
         # Downloading a file...
         if src_type == "url":
@@ -457,15 +616,16 @@ class Article():
                                        total=total,
                                        units="MB", fstr="{:.2f}") as spinner:
                         # Stream the content directly into pdest
-                        with open(pdest, "wb") as fp:
-                            chunk_size = 2048   # bytes
-                            while True:  # good argument for := here
-                                chunk = await resp.content.read(chunk_size)
-                                if not chunk:
-                                    break
-                                fp.write(chunk)
-                                if filesize is not None:
-                                    spinner.increment(chunk_size/(2**20))
+                        with availability.changing(pdest):
+                            with open(pdest, "wb") as fp:
+                                chunk_size = 2048   # bytes
+                                while True:  # good argument for := here
+                                    chunk = await resp.content.read(chunk_size)
+                                    if not chunk:
+                                        break
+                                    fp.write(chunk)
+                                    if filesize is not None:
+                                        spinner.increment(chunk_size/(2**20))
             except aiohttp.client_exceptions.InvalidURL:
                 return _error(f"Invalid URL {psrc} provided.")
             except aiohttp.ClientResponseError as e:
@@ -481,14 +641,18 @@ class Article():
     def make_haystack(self):
         """
         Returns a list of strings to use in searching. See search() for the
-        implementation.
+        implementation. The result is cached until the article changes.
         """
-        journal_data = [" ".join(self.format_authors(style="full")),
-                        self.journal_long,
-                        self.journal_short,
-                        "".join(c for c in self.journal_short if c.isupper()),
-                        self.title]
-        return [unidecode(data) for data in journal_data]
+        def haystack():
+            journal_data = [" ".join(self.format_authors(style="full")),
+                            self.journal_long,
+                            self.journal_short,
+                            "".join(c for c in self.journal_short
+                                    if c.isupper()),
+                            self.title]
+            return tuple(unidecode(data) for data in journal_data)
+
+        return list(self._memo("haystack", haystack))
 
     def search(self, *queries):
         """
@@ -565,8 +729,8 @@ class DOI():
             d = d["message"]    # avoid repeating this subscript many times
             # Minor hack to convert 'J.R.J.' to 'J. R. J.'.
             # The alternative involves re.split(), I think that's overkill.
-            article.authors = [{"family": normalize("NFKC", auth["family"]),
-                                "given": normalize("NFKC", auth["given"].replace(". ", ".").replace(".",". ").rstrip())}
+            article.authors = [Author(normalize("NFKC", auth["family"]),
+                                      normalize("NFKC", auth["given"].replace(". ", ".").replace(".",". ").rstrip()))
                                for auth in d["author"]]
             article.year = int(d["published-print"]["date-parts"][0][0]) \
                 if "published-print" in d \
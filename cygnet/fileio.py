@@ -3,43 +3,231 @@ fileio.py
 ---------
 
 Functions involving reading / writing to a file.
+
+The library is normally stored in peep.yaml, which is handled here. The other
+storage formats live in their own modules, which each provide the same three
+functions:
+
+    read_articles(fname)                    - read all the articles, in order
+    write_articles(articles, fname)         - replace the whole contents
+    append_journal(records, articles, fname)
+                                            - save the changes described by
+                                              journal records (see _journal())
+
+fileio's own read_articles(), write_articles(), and append_journal() pick the
+module from the suffix of the file (see _backends), so the rest of the
+programme doesn't need to know about them.
 """
 
+import json
+import hashlib
+import sqlite3
+from contextlib import closing
 from pathlib import Path
+from time import time
+from datetime import datetime, timezone
+from itertools import groupby
 
 import yaml
 
+from . import sqlstore
+from . import shards
 from .cygcls import Article
+from ._shared import *
+
+# The modules which handle storage formats other than YAML, by suffix.
+_backends = {".sqlite": sqlstore,
+             ".shards": shards}
+
+# Version of the snapshot cache format. This must be incremented whenever the
+# format changes, so that existing snapshots are treated as stale.
+_cache_version = 2
+# Version of the persisted citations. This must be incremented whenever
+# Article.to_citation() changes its output.
+_citations_version = 3
+# Likewise for the persisted search haystacks and Article.make_haystack().
+_haystacks_version = 2
+# Size in bytes beyond which the journal is merged back into the main file,
+# so that it doesn't take too long to replay.
+_max_journal_size = 2 ** 20
+# The size and modification time of each YAML file when it was last read
+# (without a journal) or written, i.e. when it was known to contain exactly
+# the articles in memory. See compact().
+_in_sync = {}
+
+# Use the libyaml-based loader and dumper if PyYAML was built against libyaml.
+try:
+    from yaml import CSafeLoader as _Loader, CSafeDumper as _CDumper
+except ImportError:
+    from yaml import SafeLoader as _Loader
+    _CDumper = None
+
+
+def _check_cdumper():
+    """
+    Checks that the libyaml dumper produces exactly the same output as the
+    pure-Python dumper for a typical article, so that files (and backups,
+    which are compared with filecmp) don't change just because libyaml is
+    available. If not, we don't use it at all.
+    """
+    if _CDumper is None:
+        return False
+    probe = {"authors": [{"family": "Yong", "given": "Jonathan R. J."},
+                         {"family": "O'Brien", "given": "J.-B."}],
+             "doi": "10.1000/xyz(123)-4:5",
+             "issue": None,
+             "journal_short": "J. Magn. Reson.",
+             "pages": "e1234",
+             "title": ("A long title: with 'quotes', \"more quotes\", "
+                       "# hashes & (brackets) - which must be wrapped " * 3),
+             "time_added": datetime(2020, 1, 1, tzinfo=timezone.utc),
+             "year": 2020}
+    return yaml.dump(probe, Dumper=_CDumper) == yaml.dump(probe)
+
+_use_cdumper = _check_cdumper()
 
 
-def read_articles(fname):
+def library_path(dir):
+    """
+    Returns the path to the database in the given directory. This is
+    peep.sqlite if it exists (see sqlstore.py), then the peep.shards folder if
+    it exists (see shards.py), and peep.yaml otherwise.
+    """
+    if (dir / "peep.sqlite").is_file():
+        return dir / "peep.sqlite"
+    elif (dir / "peep.shards").is_dir():
+        return dir / "peep.shards"
+    else:
+        return dir / "peep.yaml"
+
+
+def read_articles(fname, cache=False):
     """
     Read a list of articles from the specified directory.
 
     Arguments:
-        path (Path) : Path to read from.
+        path (Path) : Path to read from. SQLite databases (with the suffix
+                      .sqlite) and sharded databases (folders with the suffix
+                      .shards) are read by their own modules (see
+                      _backends).
+        cache (bool): Whether to use the snapshot cache (see
+                      read_cache()). If there is no snapshot yet, or it is
+                      stale, the file is parsed as usual, and the snapshot is
+                      generated again on exit (see compact()).
 
     Raises:
         FileNotFoundError: If the file does not exist.
         yaml.YAMLError   : If the file is not valid YAML, or it isn't in the
                            appropriate format for Cygnet.
     """
-    if not fname.is_file():
+    if not fname.exists():
         raise FileNotFoundError(f"The file {fname} does not exist.")
 
-    # Read it in
+    now = time()
+    if fname.suffix in _backends:
+        try:
+            articles = _backends[fname.suffix].read_articles(fname)
+        except sqlite3.DatabaseError as e:
+            raise yaml.YAMLError(f"The database {fname} could not be read: "
+                                 f"{str(e)}")
+        _debug(f"read_articles: loaded {len(articles)} articles from "
+               f"{fname.name} in {(time() - now) * 1000:.3f} ms")
+        return articles
+
+    # Read it in, from the snapshot if possible
+    article_dicts = read_cache(fname) if cache else None
+    if article_dicts is not None:
+        source = "snapshot"
+        articles = [_to_article(d, fname) for d in article_dicts]
+    else:
+        source = "YAML"
+        articles = list(iter_articles(fname))
+        if cache:
+            cache_path(fname).unlink(missing_ok=True)
+
+    # Apply any changes which were journalled since the file was last written.
+    if journal_path(fname).is_file():
+        articles = replay_journal(articles, journal_path(fname))
+    else:
+        _in_sync[fname] = _stat_key(fname)
+
+    _debug(f"read_articles: loaded {len(articles)} articles from {source} "
+           f"in {(time() - now) * 1000:.3f} ms")
+    return articles
+
+
+def iter_articles(fname):
+    """
+    Reads articles from the specified YAML file one at a time, so that the
+    whole file never needs to be held in memory as dictionaries.
+
+    Arguments:
+        fname (Path) : Path to read from.
+
+    Yields:
+        Article instances, in the order they appear in the file.
+
+    Raises:
+        yaml.YAMLError   : If the file is not valid YAML, or it isn't in the
+                           appropriate format for Cygnet.
+    """
+    with open(fname, "r") as fp:
+        for d in yaml.load_all(fp, Loader=_Loader):
+            yield _to_article(d, fname)
+
+
+def read_fragments(fname):
+    """
+    Reads articles from the specified YAML file one document at a time, and
+    keeps the text of each document as the article's cached YAML (see
+    dump_articles()), so that articles which don't change are never dumped
+    again. This is somewhat slower than iter_articles(), so it is only used
+    for shards (see shards.py), which are written far more often than they
+    are read.
+
+    Arguments:
+        fname (Path) : Path to read from.
+
+    Returns:
+        A list of Article instances.
+
+    Raises:
+        yaml.YAMLError   : If the file is not valid YAML, or it isn't in the
+                           appropriate format for Cygnet.
+    """
     with open(fname, "r") as fp:
-        article_dicts = list(yaml.safe_load_all(fp))
+        text = fp.read()
+    if text.startswith("---\n"):
+        text = text[4:]
+    if text.strip() == "":
+        return []
+    # A line consisting only of '---' can only be a document separator, since
+    # continuation lines of scalars are always indented.
+    documents = text.split("\n---\n")
+    documents = [doc + "\n" for doc in documents[:-1]] + documents[-1:]
+    articles = []
+    for doc in documents:
+        article = _to_article(yaml.load(doc, Loader=_Loader), fname)
+        article._fragment = doc
+        articles.append(article)
+    return articles
+
 
-    # Convert to Article instances. This implicitly validates the data.
+def _to_article(d, fname):
+    """
+    Converts a dictionary to an Article instance. This implicitly validates
+    the data.
+
+    Raises:
+        yaml.YAMLError   : If the dictionary isn't in the appropriate format
+                           for Cygnet.
+    """
     try:
-        articles = [Article(**d) for d in article_dicts]
+        return Article(**d)
     except TypeError:
         raise yaml.YAMLError(f"The file {fname} did not contain "
                              "articles in the correct format.")
 
-    return articles
-
 
 def write_articles(articles, fname, force=False):
     """
@@ -48,7 +236,10 @@ def write_articles(articles, fname, force=False):
     Arguments:
         articles (list): List of articles. Each item should be a dictionary.
         dir (Path)     : Directory to save to.
-        fname (str)    : Filename to write to.
+        fname (str)    : Filename to write to. SQLite databases (with the
+                         suffix .sqlite) and sharded databases (with the
+                         suffix .shards) are written by their own modules
+                         (see _backends).
         force (bool)   : Whether to create the directory if it doesn't exist.
 
     Returns:
@@ -64,8 +255,526 @@ def write_articles(articles, fname, force=False):
         else:
             raise FileNotFoundError(f"The directory {fname.parent} "
                                     "does not exist.")
+    if fname.suffix in _backends:
+        _backends[fname.suffix].write_articles(articles, fname)
+        return
 
-    # Serialise the articles as dictionaries.
-    article_dicts = [vars(article) for article in articles]
     with open(fname, "w") as fp:
-        yaml.dump_all(article_dicts, fp)
+        fp.write(dump_articles(articles))
+    # The file is now up to date, so the journal (if any) can be discarded.
+    # The snapshot is now stale; it is only generated again on exit, as it
+    # needs every article to be converted to a dictionary.
+    journal_path(fname).unlink(missing_ok=True)
+    cache_path(fname).unlink(missing_ok=True)
+    _in_sync[fname] = _stat_key(fname)
+
+
+def _load_all(stream):
+    """
+    Parses all the YAML documents in a string or file, using libyaml if it is
+    available.
+
+    Returns:
+        A list of the parsed documents.
+    """
+    return list(yaml.load_all(stream, Loader=_Loader))
+
+
+def _dump_all(dicts):
+    """
+    Serialises a list of dictionaries as YAML documents. The output is
+    identical to that of yaml.dump_all().
+
+    libyaml is used where possible. However, its emitter wraps long
+    double-quoted strings differently from PyYAML, so dictionaries containing
+    such strings are handed to the pure-Python dumper instead.
+
+    Returns:
+        The YAML as a string.
+    """
+    chunks = []
+    for use_c, group in groupby(dicts, key=_is_cdumper_safe):
+        dumper = _CDumper if (use_c and _use_cdumper) else yaml.Dumper
+        chunks.append(yaml.dump_all(list(group), Dumper=dumper))
+    return "---\n".join(chunks)
+
+
+def _is_cdumper_safe(obj):
+    """
+    Checks whether obj (which may be a nested structure of dicts and lists)
+    gives the same output with libyaml as with PyYAML.
+
+    The only strings which are double-quoted are those containing characters
+    other than printable ASCII. These are fine as long as they are short
+    enough to not be wrapped. Each character is escaped to at most 10
+    characters ('\\U0001f600'), which gives an upper bound on the length.
+    """
+    if isinstance(obj, str):
+        return ((obj.isascii() and obj.isprintable())
+                or sum(1 if c.isascii() and c.isprintable() else 10
+                       for c in obj) <= 50)
+    elif isinstance(obj, dict):
+        return all(_is_cdumper_safe(k) and _is_cdumper_safe(v)
+                   for k, v in obj.items())
+    elif isinstance(obj, list):
+        return all(_is_cdumper_safe(v) for v in obj)
+    else:
+        return True
+
+
+def cache_path(fname):
+    """
+    Returns the path to the snapshot cache which accompanies the given
+    file, e.g. .peep.cache for peep.yaml.
+    """
+    return fname.with_name(f".{fname.stem}.cache")
+
+
+def _stat_key(fname):
+    st = fname.stat()
+    return (st.st_size, st.st_mtime_ns)
+
+
+def _cache_key(fname):
+    """
+    Generates the key which a snapshot must match in order to be valid for the
+    given file. This is made from the size, modification time, and a hash of
+    the file contents.
+    """
+    st = fname.stat()
+    with open(fname, "rb") as fp:
+        digest = hashlib.blake2b(fp.read()).hexdigest()
+    return (_cache_version, st.st_size, st.st_mtime_ns, digest)
+
+
+def read_cache(fname):
+    """
+    Reads the article dictionaries from the snapshot of the specified file.
+    This is much faster than parsing the YAML.
+
+    The snapshot is JSON, not pickle: the library folder may be shared with
+    other people, and unpickling a file which someone else has written would
+    let them run arbitrary code.
+
+    Arguments:
+        fname (Path) : The file which the snapshot belongs to.
+
+    Returns:
+        The list of article dictionaries, or None if there is no snapshot or
+        it is stale.
+    """
+    try:
+        with open(cache_path(fname), "r", encoding="utf-8") as fp:
+            key, article_dicts = json.load(fp)
+        if key != list(_cache_key(fname)):
+            _debug(f"read_cache: snapshot for {fname} is stale")
+            return None
+        for d in article_dicts:
+            for field in ("time_added", "time_opened"):
+                if d[field] is not None:
+                    d[field] = datetime.fromisoformat(d[field])
+    except FileNotFoundError:
+        return None
+    except (ValueError, TypeError, KeyError):
+        _debug(f"read_cache: snapshot for {fname} is corrupted")
+        return None
+    return article_dicts
+
+
+def write_cache(article_dicts, fname):
+    """
+    Writes a snapshot of the article dictionaries, which must be exactly the
+    contents of the specified file.
+
+    Arguments:
+        article_dicts (list) : The article dictionaries.
+        fname (Path)         : The file which the snapshot belongs to.
+
+    Returns:
+        None.
+    """
+    def isoformat(t):
+        if isinstance(t, datetime):
+            return t.isoformat()
+        raise TypeError(f"cannot store {type(t).__name__} in snapshot")
+
+    with open(cache_path(fname), "w", encoding="utf-8") as fp:
+        json.dump((_cache_key(fname), article_dicts), fp,
+                  ensure_ascii=False, separators=(",", ":"),
+                  default=isoformat)
+
+
+def citations_path(fname):
+    """
+    Returns the path to the file of persisted citations which accompanies the
+    given file, e.g. .peep.citations for peep.yaml.
+    """
+    return fname.with_name(f".{fname.stem}.citations")
+
+
+def haystacks_path(fname):
+    """
+    Returns the path to the file of persisted search haystacks which
+    accompanies the given file, e.g. .peep.haystacks for peep.yaml.
+    """
+    return fname.with_name(f".{fname.stem}.haystacks")
+
+
+def _metadata_key(article):
+    """
+    Generates a digest of the metadata which an article's citations and
+    search haystack are made from. Persisted values are only used for
+    articles whose key matches.
+    """
+    data = repr(tuple(getattr(article, field)
+                      for field in Article._cited_from))
+    return hashlib.blake2b(data.encode(), digest_size=16).digest()
+
+
+def _load_keyed(path, version, keys=None):
+    """
+    Loads values stored by _store_keyed(). If the file doesn't exist, is
+    corrupted, or is from a different version, an empty dictionary is
+    returned instead.
+
+    Arguments:
+        path (Path)    : The file to read from.
+        version (int)  : The version which the file must have.
+        keys (list)    : The keys to look up. If None, everything is read.
+
+    Returns:
+        A dictionary of the keys which were found and their values.
+    """
+    if not path.is_file():
+        return {}
+    try:
+        with closing(sqlite3.connect(path)) as conn:
+            if conn.execute("PRAGMA user_version").fetchone()[0] != version:
+                return {}
+            if keys is None:
+                rows = conn.execute("SELECT key, value FROM entries")
+                return {key: json.loads(value) for key, value in rows}
+            # SQLite limits the number of parameters in a statement.
+            d = {}
+            keys = list(keys)
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = conn.execute("SELECT key, value FROM entries WHERE key "
+                                    f"IN ({', '.join('?' * len(chunk))})",
+                                    chunk)
+                d.update((key, json.loads(value)) for key, value in rows)
+            return d
+    except (sqlite3.Error, ValueError):
+        _debug(f"_load_keyed: {path} is corrupted")
+        return {}
+
+
+def _store_keyed(path, version, d):
+    """
+    Stores values keyed by _metadata_key(), replacing any existing values for
+    the same keys. The file is an SQLite database with one table of keys and
+    values (as JSON), so that individual values can be looked up and added
+    without reading or writing the rest; its version is stored as PRAGMA
+    user_version. A file from a different version (or one which isn't a
+    database at all) is started afresh.
+    """
+    try:
+        conn = sqlite3.connect(path)
+        if conn.execute("PRAGMA user_version").fetchone()[0] != version:
+            conn.execute("DROP TABLE IF EXISTS entries")
+    except sqlite3.DatabaseError:
+        conn.close()
+        path.unlink()
+        conn = sqlite3.connect(path)
+    with closing(conn), conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS entries "
+                     "(key BLOB PRIMARY KEY, value TEXT NOT NULL)")
+        conn.execute(f"PRAGMA user_version = {version}")
+        conn.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?)",
+                         ((key, json.dumps(value, ensure_ascii=False))
+                          for key, value in d.items()))
+
+
+def read_citations(articles, fname):
+    """
+    Restores the citations persisted by write_citations() to the articles
+    they belong to. Articles which have already been looked up, and those
+    whose metadata has changed since, are left alone. Only the entries for
+    the given articles are read.
+
+    Arguments:
+        articles (list) : List of articles.
+        fname (Path)    : The file which the citations belong to.
+
+    Returns:
+        None.
+    """
+    articles = [a for a in articles if a._citations is None]
+    if not articles:
+        return
+    keys = [_metadata_key(a) for a in articles]
+    citations = _load_keyed(citations_path(fname), _citations_version, keys)
+    # Articles without persisted citations get an empty dictionary, so that
+    # they aren't looked up again until they are modified.
+    for article, key in zip(articles, keys):
+        article._citations = dict(citations.get(key, {}))
+
+
+def write_citations(articles, fname):
+    """
+    Persists the cached citations of the articles, so that they don't have to
+    be generated again in a later session. The entries for the given articles
+    are added or updated; those of other articles are left as they are.
+
+    Arguments:
+        articles (list) : List of articles.
+        fname (Path)    : The file which the citations belong to.
+
+    Returns:
+        None.
+    """
+    _store_keyed(citations_path(fname), _citations_version,
+                 {_metadata_key(a): a._citations
+                  for a in articles if a._citations})
+
+
+def read_haystacks(articles, fname):
+    """
+    Restores the search haystacks persisted by write_haystacks() (see
+    Article.make_haystack()) to the articles they belong to, so that they
+    don't have to be computed again. Only the entries for the given articles
+    are read.
+
+    Arguments:
+        articles (list) : List of articles.
+        fname (Path)    : The file which the haystacks belong to.
+
+    Returns:
+        The articles whose haystacks were restored.
+    """
+    articles = [a for a in articles if a._cached("haystack") is None]
+    if not articles:
+        return []
+    keys = [_metadata_key(a) for a in articles]
+    haystacks = _load_keyed(haystacks_path(fname), _haystacks_version, keys)
+    restored = []
+    for article, key in zip(articles, keys):
+        haystack = haystacks.get(key)
+        if haystack is not None:
+            article._memo("haystack", lambda: tuple(haystack))
+            restored.append(article)
+    return restored
+
+
+def write_haystacks(articles, fname):
+    """
+    Persists the search haystacks which have been computed for the articles.
+    The entries for the given articles are added or updated; those of other
+    articles are left as they are.
+
+    Arguments:
+        articles (list) : List of articles.
+        fname (Path)    : The file which the haystacks belong to.
+
+    Returns:
+        None.
+    """
+    haystacks = {}
+    for article in articles:
+        haystack = article._cached("haystack")
+        if haystack is not None:
+            haystacks[_metadata_key(article)] = haystack
+    _store_keyed(haystacks_path(fname), _haystacks_version, haystacks)
+
+
+def dump_articles(articles):
+    """
+    Serialises a list of articles as YAML, exactly as write_articles() would
+    write them to a file.
+
+    Each article caches its own YAML, which is cleared whenever it is
+    modified, so only the articles which changed since they were last
+    serialised need to be dumped again.
+
+    Returns:
+        The YAML as a string.
+    """
+    for article in articles:
+        if article._fragment is None:
+            article._fragment = _dump_all([article.to_dict()])
+    return "---\n".join(article._fragment for article in articles)
+
+
+def journal_path(fname):
+    """
+    Returns the path to the journal which accompanies the given file, e.g.
+    peep.journal for peep.yaml.
+    """
+    return fname.with_suffix(".journal")
+
+
+def append_journal(records, articles, fname):
+    """
+    Appends journal records (see _journal() for the format) to the journal
+    which accompanies the specified file. This is much cheaper than rewriting
+    the whole file with write_articles(), as only the articles which were
+    changed are serialised. Once the journal grows beyond _max_journal_size
+    bytes, it is compacted, i.e. the whole file is written again instead.
+
+    Arguments:
+        records (list) : Journal records to be appended.
+        articles (list): The current list of articles.
+        fname (Path)   : The file which the journal belongs to.
+
+    The other storage formats don't have a separate journal; instead, their
+    modules write the changes directly (see _backends).
+
+    Returns:
+        The size of the journal in bytes, after appending (0 if it was
+        compacted, or there is no journal).
+    """
+    if fname.suffix in _backends:
+        _backends[fname.suffix].append_journal(records, articles, fname)
+        return 0
+
+    record_dicts = []
+    for record in records:
+        if record[0] == "put":
+            record_dicts.append({"put": record[1],
+                                 "article": record[2].to_dict()})
+        elif record[0] == "insert":
+            record_dicts.append({"insert": record[1],
+                                 "article": record[2].to_dict()})
+        elif record[0] == "delete":
+            record_dicts.append({"delete": record[1]})
+        elif record[0] == "order":
+            record_dicts.append({"order": _to_runs(record[1])})
+
+    with open(journal_path(fname), "a") as fp:
+        yaml.dump_all(record_dicts, fp, explicit_start=True)
+        size = fp.tell()
+    if size > _max_journal_size:
+        write_articles(articles, fname)
+        _debug("append_journal: journal compacted")
+        return 0
+    return size
+
+
+def compact(articles, fname):
+    """
+    Writes the whole file again if it has a journal, so that the journal
+    doesn't need to be replayed when the file is next read, and writes the
+    snapshot (see read_cache()) if there isn't an up-to-date one. This is
+    done on exit. The other storage formats don't have a separate journal or
+    a snapshot, so nothing needs to be done for them.
+
+    Arguments:
+        articles (list): The current list of articles.
+        fname (Path)   : The file to compact.
+
+    Returns:
+        None.
+    """
+    if fname.suffix in _backends:
+        return
+    if journal_path(fname).is_file():
+        write_articles(articles, fname)
+    # The snapshot can only be made from the articles in memory if nothing
+    # else has changed the file since it was last read or written.
+    if (not cache_path(fname).is_file()
+            and _in_sync.get(fname) == _stat_key(fname)):
+        write_cache([article.to_dict() for article in articles], fname)
+
+
+def _to_runs(order):
+    """
+    Compresses a reordering (see _journal()) into a list of [start, length]
+    runs of consecutive positions. Most reorderings only move a few articles
+    (e.g. sorting after adding an article), so there are only a few runs.
+    """
+    runs = []
+    for i in order:
+        if runs and runs[-1][0] + runs[-1][1] == i:
+            runs[-1][1] += 1
+        else:
+            runs.append([i, 1])
+    return runs
+
+
+def _reorder(articles, runs):
+    """
+    Reorders a list of articles according to the runs generated by
+    _to_runs().
+
+    Raises:
+        ValueError if the runs don't fit the list.
+    """
+    # Journals written by older versions list all the DOIs in order instead.
+    if runs and isinstance(runs[0], str):
+        order = {doi.lower(): n for n, doi in enumerate(runs)}
+        return sorted(articles,
+                      key=lambda a: order.get(a.doi.lower(), len(order)))
+    reordered = []
+    for start, length in runs:
+        reordered.extend(articles[start:start + length])
+    if len(reordered) != len(articles):
+        raise ValueError("reordering does not match the articles")
+    return reordered
+
+
+def replay_journal(articles, journal):
+    """
+    Applies the records in a journal file to a list of articles.
+
+    Arguments:
+        articles (list): List of articles read from the main file.
+        journal (Path) : The journal file.
+
+    Returns:
+        The updated list of articles.
+
+    Raises:
+        yaml.YAMLError   : If the journal is not valid YAML, or it isn't in
+                           the appropriate format for Cygnet.
+    """
+    with open(journal, "r") as fp:
+        record_dicts = _load_all(fp)
+
+    # Deleted articles are set to None, and only removed once the positions
+    # of the others are needed, so that the list isn't shifted for every
+    # deletion. Likewise, the position of each DOI (lowercased, since DOIs
+    # are case-insensitive) is only worked out again when it is needed.
+    positions = None
+    try:
+        for d in record_dicts:
+            if "put" in d or "delete" in d:
+                if positions is None:
+                    positions = {article.doi.lower(): i
+                                 for i, article in enumerate(articles)
+                                 if article is not None}
+                if "put" in d:
+                    article = Article(**d["article"])
+                    key = d["put"].lower()
+                    if key in positions:
+                        i = positions.pop(key)
+                        articles[i] = article
+                    else:
+                        i = len(articles)
+                        articles.append(article)
+                    positions[article.doi.lower()] = i
+                elif d["delete"].lower() in positions:
+                    articles[positions.pop(d["delete"].lower())] = None
+            else:
+                # Insertions and reorderings refer to positions in the list
+                # without the deleted articles.
+                articles = [a for a in articles if a is not None]
+                positions = None
+                if "insert" in d:
+                    articles.insert(d["insert"], Article(**d["article"]))
+                elif "order" in d:
+                    articles = _reorder(articles, d["order"])
+    except (TypeError, KeyError, ValueError, AttributeError):
+        raise yaml.YAMLError(f"The journal {journal} did not contain "
+                             "records in the correct format.")
+
+    return [article for article in articles if article is not None]
@@ -0,0 +1,366 @@
+"""
+fulltext.py
+-----------
+
+Full-text search over the PDFs stored in the pdf/ and si/ folders of a
+database.
+
+The text of each PDF is extracted (with pdftotext if it is installed, or else
+with a crude built-in extractor) in a pool of worker processes, by a task
+which runs in the background (see indexer()). The text is saved in the
+.peep.fulltext folder, in one JSON file per PDF, together with the size and
+modification time of the PDF, so that updating the index only extracts (and
+saves) PDFs which are new or have changed. In memory, the texts are kept in
+an inverted index.
+"""
+
+import os
+import re
+import asyncio
+import zlib
+import json
+import shutil
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from unidecode import unidecode
+
+from ._shared import *
+
+# Version of the index format. Increment this whenever the format or the
+# extraction changes, so that everything is extracted again.
+_version = 3
+# The folders which are indexed.
+_folders = ("pdf", "si")
+# Number of seconds to give pdftotext for each PDF.
+_timeout = 60
+
+_word_re = re.compile(r"[a-z0-9]+")
+_space_re = re.compile(r"\s+")
+
+# The most recently used index, as (path, index), so that it doesn't have to
+# be read from disk for every search.
+_loaded = (None, None)
+
+
+def index_path(dirname):
+    """
+    Returns the path to the full-text index folder of the database in
+    dirname.
+    """
+    return dirname / ".peep.fulltext"
+
+
+def doi_of(name):
+    """
+    Converts the name of an indexed PDF, e.g. 'pdf/10.1021#jacs.0c01234.pdf',
+    back to the DOI it belongs to (see Article.to_fname()).
+    """
+    return name.split("/", 1)[1][:-len(".pdf")].replace("#", "/")
+
+
+# Literal strings shown by the Tj and TJ operators in a content stream.
+_stream_re = re.compile(rb"stream\r?\n(.*?)endstream", re.S)
+_textop_re = re.compile(
+    rb"(\((?:[^()\\]|\\.)*\)|\[(?:[^\]\\]|\\.)*\])\s*T[jJ]", re.S)
+_string_re = re.compile(rb"\(((?:[^()\\]|\\.)*)\)", re.S)
+_escape_re = re.compile(rb"\\([0-7]{1,3}|.)", re.S)
+_escapes = {b"n": b"\n", b"r": b"\r", b"t": b"\t", b"b": b"\b", b"f": b"\f"}
+
+
+def _unescape(m):
+    c = m.group(1)
+    if c[:1].isdigit():
+        return bytes([int(c, 8) & 0xff])
+    return _escapes.get(c, c)
+
+
+def _extract_crude(fname):
+    """
+    Extracts the text from a PDF without any external tools. This only finds
+    text drawn with literal strings in (Flate-compressed or uncompressed)
+    content streams, so it misses text in fonts with unusual encodings, but
+    that is still better than nothing.
+    """
+    with open(fname, "rb") as fp:
+        data = fp.read()
+    chunks = []
+    for m in _stream_re.finditer(data):
+        stream = m.group(1)
+        try:
+            stream = zlib.decompressobj().decompress(stream)
+        except zlib.error:
+            pass
+        for op in _textop_re.finditer(stream):
+            s = b"".join(_string_re.findall(op.group(1)))
+            chunks.append(_escape_re.sub(_unescape, s).decode("latin-1"))
+    return " ".join(chunks)
+
+
+def _extract(fname):
+    """
+    Extracts the text from a PDF, and the (normalised) words in it. This runs
+    in a worker process.
+
+    Returns:
+        Tuple of (text, set of words). The text is empty if nothing could be
+        extracted.
+    """
+    try:
+        if shutil.which("pdftotext"):
+            text = subprocess.run(["pdftotext", "-q", "-enc", "UTF-8",
+                                   str(fname), "-"],
+                                  capture_output=True, timeout=_timeout
+                                  ).stdout.decode("utf-8", errors="replace")
+        else:
+            text = _extract_crude(fname)
+    except subprocess.TimeoutExpired:
+        # Probably a corrupted PDF. It is indexed without any text, so that
+        # it isn't tried again until it changes.
+        _debug(f"fulltext: pdftotext timed out on {fname}")
+        text = ""
+    except (OSError, ValueError):
+        text = ""
+    text = _space_re.sub(" ", text).strip()
+    return text, _words(text)
+
+
+def _entry_path(path, name):
+    """
+    Returns the path to the file in the index folder which holds the text of
+    the PDF with the given name.
+    """
+    return path / (name[:-len(".pdf")] + ".json")
+
+
+def _words(text):
+    """
+    Returns the set of (normalised) words in a text.
+    """
+    return set(_word_re.findall(unidecode(text).lower()))
+
+
+def _add(index, name, stat, text, words):
+    index["files"][name] = stat
+    index["texts"][name] = text
+    for word in words:
+        index["postings"].setdefault(word, set()).add(name)
+
+
+def _drop(index, name):
+    text = index["texts"].pop(name)
+    del index["files"][name]
+    postings = index["postings"]
+    for word in _words(text):
+        postings[word].discard(name)
+        if not postings[word]:
+            del postings[word]
+
+
+def _read_index(path):
+    """
+    Reads the index from disk. Entries which are unusable are left out (so
+    that the PDFs are extracted again), and an index in the old format (a
+    single JSON file) is deleted.
+    """
+    index = {"files": {},      # name -> (size, mtime_ns)
+             "texts": {},      # name -> text
+             "postings": {}}   # word -> set of names
+    if path.is_file():
+        try:
+            path.unlink()
+        except OSError as e:
+            _debug(f"fulltext: could not delete old index {path}: {str(e)}")
+        return index
+    for folder in _folders:
+        try:
+            entries = os.scandir(path / folder)
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                if not entry.name.endswith(".json"):
+                    continue
+                name = f"{folder}/{entry.name[:-len('.json')]}.pdf"
+                try:
+                    with open(entry.path, "r", encoding="utf-8") as fp:
+                        data = json.load(fp)
+                    if data["version"] == _version:
+                        _add(index, name, tuple(data["stat"]),
+                             data["text"], _words(data["text"]))
+                except (OSError, ValueError, TypeError, KeyError):
+                    _debug(f"fulltext: index entry {entry.path} is corrupted")
+    return index
+
+
+def _store(path, name, stat, text):
+    """
+    Saves the text of one PDF to the index folder.
+    """
+    fname = _entry_path(path, name)
+    try:
+        fname.parent.mkdir(parents=True, exist_ok=True)
+        with open(fname, "w", encoding="utf-8") as fp:
+            json.dump({"version": _version, "stat": stat, "text": text},
+                      fp, ensure_ascii=False, separators=(",", ":"))
+    except OSError as e:
+        _debug(f"fulltext: could not save index entry {fname}: {str(e)}")
+
+
+def _unstore(path, name):
+    try:
+        _entry_path(path, name).unlink()
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        _debug(f"fulltext: could not delete index entry for {name}: "
+               f"{str(e)}")
+
+
+def _get(path):
+    """
+    Returns the index at path, reading it from disk if it isn't the one
+    which is already loaded.
+    """
+    global _loaded
+    if _loaded[0] != path:
+        _loaded = (path, _read_index(path))
+    return _loaded[1]
+
+
+def _scan(dirname):
+    """
+    Finds all the PDFs in the database, with their sizes and modification
+    times.
+    """
+    files = {}
+    for folder in _folders:
+        try:
+            entries = os.scandir(dirname / folder)
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.name.endswith(".pdf") and entry.is_file():
+                    st = entry.stat()
+                    files[f"{folder}/{entry.name}"] = (st.st_size,
+                                                       st.st_mtime_ns)
+    return files
+
+
+async def update(dirname):
+    """
+    Brings the full-text index of the database in dirname up to date,
+    extracting the text of any PDFs which are new or have changed since the
+    last update. The extraction is done in a pool of worker processes, and
+    the text of each PDF is saved as soon as it has been extracted.
+
+    Returns:
+        The index.
+    """
+    global _loaded
+    loop = asyncio.get_event_loop()
+    path = index_path(dirname)
+    if _loaded[0] != path:
+        index = await loop.run_in_executor(None, _read_index, path)
+        # search() may have loaded it in the meantime.
+        if _loaded[0] != path:
+            _loaded = (path, index)
+    index = _loaded[1]
+
+    files = _scan(dirname)
+    # Remove the entries of PDFs which were deleted or changed.
+    for name in [name for name in index["files"]
+                 if files.get(name) != index["files"][name]]:
+        _drop(index, name)
+        _unstore(path, name)
+    new = [name for name in files if name not in index["files"]]
+    if not new:
+        return index
+
+    _debug(f"fulltext: indexing {len(new)} PDF{_p(new)}")
+    pool = ProcessPoolExecutor()
+    futures = {}
+    try:
+        for name in new:
+            futures[name] = pool.submit(_extract, dirname / name)
+    except (BrokenProcessPool, OSError):
+        pass
+    try:
+        for name in new:
+            try:
+                text, words = await asyncio.wrap_future(futures[name])
+            except (KeyError, BrokenProcessPool, OSError):
+                # Fall back to a thread of this process.
+                text, words = await loop.run_in_executor(None, _extract,
+                                                         dirname / name)
+            _add(index, name, files[name], text, words)
+            _store(path, name, files[name], text)
+    finally:
+        # If this was cancelled, don't wait for the remaining PDFs.
+        for future in futures.values():
+            future.cancel()
+        pool.shutdown(wait=False)
+    _debug(f"fulltext: indexed {len(new)} PDF{_p(new)}")
+    return index
+
+
+async def indexer():
+    """
+    Keeps the full-text index of the current database up to date, checking
+    every interval seconds for PDFs which are new or have changed. This runs
+    in the background, so that searching never has to wait for the text of
+    PDFs to be extracted.
+    """
+    interval = 5
+    while True:
+        if _g.currentPath is not None:
+            try:
+                await update(_g.currentPath)
+            except OSError as e:
+                _debug(f"fulltext: could not update index: {str(e)}")
+        await asyncio.sleep(interval)
+
+
+def search(dirname, query, width=40):
+    """
+    Searches the PDFs in the database for all the words in a query. This
+    doesn't wait for the index to be updated: PDFs which haven't been indexed
+    yet, or have changed since they were, are left out.
+
+    Arguments:
+        dirname (Path) : The folder of the database.
+        query (str)    : The words to search for. Case and accents are
+                         ignored.
+        width (int)    : Number of characters of context on either side of
+                         the match in the snippets.
+
+    Returns:
+        Tuple of (list of (name of PDF, snippet) tuples sorted by name, number
+        of PDFs which were left out).
+    """
+    index = _get(index_path(dirname))
+    files = _scan(dirname)
+    pending = sum(1 for name in files
+                  if index["files"].get(name) != files[name])
+    words = _word_re.findall(unidecode(query).lower())
+    if not words:
+        return [], pending
+    names = set.intersection(*(index["postings"].get(word, set())
+                               for word in words))
+    names = {name for name in names
+             if index["files"][name] == files.get(name)}
+    results = []
+    for name in sorted(names):
+        text = index["texts"][name]
+        m = re.search(re.escape(words[0]), text, re.IGNORECASE)
+        if m is None:
+            # The word must be in the text with accents. unidecode() can
+            # change the length of the text, so this is only approximately in
+            # the right place.
+            m = re.search(re.escape(words[0]), unidecode(text), re.IGNORECASE)
+        start = m.start() if m else 0
+        snippet = text[max(0, start - width):start + len(words[0]) + width]
+        results.append((name, snippet))
+    return results, pending
@@ -0,0 +1,719 @@
+"""
+index.py
+--------
+
+Indexes over the article list, which make lookups faster than looping over
+every article.
+
+Each index is kept in sync with _g.articleList through the functions at the
+bottom of this module, which must be called whenever articles are added to,
+removed from, or replaced in the list:
+
+    add(article)       - after an article is appended
+    remove(article)    - after an article is deleted
+    replace(old, new)  - after an article is replaced by another one
+    rebuild(articles)  - after the whole list is replaced, e.g. by cd
+
+Reordering the list doesn't affect any of the indexes.
+"""
+
+import re
+import abc
+from math import log
+from bisect import bisect_right
+from collections import Counter
+
+from unidecode import unidecode
+
+
+class Index(abc.ABC):
+    """
+    Base class for indexes. Subclasses must implement clear(), add(), and
+    remove(); they are registered with register() so that they are kept up to
+    date.
+    """
+    @abc.abstractmethod
+    def clear(self):
+        pass
+
+    @abc.abstractmethod
+    def add(self, article):
+        pass
+
+    @abc.abstractmethod
+    def remove(self, article):
+        pass
+
+    def replace(self, old, new):
+        self.remove(old)
+        self.add(new)
+
+    def rebuild(self, articles):
+        self.clear()
+        for article in articles:
+            self.add(article)
+
+
+class LazyIndex(Index):
+    """
+    Base class for indexes which are expensive to build, because they need
+    every article's search haystack. These are only built when they are first
+    needed (subclasses must call _ensure() before using the index), and until
+    then add() and remove() only keep track of which articles to build it
+    from (subclasses must call _defer() first).
+    """
+    def __init__(self):
+        # The articles to build the index from when it's next needed, keyed
+        # by id, or None if the index is up to date.
+        self._pending = None
+
+    def rebuild(self, articles):
+        self.clear()
+        self._pending = {id(article): article for article in articles}
+
+    def _defer(self, article, present):
+        """
+        Records that an article was added (or removed, if present is False)
+        if the index hasn't been built yet.
+
+        Returns:
+            True if the index hasn't been built yet, in which case there is
+            nothing else to do.
+        """
+        if self._pending is None:
+            return False
+        if present:
+            self._pending[id(article)] = article
+        else:
+            self._pending.pop(id(article), None)
+        return True
+
+    def _ensure(self):
+        if self._pending is not None:
+            articles, self._pending = self._pending, None
+            for article in articles.values():
+                self.add(article)
+
+
+class DOIIndex(Index):
+    """
+    Maps DOIs to articles. DOIs are case-insensitive, so they are lowercased
+    before being used as keys.
+    """
+    def __init__(self):
+        self._articles = {}
+
+    @staticmethod
+    def key(doi):
+        return doi.lower()
+
+    def clear(self):
+        self._articles.clear()
+
+    def add(self, article):
+        if article.doi is not None:
+            self._articles[self.key(article.doi)] = article
+
+    def remove(self, article):
+        # Only remove the entry if it really belongs to this article, in case
+        # the library contains the same DOI twice.
+        if (article.doi is not None
+                and self._articles.get(self.key(article.doi)) is article):
+            del self._articles[self.key(article.doi)]
+
+    def get(self, doi):
+        """
+        Returns the article with the given DOI, or None if there isn't one.
+        """
+        return self._articles.get(self.key(doi))
+
+    def __contains__(self, doi):
+        return self.key(doi) in self._articles
+
+    def __len__(self):
+        return len(self._articles)
+
+
+class YearIndex(Index):
+    """
+    Maps years of publication to the articles published in them.
+    """
+    def __init__(self):
+        self._articles = {}   # year -> set of ids of articles
+
+    @staticmethod
+    def key(article):
+        try:
+            return int(article.year)
+        except (TypeError, ValueError):
+            return None
+
+    def clear(self):
+        self._articles.clear()
+
+    def add(self, article):
+        year = self.key(article)
+        if year is not None:
+            self._articles.setdefault(year, set()).add(id(article))
+
+    def remove(self, article):
+        year = self.key(article)
+        if year is not None and year in self._articles:
+            self._articles[year].discard(id(article))
+            if not self._articles[year]:
+                del self._articles[year]
+
+    def range(self, low=None, high=None):
+        """
+        Finds the articles published between two years (inclusive). Either
+        end can be None, meaning that the range is open at that end.
+
+        Returns:
+            The set of ids of the articles.
+        """
+        ids = set()
+        for year, articles in self._articles.items():
+            if ((low is None or year >= low)
+                    and (high is None or year <= high)):
+                ids |= articles
+        return ids
+
+
+class JournalIndex(Index):
+    """
+    Maps journals to the articles published in them. A library only has a
+    handful of different journals, so a query about the journal can be
+    answered by looking at each journal once, instead of at every article.
+    """
+    def __init__(self):
+        self._articles = {}   # (journal_long, journal_short) -> set of ids
+
+    @staticmethod
+    def key(article):
+        return (article.journal_long, article.journal_short)
+
+    def clear(self):
+        self._articles.clear()
+
+    def add(self, article):
+        self._articles.setdefault(self.key(article), set()).add(id(article))
+
+    def remove(self, article):
+        key = self.key(article)
+        if key in self._articles:
+            self._articles[key].discard(id(article))
+            if not self._articles[key]:
+                del self._articles[key]
+
+    @staticmethod
+    def names(journal_long, journal_short):
+        """
+        Returns the strings which a journal query is matched against: the
+        long and short names, and the initials of the short name (e.g. 'JMR'
+        for 'J. Magn. Reson.'). These are the same as in the search haystack
+        (see Article.make_haystack()).
+        """
+        journal_long = journal_long or ""
+        journal_short = journal_short or ""
+        return (unidecode(journal_long), unidecode(journal_short),
+                unidecode("".join(c for c in journal_short if c.isupper())))
+
+    def search(self, query):
+        """
+        Finds the articles whose journal matches a compiled regex.
+
+        Returns:
+            The set of ids of the matching articles.
+        """
+        ids = set()
+        for key, articles in self._articles.items():
+            if any(query.search(name) for name in self.names(*key)):
+                ids |= articles
+        return ids
+
+
+class TokenIndex(LazyIndex):
+    """
+    Inverted index from the words in each article's search haystack (see
+    Article.make_haystack()) to the articles containing them. Words are
+    maximal runs of ASCII letters and digits, lowercased.
+
+    Since the haystack is converted to ASCII, a query made only of letters
+    and digits can only match inside a single word. So the articles whose
+    haystack contains such a query are exactly those with a word containing
+    it, and these can be found by looking through the (much smaller)
+    vocabulary instead of every article.
+
+    The vocabulary is itself indexed by character trigrams, for fuzzy
+    searching (see fuzzy()).
+
+    Building the index means computing every haystack, so this is only done
+    when it is first needed.
+    """
+    word_re = re.compile(r"[a-z0-9]+")
+    plain_re = re.compile(r"[A-Za-z0-9]+")
+    # The minimum similarity for a fuzzy match.
+    fuzzy_threshold = 0.3
+
+    def __init__(self):
+        super().__init__()
+        self._postings = {}   # word -> set of ids of articles
+        self._words = {}      # id of article -> set of words
+        self._articles = {}   # id of article -> article
+        self._trigrams = {}   # trigram -> set of words
+        self._ntrigrams = {}  # word -> number of trigrams in it
+
+    def clear(self):
+        self._postings.clear()
+        self._words.clear()
+        self._articles.clear()
+        self._trigrams.clear()
+        self._ntrigrams.clear()
+        self._pending = None
+
+    def add(self, article):
+        if self._defer(article, True):
+            return
+        words = set(self.word_re.findall(
+            " ".join(article.make_haystack()).lower()))
+        self._words[id(article)] = words
+        self._articles[id(article)] = article
+        for word in words:
+            if word not in self._postings:
+                self._postings[word] = set()
+                trigrams = self._trigrams_of(word)
+                self._ntrigrams[word] = len(trigrams)
+                for trigram in trigrams:
+                    self._trigrams.setdefault(trigram, set()).add(word)
+            self._postings[word].add(id(article))
+
+    def remove(self, article):
+        if self._defer(article, False):
+            return
+        self._articles.pop(id(article), None)
+        for word in self._words.pop(id(article), ()):
+            self._postings[word].discard(id(article))
+            if not self._postings[word]:
+                del self._postings[word]
+                del self._ntrigrams[word]
+                for trigram in self._trigrams_of(word):
+                    self._trigrams[trigram].discard(word)
+                    if not self._trigrams[trigram]:
+                        del self._trigrams[trigram]
+
+    def words_containing(self, query):
+        """
+        Returns the list of words in the index which contain the query,
+        ignoring case.
+        """
+        self._ensure()
+        query = query.lower()
+        return [word for word in self._postings if query in word]
+
+    def search(self, query):
+        """
+        Finds the articles whose haystack contains the query, ignoring case.
+        The query must consist only of letters and digits (see plain_re).
+
+        Returns:
+            The set of ids of the matching articles.
+        """
+        ids = set()
+        for word in self.words_containing(query):
+            ids |= self._postings[word]
+        return ids
+
+    @staticmethod
+    def _trigrams_of(word):
+        # Padding the word means that its start and end count for more.
+        padded = f"  {word} "
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    def similar_words(self, qword):
+        """
+        Finds the words in the index which are similar to a (lowercase) word.
+        The similarity of two words is the fraction of their trigrams which
+        they have in common; only words with the same trigrams as the query
+        are looked at.
+
+        Returns:
+            Dictionary of {word: similarity}, for the words with a similarity
+            of at least fuzzy_threshold.
+        """
+        self._ensure()
+        qtrigrams = self._trigrams_of(qword)
+        shared = Counter()
+        for trigram in qtrigrams:
+            shared.update(self._trigrams.get(trigram, ()))
+        similar = {}
+        for word, n in shared.items():
+            similarity = n / (len(qtrigrams) + self._ntrigrams[word] - n)
+            if similarity >= self.fuzzy_threshold:
+                similar[word] = similarity
+        return similar
+
+    def fuzzy(self, query):
+        """
+        Finds the articles containing words similar to those in the query
+        (see similar_words()). An article matches if, for every word in the
+        query, it contains a similar word.
+
+        Returns:
+            Dictionary of {id of article: similarity}, where the similarity is
+            that of the most similar word, averaged over the query words.
+        """
+        qwords = self.word_re.findall(unidecode(query).lower())
+        scores = None
+        for qword in qwords:
+            best = {}
+            for word, similarity in self.similar_words(qword).items():
+                for i in self._postings[word]:
+                    if similarity > best.get(i, 0):
+                        best[i] = similarity
+            if scores is None:
+                scores = best
+            else:
+                scores = {i: scores[i] + similarity
+                          for i, similarity in best.items() if i in scores}
+        if not scores:
+            return {}
+        return {i: score / len(qwords) for i, score in scores.items()}
+
+
+class TermStats(LazyIndex):
+    """
+    Statistics about the words in the author, journal, and title fields of
+    the articles, for ranking search results with BM25F: the number of
+    articles containing each word, and the total length of each field.
+
+    The term frequencies of each article aren't kept, because they are only
+    needed for the articles being ranked, and can be counted from their
+    haystacks when they are.
+    """
+    fields = ("author", "journal", "title")
+    # The positions of the fields in the haystack (see
+    # Article.make_haystack()).
+    _positions = ((0,), (1, 2, 3), (4,))
+    # How much more a word counts in each field than in the title.
+    boosts = (2.0, 0.5, 1.0)
+    # The usual BM25 parameters: k1 limits the effect of repeated words, and
+    # b sets how much long fields are penalised.
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self):
+        super().__init__()
+        self._df = Counter()            # word -> number of articles
+        self._lengths = [0, 0, 0]       # total number of words in each field
+        self._n = 0                     # number of articles
+
+    def clear(self):
+        self._df.clear()
+        self._lengths = [0, 0, 0]
+        self._n = 0
+        self._pending = None
+
+    def counts(self, article):
+        """
+        Returns a tuple with the number of times each word appears in each
+        field of an article, as a Counter for each field.
+        """
+        haystack = article.make_haystack()
+        return tuple(Counter(TokenIndex.word_re.findall(
+            " ".join(haystack[k] for k in positions).lower()))
+            for positions in self._positions)
+
+    def _update(self, article, sign):
+        if self._defer(article, sign > 0):
+            return
+        counts = self.counts(article)
+        for field, counter in enumerate(counts):
+            self._lengths[field] += sign * sum(counter.values())
+        for word in set().union(*counts):
+            self._df[word] += sign
+            if self._df[word] <= 0:
+                del self._df[word]
+        self._n += sign
+
+    def add(self, article):
+        self._update(article, 1)
+
+    def remove(self, article):
+        self._update(article, -1)
+
+    def score(self, articles, terms):
+        """
+        Scores articles against a query with BM25F. Each term of the query can
+        match several words in the index (e.g. all the words containing it,
+        or all the words similar to it), each with a weight; an article
+        scores for a term according to the best of these words which it
+        contains.
+
+        Arguments:
+            articles (list) : The articles to score.
+            terms (list)    : The terms of the query. Each of these is a tuple
+                              of (dictionary of {word: weight}, fields), where
+                              fields is a collection of the fields (see
+                              TermStats.fields) which the term is matched
+                              against, or None for all fields.
+
+        Returns:
+            Dictionary of {id of article: score}.
+        """
+        self._ensure()
+        n = max(self._n, 1)
+        averages = [max(length / n, 1) for length in self._lengths]
+        idfs = [{word: log(1 + (n - self._df[word] + 0.5)
+                           / (self._df[word] + 0.5))
+                 for word in words} for words, _ in terms]
+        scores = {}
+        for article in articles:
+            counts = self.counts(article)
+            norms = [1 - self.b + self.b * sum(counter.values()) / average
+                     for counter, average in zip(counts, averages)]
+            score = 0
+            for (words, fields), idf in zip(terms, idfs):
+                best = 0
+                for word, weight in words.items():
+                    tf = sum(self.boosts[f] * counts[f][word] / norms[f]
+                             for f, name in enumerate(self.fields)
+                             if (fields is None or name in fields)
+                             and word in counts[f])
+                    if tf:
+                        best = max(best, weight * idf[word] * tf
+                                   * (self.k1 + 1) / (self.k1 + tf))
+                score += best
+            scores[id(article)] = score
+        return scores
+
+
+class ColumnWidths(LazyIndex):
+    """
+    Histograms of the widths of the columns that articles are listed in, so
+    that the widest entry in each column across the whole library is known
+    without looking at every article. The widths of each article are measured
+    by a function which is passed in (see listprint.get_widths()).
+    """
+    def __init__(self, measure, ncolumns):
+        super().__init__()
+        self._measure = measure
+        self._ncolumns = ncolumns
+        self._counts = [Counter() for _ in range(ncolumns)]  # width -> count
+        self._widest = [0] * ncolumns
+        # The widths of each article, as they were when it was added.
+        self._widths = {}
+
+    def clear(self):
+        self._counts = [Counter() for _ in range(self._ncolumns)]
+        self._widest = [0] * self._ncolumns
+        self._widths.clear()
+        self._pending = None
+
+    def add(self, article):
+        if self._defer(article, True):
+            return
+        widths = tuple(self._measure(article)[:self._ncolumns])
+        self._widths[id(article)] = widths
+        for column, width in enumerate(widths):
+            self._counts[column][width] += 1
+            self._widest[column] = max(self._widest[column], width)
+
+    def remove(self, article):
+        if self._defer(article, False):
+            return
+        for column, width in enumerate(self._widths.pop(id(article), ())):
+            counts = self._counts[column]
+            counts[width] -= 1
+            if counts[width] == 0:
+                del counts[width]
+                if width == self._widest[column]:
+                    self._widest[column] = max(counts, default=0)
+
+    def widest(self):
+        """
+        Returns a tuple with the width of the widest entry in each column.
+        """
+        self._ensure()
+        return tuple(self._widest)
+
+    def __len__(self):
+        self._ensure()
+        return len(self._widths)
+
+
+class HaystackIndex(Index):
+    """
+    The search haystacks of all articles (see Article.make_haystack()) joined
+    into one buffer, so that a regex can be run over the whole library in one
+    go instead of over each field of each article in turn. Each field is
+    followed by a newline.
+
+    The buffer is rebuilt when it is next needed after any change. This is
+    cheap, because the haystacks themselves are cached on the articles.
+
+    The index also keeps track of the articles which were added since their
+    haystacks were last restored from, or saved to, the persisted haystacks
+    (see unread() and unsaved()), so that searching doesn't need to go
+    through the whole library to find them.
+    """
+    # Constructs which can behave differently at the start or end of a field
+    # than at the same place in the buffer. Queries containing them are
+    # matched against each article separately.
+    _unsafe_re = re.compile(r"\\[AZ]|\(\?<?[=!]")
+
+    def __init__(self):
+        self._list = {}      # the articles, keyed by id
+        self._buffer = None  # None if it needs to be rebuilt
+        self._articles = []  # the articles in the buffer, in order
+        self._starts = []    # the offset of each article in the buffer
+        # Indices of articles with newlines inside their haystacks.
+        self._multiline = set()
+        # Articles whose persisted haystacks haven't been looked for, and
+        # those whose haystacks haven't been persisted, keyed by id.
+        self._unread = {}
+        self._unsaved = {}
+
+    def clear(self):
+        self._list = {}
+        self._buffer = None
+        self._unread = {}
+        self._unsaved = {}
+
+    def rebuild(self, articles):
+        self._list = {id(a): a for a in articles}
+        self._buffer = None
+        self._unread = dict(self._list)
+        self._unsaved = dict(self._list)
+
+    def add(self, article):
+        self._buffer = None
+        self._list[id(article)] = article
+        self._unread[id(article)] = article
+        self._unsaved[id(article)] = article
+
+    def remove(self, article):
+        self._buffer = None
+        self._list.pop(id(article), None)
+        self._unread.pop(id(article), None)
+        self._unsaved.pop(id(article), None)
+
+    def unread(self):
+        """
+        Returns the articles added since this was last called, whose
+        persisted haystacks haven't been looked for yet.
+        """
+        articles = list(self._unread.values())
+        self._unread = {}
+        return articles
+
+    def unsaved(self):
+        """
+        Returns the articles whose haystacks have been computed, but haven't
+        been persisted yet.
+        """
+        return [a for a in self._unsaved.values()
+                if a._cached("haystack") is not None]
+
+    def saved(self, articles):
+        """
+        Records that the haystacks of the given articles are persisted.
+        """
+        for article in articles:
+            self._unsaved.pop(id(article), None)
+
+    def _ensure(self):
+        if self._buffer is not None:
+            return
+        self._articles = list(self._list.values())
+        self._starts = []
+        self._multiline = set()
+        parts = []
+        pos = 0
+        for i, article in enumerate(self._articles):
+            haystack = article.make_haystack()
+            if any("\n" in field for field in haystack):
+                self._multiline.add(i)
+                haystack = [field.replace("\n", " ") for field in haystack]
+            part = "\n".join(haystack) + "\n"
+            self._starts.append(pos)
+            parts.append(part)
+            pos += len(part)
+        self._buffer = "".join(parts)
+
+    def search(self, query):
+        """
+        Finds the articles which match a compiled regex, in exactly the same
+        way as Article.search().
+
+        Returns:
+            The set of ids of the matching articles.
+        """
+        if self._unsafe_re.search(query.pattern):
+            return {id(article) for article in self._list.values()
+                    if article.search(query)[0]}
+        self._ensure()
+        # With MULTILINE, ^ and $ match at the start and end of every field,
+        # just as they would for each field on its own.
+        pattern = re.compile(query.pattern, query.flags | re.MULTILINE)
+        ids = set()
+        pos = 0
+        while True:
+            m = pattern.search(self._buffer, pos)
+            if m is None:
+                break
+            i = bisect_right(self._starts, m.start()) - 1
+            article = self._articles[i]
+            # A match which runs past the end of a field (or one in an article
+            # whose fields had to be changed for the buffer) might not be a
+            # match in the field itself, so it has to be checked. It might
+            # also have skipped over matches in the next few articles, but
+            # that is fine because the search restarts at the next article.
+            if (("\n" not in m.group() and i not in self._multiline)
+                    or article.search(query)[0]):
+                ids.add(id(article))
+            if i + 1 == len(self._articles):
+                break
+            pos = self._starts[i + 1]
+        return ids
+
+
+_indexes = []
+
+
+def register(index):
+    """
+    Registers an index so that it is kept in sync with the article list.
+
+    Returns:
+        The index.
+    """
+    _indexes.append(index)
+    return index
+
+
+def add(article):
+    for index in _indexes:
+        index.add(article)
+
+
+def remove(article):
+    for index in _indexes:
+        index.remove(article)
+
+
+def replace(old, new):
+    for index in _indexes:
+        index.replace(old, new)
+
+
+def rebuild(articles):
+    for index in _indexes:
+        index.rebuild(articles)
+
+
+dois = register(DOIIndex())
+years = register(YearIndex())
+journals = register(JournalIndex())
+tokens = register(TokenIndex())
+terms = register(TermStats())
+haystacks = register(HaystackIndex())
@@ -0,0 +1,190 @@
+"""
+latex.py
+--------
+
+Conversion of Unicode text to LaTeX, for BibLaTeX citations.
+
+Accented letters are converted to accent macros by decomposing them (NFD)
+into a base letter and combining marks, so all of Latin-1, Latin Extended-A
+and -B, and Latin Extended Additional are covered without listing every
+character by hand. Characters which don't decompose (e.g. "\u00f8") and other
+symbols are listed in _special. Everything is compiled into one table when
+the module is imported, and a string is converted in a single pass which only
+stops at its non-ASCII characters.
+"""
+
+import re
+import unicodedata
+
+# LaTeX accent macros for combining marks. Macros made of a symbol can be
+# followed directly by a single letter, e.g. \'e; macros made of a letter
+# need braces, e.g. \v{c}.
+_accents = {
+    "\u0300": "`", "\u0301": "'", "\u0302": "^", "\u0303": "~",
+    "\u0304": "=", "\u0306": "u", "\u0307": ".", "\u0308": '"',
+    "\u030a": "r", "\u030b": "H", "\u030c": "v", "\u0323": "d",
+    "\u0327": "c", "\u0328": "k", "\u0331": "b",
+}
+
+# Characters which can't be built from accents, or which have a more usual
+# LaTeX form.
+_special = {
+    "\u00a0": "~", "\u00a7": "{\\S}", "\u00ad": "\\-",
+    "\u00b0": "{\\textdegree}", "\u00b1": "\\(\\pm\\)",
+    "\u00b5": "\\(\\mu\\)", "\u00b7": "\\(\\cdot\\)",
+    "\u00b2": "\\textsuperscript{2}", "\u00b3": "\\textsuperscript{3}",
+    "\u00b9": "\\textsuperscript{1}",
+    "\u00c5": "{\\AA}", "\u00c6": "{\\AE}", "\u00d0": "{\\DH}",
+    "\u00d7": "\\(\\times\\)", "\u00d8": "{\\O}", "\u00de": "{\\TH}",
+    "\u00df": "{\\ss}", "\u00e5": "{\\aa}", "\u00e6": "{\\ae}",
+    "\u00f0": "{\\dh}", "\u00f7": "\\(\\div\\)", "\u00f8": "{\\o}",
+    "\u00fe": "{\\th}",
+    "\u0110": "{\\DJ}", "\u0111": "{\\dj}", "\u0131": "{\\i}",
+    "\u0141": "{\\L{}}", "\u0142": "{\\l{}}", "\u014a": "{\\NG}",
+    "\u014b": "{\\ng}", "\u0152": "{\\OE}", "\u0153": "{\\oe}",
+    "\u0237": "{\\j}",
+    "\u03d1": "\\(\\vartheta\\)", "\u03d5": "\\(\\phi\\)",
+    "\u03f5": "\\(\\epsilon\\)",
+    "\u2009": "\\,", "\u2010": "-", "\u2011": "-", "\u2012": "-",
+    "\u2013": "--", "\u2014": "---", "\u2018": "`", "\u2019": "'",
+    "\u201c": "``", "\u201d": "''", "\u2026": "{\\ldots}",
+    "\u2032": "\\('\\)", "\u2190": "\\(\\leftarrow\\)",
+    "\u2192": "\\(\\rightarrow\\)", "\u2194": "\\(\\leftrightarrow\\)",
+    "\u21cc": "\\(\\rightleftharpoons\\)", "\u2212": "\\(-\\)",
+    "\u2248": "\\(\\approx\\)", "\u2264": "\\(\\leq\\)",
+    "\u2265": "\\(\\geq\\)",
+}
+
+# Capital Greek letters which look like Latin ones don't have macros.
+_greek_latin = {
+    "ALPHA": "A", "BETA": "B", "EPSILON": "E", "ZETA": "Z", "ETA": "H",
+    "IOTA": "I", "KAPPA": "K", "MU": "M", "NU": "N", "OMICRON": "O",
+    "RHO": "P", "TAU": "T", "CHI": "X",
+}
+_greek_small = {"lamda": "lambda", "epsilon": "varepsilon", "phi": "varphi",
+                "final sigma": "varsigma"}
+
+# Latin blocks whose accented letters are converted.
+_latin_ranges = (range(0x00c0, 0x0250), range(0x1e00, 0x1f00))
+
+# Characters which need to be looked up in the table.
+_nonascii_re = re.compile("[^\x00-\x7f]")
+# Combining marks left over after normalisation, see encode().
+_combining_re = re.compile("([A-Za-z])([\u0300-\u036f]+)")
+
+
+def _accented(base, marks):
+    """
+    Builds the LaTeX for a letter with one or more accents, e.g. an "e" with
+    an acute accent gives "{\\'e}". Returns None if any of the accents isn't
+    supported.
+    """
+    s = base
+    for mark in marks:
+        macro = _accents.get(mark)
+        if macro is None:
+            return None
+        if macro.isalpha():
+            s = f"\\{macro}{{{s}}}"
+        elif len(s) == 1:
+            s = f"\\{macro}{s}"
+        else:
+            s = f"\\{macro}{{{s}}}"
+    return "{" + s + "}"
+
+
+def _greek(c):
+    """
+    Returns the LaTeX for a Greek letter, or None if c isn't one.
+    """
+    try:
+        name = unicodedata.name(c)
+    except ValueError:
+        return None
+    for prefix, capital in (("GREEK CAPITAL LETTER ", True),
+                            ("GREEK SMALL LETTER ", False)):
+        if name.startswith(prefix):
+            letter = name[len(prefix):]
+            break
+    else:
+        return None
+    if capital:
+        if letter in _greek_latin:
+            return _greek_latin[letter]
+        macro = letter.capitalize().replace("Lamda", "Lambda")
+    elif letter == "OMICRON":
+        return "o"
+    else:
+        macro = _greek_small.get(letter.lower(), letter.lower())
+    return f"\\(\\{macro}\\)"
+
+
+def _make_table():
+    """
+    Builds the table of characters and their LaTeX equivalents used by
+    encode().
+    """
+    table = {}
+    for block in _latin_ranges:
+        for code in block:
+            decomposed = unicodedata.normalize("NFD", chr(code))
+            if (len(decomposed) > 1 and decomposed[0].isascii()
+                    and decomposed[0].isalpha()):
+                latex = _accented(decomposed[0], decomposed[1:])
+                if latex is not None:
+                    table[chr(code)] = latex
+    for code in list(range(0x0391, 0x03aa)) + list(range(0x03b1, 0x03ca)):
+        latex = _greek(chr(code))
+        if latex is not None:
+            table[chr(code)] = latex
+    table.update(_special)
+    return table
+
+
+_table = _make_table()
+
+
+def _lookup(match):
+    c = match.group()
+    return _table.get(c, c)
+
+
+def encode(s):
+    """
+    Converts the non-ASCII characters in a string to their LaTeX equivalents.
+    Characters which LaTeX doesn't have an equivalent for are left as they
+    are.
+
+    The string is first normalised (NFC), so that letters followed by
+    combining accents are treated in the same way as precomposed ones. The
+    few combining accents which are left over (those on letters which don't
+    have a precomposed form) are dealt with separately.
+
+    Arguments:
+        s (str) : The string to convert.
+
+    Returns:
+        The converted string.
+    """
+    if s.isascii():
+        return s
+    s = _nonascii_re.sub(_lookup, unicodedata.normalize("NFC", s))
+    if not s.isascii():
+        s = _combining_re.sub(
+            lambda m: _accented(m.group(1), m.group(2)) or m.group(0), s)
+    return s
+
+
+def encode_all(strings):
+    """
+    Converts many strings at once, e.g. the citations for a whole library.
+
+    Arguments:
+        strings (iterable) : The strings to convert.
+
+    Returns:
+        A list of the converted strings, in the same order.
+    """
+    # Joining the strings together and converting them in one go turns out to
+    # be no faster, because encode() skips ASCII-only strings very quickly.
+    return [encode(s) for s in strings]
@@ -3,22 +3,40 @@ listprint.py
 ------------
 
 All functions needed to print lists. It's surprisingly complicated!
+
+Lists which are too long to fit in the terminal are shown in a pager (see
+_Pager), which only formats the articles on screen.
 """
 
 
 import os
-from copy import deepcopy
+import sys
+from collections import namedtuple
 from itertools import zip_longest
 
+import prompt_toolkit as pt
+from prompt_toolkit.formatted_text import ANSI
+from prompt_toolkit.key_binding import KeyBindings
+from prompt_toolkit.layout import Layout, Window
+from prompt_toolkit.layout.controls import FormattedTextControl
+
+from . import availability
+from . import index
 from ._shared import *
 
 _formatstr = "{0:<{1}}{2:{3}}{4:<{5}}{6:{7}}{8:{9}}"
 
+# The values needed to print one article. Listing works on these rather than
+# on the articles themselves, which are never modified (or copied).
+Row = namedtuple("Row", ["refno", "authors", "year", "journal",
+                         "volume_info", "title", "doi", "availability"])
+
 
 def print_list(articles, refnos, max_auth=5):
     """
     Prints a series of articles and refnos, along with the PDF/SI availability
-    of each article.
+    of each article. If the list is longer than the terminal, and the output
+    is going to the terminal, it is shown in a pager instead.
 
     Arguments:
         articles (list) : List of articles to be printed.
@@ -36,93 +54,140 @@ def print_list(articles, refnos, max_auth=5):
     if len(articles) != len(refnos):
         raise ValueError("articles and refnos do not have same length")
 
-    # Make a copy of the articles
-    articles = deepcopy(articles)
-
     # Calculate field sizes and set format string
     field_sizes = get_field_sizes(articles, refnos)
 
-    # Construct and print the list header
-    print_list_head(field_sizes)
+    # Use the PDFs and SIs as they are now
+    availability.refresh(_g.currentPath)
+
+    if sys.stdout.isatty() and _too_long(articles, field_sizes, max_auth):
+        _Pager(articles, refnos, field_sizes, max_auth).run()
+        return
+
+    # Pick out what is needed from the articles
+    rows = [make_row(article, refno)
+            for article, refno in zip(articles, refnos)]
+
+    # Construct the list header and all the articles
+    lines = format_list_head(field_sizes)
+    for row in rows:
+        lines.extend(format_list_article(row, field_sizes, max_auth=max_auth))
 
-    # Print all articles
-    for article, refno in zip(articles, refnos):
-        print_list_article(article, refno, field_sizes, max_auth=max_auth)
+    # Print it all with one write. Printing each line separately is slow,
+    # especially when stdout is patched by prompt_toolkit.
+    lines.append("")
+    sys.stdout.write("\n".join(lines))
+    sys.stdout.flush()
 
 
-def print_list_head(field_sizes):
+def make_row(article, refno):
     """
-    Prints the header of the list.
+    Collects the values needed to print one article.
+
+    Returns: A Row.
+    """
+    return Row(refno,
+               article.format_authors(style="display"),
+               article.year,
+               article.format_short_journalname(),
+               article.get_volume_info(),
+               article.title,
+               article.doi,
+               article.get_availability_string())
+
+
+def format_list_head(field_sizes):
+    """
+    Constructs the header of the list.
+
+    Returns: List of lines (without newlines).
     """
     # blank row
-    print()
-    # header row
-    print(_g.ansiBold
-          + _formatstr.format("#", field_sizes["number"],
-                              "Authors", field_sizes["author"],
-                              "Year", field_sizes["year"],
-                              "Journal", field_sizes["journal"],
-                              "Title & DOI", field_sizes["title"])
-          + _g.ansiReset)
-    # a horizontal line
-    print("-" * sum(field_sizes.values()))
+    return ["",
+            # header row
+            _g.ansiBold
+            + _formatstr.format("#", field_sizes["number"],
+                                "Authors", field_sizes["author"],
+                                "Year", field_sizes["year"],
+                                "Journal", field_sizes["journal"],
+                                "Title & DOI", field_sizes["title"])
+            + _g.ansiReset,
+            # a horizontal line
+            "-" * sum(field_sizes.values())]
 
 
-def print_list_article(article, refno, field_sizes, max_auth):
+def format_list_article(row, field_sizes, max_auth):
     """
-    Print one article.
+    Constructs the lines for one article.
 
     Arguments:
-        article (dict)     : The article.
-        refno (int)        : The reference number.
+        row (Row)          : The article, as generated by make_row().
         field_sizes (dict) : The field sizes for each column of the list. These
                              are generated by get_field_sizes().
         max_auth (int)     : Number of authors to print. If 0 or negative
                              prints all authors.
 
-    Returns: None.
+    Returns: List of lines (without newlines).
     """
     # We now need to construct each column of information, one at a time.
     # 1. Number column (refno): just has one piece of information.
-    number_column = [refno]
+    number_column = [row.refno]
     # 2. Author column: Has all authors listed in the format 'JRJ Yong'
     # The field width has been calculated carefully earlier to make sure that
     # no names are clipped.
-    author_column = article.format_authors(style="display")
+    author_column = row.authors
     # Truncate author lists depending on max_auth
     if max_auth > 0 and len(author_column) > max_auth:
         author_column = [*author_column[:max_auth - 2],
                          "...",
                          author_column[-1]]
     # 3. Year column: just one piece of information
-    year_column = [article.year]
+    year_column = [row.year]
     # 4. Journal column: has the journal short name, as well as volume info
-    journal_column = [article.format_short_journalname(),
-                      article.get_volume_info()]
+    journal_column = [row.journal, row.volume_info]
     # 5. Title and DOI column: has title, DOI, and the availability
     # The title must be split according to the field width.
     n = field_sizes["title"]
-    title_column = [article.title[i:i+n]
-                    for i in range(0, len(article.title), n)]
+    title_column = [row.title[i:i+n]
+                    for i in range(0, len(row.title), n)]
     # Then we tack on the DOI and the availability string.
-    title_column.extend([article.doi,
-                         article.get_availability_string()])
-
-    # Now, print everything!
-    for number, author, year, journal, title in zip_longest(number_column,
-                                                            author_column,
-                                                            year_column,
-                                                            journal_column,
-                                                            title_column,
-                                                            fillvalue=""):
-        print(_formatstr.format(number, field_sizes["number"],
-                                author, field_sizes["author"],
-                                year, field_sizes["year"],
-                                journal, field_sizes["journal"],
-                                title, field_sizes["title"])
-              )
-    # Print blank line for readability
-    print()
+    title_column.extend([row.doi, row.availability])
+
+    # Now, put everything together!
+    lines = [_formatstr.format(number, field_sizes["number"],
+                               author, field_sizes["author"],
+                               year, field_sizes["year"],
+                               journal, field_sizes["journal"],
+                               title, field_sizes["title"])
+             for number, author, year, journal, title
+             in zip_longest(number_column, author_column, year_column,
+                            journal_column, title_column, fillvalue="")]
+    # Blank line for readability
+    lines.append("")
+    return lines
+
+
+def get_widths(article):
+    """
+    Measures the columns of an article. This is cached on the article.
+
+    Returns:
+        Tuple of (width of the longest author, width of the journal column,
+        length of the title, number of authors).
+    """
+    def widths():
+        authors = article.format_authors(style="display")
+        return (max(len(author) for author in authors),
+                max(len(article.format_short_journalname()),
+                    len(article.get_volume_info())),
+                len(article.title),
+                len(authors))
+
+    return article._memo("widths", widths)
+
+
+# The widest author, journal, and title in the whole library.
+widths = index.register(index.ColumnWidths(get_widths, 3))
 
 
 def get_field_sizes(articles, refnos, padding=2):
@@ -131,31 +196,34 @@ def get_field_sizes(articles, refnos, padding=2):
     characters that each column should occupy.
 
     Arguments:
-        articles (list of dict) : The articles to be printed.
-        refnos (list of int)    : The reference numbers of the articles.
-        padding (int)           : The padding between each column.
+        articles (list of Article) : The articles to be printed.
+        refnos (list of int)       : The reference numbers of the articles.
+        padding (int)              : The padding between each column.
 
     Returns:
         Dictionary of field sizes, with keys "number", "author", "year",
         "journal", and "title" for each of the five respective columns.
     """
-    number_fs = max(len(str(r)) for r in refnos) + padding
-    author_fs = max(max(max(len(i)
-                            for i in article.format_authors(style="display"))
-                        for article in articles),
-                    len("Authors")
-                    ) + padding
+    # When listing the whole library (which is the usual case), the widest
+    # entries are already known, so the articles don't need to be looked at.
+    if len(articles) == len(_g.articleList) == len(widths):
+        author_w, journal_w, title_w = widths.widest()
+        number_w = len(str(len(articles)))
+    else:
+        measured = [get_widths(article) for article in articles]
+        author_w = max(w[0] for w in measured)
+        journal_w = max(w[1] for w in measured)
+        title_w = max(w[2] for w in measured)
+        number_w = len(str(max(refnos)))
+    number_fs = number_w + padding
+    author_fs = max(author_w, len("Authors")) + padding
     year_fs = 4 + padding
-    journal_fs = max(max(len(art.format_short_journalname())
-                         for art in articles),
-                     max(len(art.get_volume_info()) for art in articles),
-                     len("Journal")
-                     ) + padding
+    journal_fs = max(journal_w, len("Journal")) + padding
     # Use up the remaining space in the terminal, but don't extend beyond the
     # longest title, as there's no need to.
     remaining_columns = (os.get_terminal_size().columns - number_fs - author_fs
                          - year_fs - journal_fs)
-    title_fs = min(remaining_columns, max(len(a.title) for a in articles))
+    title_fs = min(remaining_columns, title_w)
     # When you print ANSI escape codes, you have to make sure that all the
     # characters in the escape code are on the same line, otherwise the colour
     # for the subsequent lines gets completely messed up.
@@ -168,3 +236,130 @@ def get_field_sizes(articles, refnos, padding=2):
             "year": year_fs,
             "journal": journal_fs,
             "title": title_fs}
+
+
+def _count_lines(article, field_sizes, max_auth):
+    """
+    Returns the number of lines which format_list_article() produces for an
+    article, without formatting it.
+    """
+    _, _, title_length, nauthors = get_widths(article)
+    if max_auth > 0:
+        nauthors = min(nauthors, max_auth)
+    # The title is followed by the DOI and the availability, and then there is
+    # a blank line.
+    ntitle = -(-title_length // field_sizes["title"]) + 2
+    return max(nauthors, 2, ntitle) + 1
+
+
+def _too_long(articles, field_sizes, max_auth):
+    """
+    Checks whether a list is too long to fit in the terminal.
+    """
+    rows = os.get_terminal_size().lines
+    total = 3   # the header
+    for article in articles:
+        total += _count_lines(article, field_sizes, max_auth)
+        if total > rows:
+            return True
+    return False
+
+
+class _Pager():
+    """
+    Full-screen view of a list, which can be scrolled through one article or
+    one page at a time. Only the articles on screen are formatted, so even
+    very long lists are shown straight away.
+    """
+    help = "j/k: scroll  space/b: page  g/G: top/bottom  q: quit"
+
+    def __init__(self, articles, refnos, field_sizes, max_auth):
+        self.articles = articles
+        self.refnos = list(refnos)
+        self.field_sizes = field_sizes
+        self.max_auth = max_auth
+        # The header, without the blank line at the top.
+        self.head = format_list_head(field_sizes)[1:]
+        self.top = 0      # index of the first article on screen
+        self.bottom = 0   # index after the last article on screen
+
+        kb = KeyBindings()
+        kb.add("j")(kb.add("down")(kb.add("enter")(self._scroll_down)))
+        kb.add("k")(kb.add("up")(self._scroll_up))
+        kb.add(" ")(kb.add("f")(kb.add("pagedown")(self._page_down)))
+        kb.add("b")(kb.add("pageup")(self._page_up))
+        kb.add("g")(kb.add("home")(self._go_top))
+        kb.add("G")(kb.add("end")(self._go_bottom))
+        kb.add("q")(kb.add("escape")(kb.add("c-c")(self._quit)))
+        self.app = pt.Application(
+            layout=Layout(Window(FormattedTextControl(self._render),
+                                 wrap_lines=False)),
+            key_bindings=kb, full_screen=True)
+
+    def run(self):
+        # This is called from inside the prompt's event loop, so the pager
+        # needs its own.
+        self.app.run(in_thread=True)
+
+    def _format(self, i):
+        return format_list_article(make_row(self.articles[i], self.refnos[i]),
+                                   self.field_sizes, self.max_auth)
+
+    def _page_height(self):
+        # Space for articles, leaving room for the header and the status line.
+        return max(self.app.output.get_size().rows - len(self.head) - 1, 1)
+
+    def _render(self):
+        height = self._page_height()
+        lines = []
+        i = self.top
+        while i < len(self.articles):
+            block = self._format(i)
+            # Always show at least one article, even if it doesn't fit.
+            if len(lines) + len(block) > height and i > self.top:
+                break
+            lines.extend(block)
+            i += 1
+        self.bottom = i
+        lines = lines[:height]
+        lines.extend([""] * (height - len(lines)))
+        status = (f"{_g.ansiBold}articles {self.top + 1}-{self.bottom} of "
+                  f"{len(self.articles)}{_g.ansiReset}    {self.help}")
+        return ANSI("\n".join(self.head + lines + [status]))
+
+    def _start_of_page_ending(self, end):
+        """
+        Finds the first article of the page which ends just before the
+        article with index end.
+        """
+        height = self._page_height()
+        i, used = end, 0
+        while i > 0:
+            used += _count_lines(self.articles[i - 1], self.field_sizes,
+                                 self.max_auth)
+            if used > height:
+                break
+            i -= 1
+        return min(i, max(end - 1, 0))
+
+    def _scroll_down(self, event):
+        self.top = min(self.top + 1, len(self.articles) - 1)
+
+    def _scroll_up(self, event):
+        self.top = max(self.top - 1, 0)
+
+    def _page_down(self, event):
+        if self.bottom < len(self.articles):
+            self.top = self.bottom
+
+    def _page_up(self, event):
+        self.top = self._start_of_page_ending(self.top)
+
+    def _go_top(self, event):
+        self.top = 0
+
+    def _go_bottom(self, event):
+        self.top = self._start_of_page_ending(len(self.articles))
+
+    def _quit(self, event):
+        event.app.exit()
@@ -5,7 +5,6 @@ prompt.py
 Class that controls the main REPL.
 """
 
-import asyncio
 import re
 from pathlib import Path
 
@@ -106,109 +105,107 @@ class peepPrompt():
 
     async def loop(self):
         print(self.intro)
-        with pt.patch_stdout.patch_stdout():
-            while True:
-                try:
-                    line = await self.session.prompt_async(self.make_message(),
-                                                           style=self.style)
-                except KeyboardInterrupt:  # Ctrl-C
+        while True:
+            try:
+                # Anything printed while the prompt is shown (e.g. by other
+                # tasks) goes above it. Leaving patch_stdout() waits for all
+                # of that to be written, so commands then write straight to
+                # the terminal without racing against the next prompt.
+                with pt.patch_stdout.patch_stdout():
+                    line = await self.session.prompt_async(
+                        self.make_message(), style=self.style)
+            except KeyboardInterrupt:  # Ctrl-C
+                continue
+            except EOFError:  # Ctrl-D
+                break
+            else:
+                # Skip empty lines.
+                if line.strip() == "":
+                    continue
+                # Otherwise, parse the line.
+                cmd, args, help = self.parse_line(line)
+
+                # Check for edge cases of help which cannot be delegated
+                # to the decorator.
+                if help and cmd == "":   # General help wanted
+                    print(self.intro)
                     continue
-                except EOFError:  # Ctrl-D
+                elif help and cmd in ["q", "quit", "zzzpeep"]:
+                    print(f"{_g.ansiHelpYellow}"
+                          f"\n    Quits the programme.\n{_g.ansiReset}")
+                    continue
+
+                # Run the desired command.
+                if cmd in ["q", "qu", "qui", "quit",             # QUIT
+                           "zzzpeep"]:
                     break
-                else:
-                    # Skip empty lines.
-                    if line.strip() == "":
-                        continue
-                    # Otherwise, parse the line.
-                    cmd, args, help = self.parse_line(line)
-
-                    # Check for edge cases of help which cannot be delegated
-                    # to the decorator.
-                    if help and cmd == "":   # General help wanted
-                        print(self.intro)
-                        continue
-                    elif help and cmd in ["q", "quit", "zzzpeep"]:
-                        print(f"{_g.ansiHelpYellow}"
-                              f"\n    Quits the programme.\n{_g.ansiReset}")
-                        continue
-
-                    # Run the desired command.
-                    if cmd in ["q", "qu", "qui", "quit",             # QUIT
-                               "zzzpeep"]:
-                        break
-                    elif cmd in ["c", "ci", "cit", "cite"]:          # CITE
-                        await commands.cli_cite(args, help=help)
-                        # asyncio.create_task(commands.cli_cite(args, help=help))
-                    elif cmd in ["o", "op", "ope", "open"]:          # OPEN
-                        commands.cli_open(args, help=help)
-                    elif cmd in ["w", "wr", "wri", "writ",           # WRITE
-                                 "write"]:
-                        commands.cli_write(args, help=help)
-                    elif cmd in ["l", "li", "ls", "lis", "list"]:    # LIST
-                        commands.cli_list(args, help=help)
-                    elif cmd in ["cd"]:                              # CD
-                        commands.cli_cd(args, help=help)
-                    elif cmd in ["e", "ed", "edi", "edit"]:          # EDIT
-                        if help is False:
-                            _saveHist(cmd, args)
-                        commands.cli_edit(args, help=help)
-                    elif cmd in ["a", "ad", "add"]:                  # ADD
-                        if help is False:
-                            _saveHist(cmd, args)
-                        await commands.cli_add(args, help=help)
-                    elif cmd in ["d", "de", "del", "dele",           # DELETE
-                                 "delet", "delete"]:
-                        if help is False:
-                            _saveHist(cmd, args)
-                        await commands.cli_delete(args, help=help)
-                    elif cmd in ["u", "up", "upd", "upda",           # UPDATE
-                                 "updat", "update"]:
-                        if help is False:
-                            _saveHist(cmd, args)
-                        await commands.cli_update(args, help=help)
-                    elif cmd in ["s", "se", "search"]:               # SEARCH
-                        commands.cli_search(args, help=help)
-                    elif cmd in ["so", "sor", "sort"]:               # SORT
-                        if help is False:
-                            _saveHist(cmd, args)
-                        commands.cli_sort(args, help=help)
-                    elif cmd in ["i", "im", "imp", "impo",           # IMPORT
-                                 "impor", "import"]:
-                        if help is False:
-                            _saveHist(cmd, args)
-                        await commands.cli_import(args, help=help)
-                    elif cmd in ["ap", "addp", "addpd", "addpdf"]:   # ADDPDF
-                        await commands.cli_addpdf(args, help=help)
-                    elif cmd in ["dp", "delp", "delpd", "delpdf",    # DELETEPDF
-                                 "deletep", "deletepd", "deletepdf"]:
-                        await commands.cli_deletepdf(args, help=help)
-                    elif cmd in ["f", "fe", "fet", "fetc",           # FETCH
-                                 "fetch"]:
-                        await commands.cli_fetch(args, help=help)
-                    elif cmd in ["un", "und", "undo"]:               # UNDO
-                        _undo(help=help)
-                    elif cmd in ["exec"] and _g.debug:               # EXEC
-                        import traceback
-                        # Execute arbitrary code. Useful for inspecting internal state.
-                        try:
-                            exec("_res =  " + " ".join(args), globals(), locals())
-                            print(locals()["_res"])
-                        except Exception as e:
-                            traceback.print_exc()
-                    elif cmd in ["pee"]:                             # PEE
-                        print("zzzpee...")
-                    elif cmd in ["peep", "PEEP"]:                    # PEEP
-                        print("PEEP!")
-                    else:                                            # unknown
-                        _error("command '{}' not recognised".format(cmd))
-
-                    # Need a tiny sleep to paper over a weird bug.
-                    # Try removing this and spamming 'l' before quitting
-                    #  to see the bug.
-                    # There WILL be bugs if the time taken to print any
-                    #  output (e.g. 'l' with large databases) exceeds
-                    #  this sleep. With 3 references, printing takes a
-                    #  fraction of a millisecond. With 300 references
-                    #  it takes about 60 ms.
-                    await asyncio.sleep(0.1)   # 100 ms.
+                elif cmd in ["c", "ci", "cit", "cite"]:          # CITE
+                    await commands.cli_cite(args, help=help)
+                    # asyncio.create_task(commands.cli_cite(args, help=help))
+                elif cmd in ["o", "op", "ope", "open"]:          # OPEN
+                    commands.cli_open(args, help=help)
+                elif cmd in ["w", "wr", "wri", "writ",           # WRITE
+                             "write"]:
+                    commands.cli_write(args, help=help)
+                elif cmd in ["l", "li", "ls", "lis", "list"]:    # LIST
+                    commands.cli_list(args, help=help)
+                elif cmd in ["cd"]:                              # CD
+                    commands.cli_cd(args, help=help)
+                elif cmd in ["e", "ed", "edi", "edit"]:          # EDIT
+                    if help is False:
+                        _saveHist(cmd, args)
+                    commands.cli_edit(args, help=help)
+                elif cmd in ["a", "ad", "add"]:                  # ADD
+                    if help is False:
+                        _saveHist(cmd, args)
+                    await commands.cli_add(args, help=help)
+                elif cmd in ["d", "de", "del", "dele",           # DELETE
+                             "delet", "delete"]:
+                    if help is False:
+                        _saveHist(cmd, args)
+                    await commands.cli_delete(args, help=help)
+                elif cmd in ["u", "up", "upd", "upda",           # UPDATE
+                             "updat", "update"]:
+                    if help is False:
+                        _saveHist(cmd, args)
+                    await commands.cli_update(args, help=help)
+                elif cmd in ["s", "se", "search"]:               # SEARCH
+                    commands.cli_search(args, help=help)
+                elif cmd in ["so", "sor", "sort"]:               # SORT
+                    if help is False:
+                        _saveHist(cmd, args)
+                    commands.cli_sort(args, help=help)
+                elif cmd in ["i", "im", "imp", "impo",           # IMPORT
+                             "impor", "import"]:
+                    if help is False:
+                        _saveHist(cmd, args)
+                    await commands.cli_import(args, help=help)
+                elif cmd in ["ap", "addp", "addpd", "addpdf"]:   # ADDPDF
+                    await commands.cli_addpdf(args, help=help)
+                elif cmd in ["dp", "delp", "delpd", "delpdf",    # DELETEPDF
+                             "deletep", "deletepd", "deletepdf"]:
+                    await commands.cli_deletepdf(args, help=help)
+                elif cmd in ["f", "fe", "fet", "fetc",           # FETCH
+                             "fetch"]:
+                    await commands.cli_fetch(args, help=help)
+                elif cmd in ["un", "und", "undo"]:               # UNDO
+                    _undo(help=help)
+                elif cmd in ["exec"] and _g.debug:               # EXEC
+                    import traceback
+                    # Execute arbitrary code. Useful for inspecting internal state.
+                    try:
+                        exec("_res =  " + " ".join(args), globals(), locals())
+                        print(locals()["_res"])
+                    except Exception as e:
+                        traceback.print_exc()
+                elif cmd in ["pee"]:                             # PEE
+                    print("zzzpee...")
+                elif cmd in ["peep", "PEEP"]:                    # PEEP
+                    print("PEEP!")
+                else:                                            # unknown
+                    _error("command '{}' not recognised".format(cmd))
+
+                # Anything which changes the articles after this (e.g. from
+                # another task) isn't part of the command just run.
+                _endHist()
         return
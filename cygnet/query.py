@@ -0,0 +1,585 @@
+"""
+query.py
+--------
+
+The query language used by search, and by the commands which take a selection
+of articles.
+
+A query is made of terms, all of which have to match:
+
+    keeler              a word or regex, matched against the authors, journal
+                        and title (as search has always done)
+    ~keelr              a word, matched fuzzily
+    "pure shift"        an exact phrase
+    author:keeler       a word, regex or phrase, matched against one field
+                        only (author, title, journal, or doi)
+    year:2015..2019     a range of years or volumes; either end can be left
+                        out, e.g. 'year:2015..', or it can be a single year
+
+Terms can be combined with AND, OR, and NOT (which must be in capitals), and
+grouped with parentheses. NOT binds most tightly, then AND, then OR.
+
+A query is parsed into a tree of nodes, which is evaluated against the whole
+library at once. The terms of an AND are evaluated in order of cost: those
+which can be answered from an index (see index.py) come first, and the
+intersection of their results is then used to narrow down the articles that
+the more expensive regex terms have to be run on.
+
+The matching articles can then be ranked by how relevant they are to the
+words in the query (see rank()).
+
+Errors in the query are raised as ValueErrors.
+"""
+
+import re
+import abc
+
+from unidecode import unidecode
+
+from . import index
+
+# The costs of evaluating the different kinds of nodes.
+_INDEX = 0   # a lookup in an index
+_VOCAB = 1   # a scan over the vocabulary of the token index
+_SCAN = 2    # a regex run over every article
+
+# The fields which terms can be restricted to, with their aliases.
+_fields = {"author": "author", "authors": "author", "title": "title",
+           "journal": "journal", "year": "year", "volume": "volume",
+           "doi": "doi"}
+# The positions of the fields in the search haystack (see
+# Article.make_haystack()).
+_haystack_fields = {"author": [0], "title": [4], "journal": [1, 2, 3]}
+
+_operators = ("AND", "OR", "NOT")
+_field_re = re.compile(r"([a-z]+):(.+)", re.S)
+_range_re = re.compile(r"(\d*)(?:\.\.(\d*))?")
+_quoted_re = re.compile(r'"[^"]*"')
+
+
+class _Context():
+    """
+    The state of one evaluation of a query.
+    """
+    def __init__(self, articles):
+        self.articles = {id(article): article for article in articles}
+        self._results = {}
+
+    def result(self, node):
+        # Nodes are evaluated at most once.
+        if id(node) not in self._results:
+            self._results[id(node)] = node.evaluate(self)
+        return self._results[id(node)]
+
+
+class Node(abc.ABC):
+    """
+    Base class for the nodes of a query. Subclasses must implement
+    evaluate(), which finds the matching articles in the whole library, and
+    may implement test(), which checks a single article, and terms(), which
+    returns the words used for ranking (see rank()).
+    """
+    cost = _SCAN
+
+    @abc.abstractmethod
+    def evaluate(self, ctx):
+        pass
+
+    def terms(self):
+        return []
+
+    def test(self, article, ctx):
+        return id(article) in ctx.result(self)
+
+    def _filter(self, ids, ctx, keep=True):
+        """
+        Returns the ids (a subset of the library) which match (or, if keep is
+        False, don't match) this node. Expensive nodes are only run on those
+        articles, unless there are so many of them that evaluating the node
+        on the whole library at once is quicker.
+        """
+        if self.cost < _SCAN or len(ids) * 4 > len(ctx.articles):
+            return ids & ctx.result(self) if keep else ids - ctx.result(self)
+        return {i for i in ids
+                if self.test(ctx.articles[i], ctx) == keep}
+
+
+class And(Node):
+    def __init__(self, children, implicit=False):
+        self.children = children
+        # Whether the AND was implied by putting terms next to each other,
+        # rather than written out.
+        self.implicit = implicit
+
+    @property
+    def cost(self):
+        return min((child.cost for child in self.children
+                    if not isinstance(child, Not)), default=_SCAN)
+
+    def evaluate(self, ctx):
+        positive = [c for c in self.children if not isinstance(c, Not)]
+        negative = [c.child for c in self.children if isinstance(c, Not)]
+        # The cheapest terms are evaluated on the whole library, and the most
+        # selective of them are intersected first.
+        cheap = sorted((ctx.result(c) for c in positive if c.cost == _INDEX),
+                       key=len)
+        others = sorted((c for c in positive if c.cost != _INDEX),
+                        key=lambda c: c.cost)
+        if cheap:
+            ids = set(cheap[0])
+            for found in cheap[1:]:
+                ids &= found
+        elif others:
+            ids = set(ctx.result(others.pop(0)))
+        else:
+            ids = set(ctx.articles)
+        for child in others:
+            if not ids:
+                break
+            ids = child._filter(ids, ctx)
+        for child in sorted(negative, key=lambda c: c.cost):
+            if not ids:
+                break
+            ids = child._filter(ids, ctx, keep=False)
+        return ids
+
+    def test(self, article, ctx):
+        return all(child.test(article, ctx) for child in self.children)
+
+    def terms(self):
+        return [term for child in self.children for term in child.terms()]
+
+
+class Or(Node):
+    def __init__(self, children):
+        self.children = children
+
+    @property
+    def cost(self):
+        return max(child.cost for child in self.children)
+
+    def evaluate(self, ctx):
+        ids = set()
+        for child in self.children:
+            ids |= ctx.result(child)
+        return ids
+
+    def test(self, article, ctx):
+        return any(child.test(article, ctx) for child in self.children)
+
+    def terms(self):
+        return [term for child in self.children for term in child.terms()]
+
+
+class Not(Node):
+    def __init__(self, child):
+        self.child = child
+
+    @property
+    def cost(self):
+        return self.child.cost
+
+    def evaluate(self, ctx):
+        return set(ctx.articles) - ctx.result(self.child)
+
+    def test(self, article, ctx):
+        return not self.child.test(article, ctx)
+
+
+def _terms(text, plain, phrase, fields=None):
+    """
+    Returns the terms for ranking a word or phrase (see TermStats.score() in
+    index.py).
+    A word matches all the words in the index which contain it. Regexes
+    aren't used for ranking.
+    """
+    if plain:
+        words = [text]
+    elif phrase:
+        words = index.tokens.word_re.findall(text.lower())
+    else:
+        return []
+    return [({w: 1 for w in index.tokens.words_containing(word)}, fields)
+            for word in words]
+
+
+def _compile(pattern):
+    try:
+        return re.compile(pattern, flags=re.IGNORECASE)
+    except re.error as e:
+        raise ValueError(f"invalid regex '{pattern}' ({str(e)})")
+
+
+class Word(Node):
+    """
+    A word or regex (or, if phrase is True, an exact phrase) matched against
+    the whole search haystack.
+    """
+    def __init__(self, text, phrase=False):
+        self.text = text
+        self.phrase = phrase
+        self.plain = bool(index.tokens.plain_re.fullmatch(text))
+        self.regex = _compile(re.escape(text) if phrase else text)
+
+    @property
+    def cost(self):
+        return _VOCAB if self.plain else _SCAN
+
+    def terms(self):
+        return _terms(self.text, self.plain, self.phrase)
+
+    def evaluate(self, ctx):
+        if self.plain:
+            return index.tokens.search(self.text) & ctx.articles.keys()
+        return index.haystacks.search(self.regex) & ctx.articles.keys()
+
+    def test(self, article, ctx):
+        return article.search(self.regex)[0]
+
+
+class Fuzzy(Node):
+    """
+    A word matched fuzzily (see index.TokenIndex.fuzzy()).
+    """
+    cost = _VOCAB
+
+    def __init__(self, text):
+        self.text = text
+
+    def evaluate(self, ctx):
+        return index.tokens.fuzzy(self.text).keys() & ctx.articles.keys()
+
+    def terms(self):
+        # Similar words count for less, the less similar they are.
+        return [(index.tokens.similar_words(word), None) for word in
+                index.tokens.word_re.findall(self.text.lower())]
+
+
+class Field(Node):
+    """
+    A word, regex, or phrase matched against the author, title, or journal
+    fields.
+    """
+    def __init__(self, field, text, phrase=False):
+        self.field = field
+        self.text = text
+        self.phrase = phrase
+        self.plain = bool(index.tokens.plain_re.fullmatch(text))
+        self.regex = _compile(re.escape(text) if phrase else text)
+
+    @property
+    def cost(self):
+        if self.field == "journal":
+            return _INDEX
+        return _VOCAB if self.plain else _SCAN
+
+    def evaluate(self, ctx):
+        if self.field == "journal":
+            return index.journals.search(self.regex) & ctx.articles.keys()
+        # A plain word has to be in the haystack somewhere, so the token
+        # index can rule out most articles.
+        if self.plain:
+            ids = index.tokens.search(self.text) & ctx.articles.keys()
+        else:
+            ids = ctx.articles.keys()
+        return {i for i in ids if self.test(ctx.articles[i], ctx)}
+
+    def test(self, article, ctx):
+        haystack = article.make_haystack()
+        return any(self.regex.search(haystack[k])
+                   for k in _haystack_fields[self.field])
+
+    def terms(self):
+        return _terms(self.text, self.plain, self.phrase, (self.field,))
+
+
+class DOI(Node):
+    """
+    A DOI, or part of one.
+    """
+    cost = _INDEX
+
+    def __init__(self, text):
+        self.text = text.lower()
+
+    def evaluate(self, ctx):
+        article = index.dois.get(self.text)
+        if article is not None:
+            return {id(article)} & ctx.articles.keys()
+        return {i for i, article in ctx.articles.items()
+                if self.test(article, ctx)}
+
+    def test(self, article, ctx):
+        return article.doi is not None and self.text in article.doi.lower()
+
+
+class Range(Node):
+    """
+    A range of years or volumes. Either end may be None.
+    """
+    def __init__(self, field, low, high):
+        self.field = field
+        self.low = low
+        self.high = high
+
+    @property
+    def cost(self):
+        return _INDEX if self.field == "year" else _SCAN
+
+    def evaluate(self, ctx):
+        if self.field == "year":
+            return (index.years.range(self.low, self.high)
+                    & ctx.articles.keys())
+        return {i for i, article in ctx.articles.items()
+                if self.test(article, ctx)}
+
+    def test(self, article, ctx):
+        try:
+            value = int(getattr(article, self.field))
+        except (TypeError, ValueError):
+            return False
+        return ((self.low is None or value >= self.low)
+                and (self.high is None or value <= self.high))
+
+
+def _unquote(text):
+    """
+    Returns (text, whether it was quoted).
+    """
+    if len(text) >= 2 and text[0] == '"' and text[-1] == '"':
+        return text[1:-1], True
+    return text, False
+
+
+def _make_term(text):
+    """
+    Makes the node for a single term of a query.
+    """
+    text = unidecode(text)
+    m = _field_re.fullmatch(text)
+    if m is not None and m.group(1) in _fields:
+        field = _fields[m.group(1)]
+        value, quoted = _unquote(m.group(2))
+        if field in ("year", "volume"):
+            r = _range_re.fullmatch(value)
+            if r is None or not any(r.groups()):
+                raise ValueError(f"invalid {field} range '{value}'")
+            low = int(r.group(1)) if r.group(1) else None
+            if r.group(2) is None:
+                high = low          # a single number, not a range
+            else:
+                high = int(r.group(2)) if r.group(2) else None
+            return Range(field, low, high)
+        elif field == "doi":
+            return DOI(value)
+        return Field(field, value, phrase=quoted)
+    if text.startswith("~"):
+        return Fuzzy(text[1:])
+    value, quoted = _unquote(text)
+    return Word(value, phrase=quoted)
+
+
+def _words(args):
+    """
+    Groups command-line arguments back into the words of a query. A quoted
+    phrase is split into several arguments by the prompt, so these are joined
+    back together.
+
+    Returns:
+        A list of (word, number of arguments used up so far).
+    """
+    words = []
+    i = 0
+    while i < len(args):
+        word = args[i]
+        i += 1
+        while word.count('"') % 2 == 1 and i < len(args):
+            word = f"{word} {args[i]}"
+            i += 1
+        if word.count('"') % 2 == 1:
+            raise ValueError(f"unmatched quote in '{word}'")
+        words.append((word, i))
+    return words
+
+
+def _tokenize(args):
+    """
+    Splits command-line arguments into the tokens of a query: parentheses,
+    operators, and the text of terms. Parentheses are only taken to be
+    grouping terms if they aren't matched within the same word, so that
+    regexes like '(a|b)' still work.
+
+    Returns:
+        A list of (token, number of arguments used up so far).
+    """
+    tokens = []
+    for word, n in _words(args):
+        bare = _quoted_re.sub("", word)
+        opening = max(bare.count("(") - bare.count(")"), 0)
+        closing = max(bare.count(")") - bare.count("("), 0)
+        while opening and word.startswith("("):
+            tokens.append(("(", n))
+            word = word[1:]
+            opening -= 1
+        trailing = []
+        while closing and word.endswith(")"):
+            trailing.append((")", n))
+            word = word[:-1]
+            closing -= 1
+        if word:
+            tokens.append((word, n))
+        tokens.extend(trailing)
+    return tokens
+
+
+class _Parser():
+    """
+    Recursive-descent parser for queries, with the grammar
+
+        or   := and ("OR" and)*
+        and  := not (["AND"] not)*
+        not  := "NOT" not | atom
+        atom := "(" or ")" | term
+    """
+    def __init__(self, tokens):
+        self.tokens = [token for token, _ in tokens]
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def next(self):
+        token = self.peek()
+        if token is None:
+            raise ValueError("query ended unexpectedly")
+        self.pos += 1
+        return token
+
+    def parse(self):
+        node = self.parse_or()
+        if self.peek() is not None:
+            raise ValueError(f"unexpected '{self.peek()}' in query")
+        return node
+
+    def parse_or(self):
+        children = [self.parse_and()]
+        while self.peek() == "OR":
+            self.next()
+            children.append(self.parse_and())
+        return children[0] if len(children) == 1 else Or(children)
+
+    def parse_and(self):
+        children = [self.parse_not()]
+        implicit = True
+        while self.peek() not in (None, "OR", ")"):
+            if self.peek() == "AND":
+                self.next()
+                implicit = False
+            children.append(self.parse_not())
+        return children[0] if len(children) == 1 else And(children, implicit)
+
+    def parse_not(self):
+        if self.peek() == "NOT":
+            self.next()
+            return Not(self.parse_not())
+        return self.parse_atom()
+
+    def parse_atom(self):
+        token = self.next()
+        if token == "(":
+            node = self.parse_or()
+            if self.peek() != ")":
+                raise ValueError("unmatched '(' in query")
+            self.next()
+            return node
+        elif token in _operators or token == ")":
+            raise ValueError(f"unexpected '{token}' in query")
+        return _make_term(token)
+
+
+def parse(args):
+    """
+    Parses a query.
+
+    Arguments:
+        args (list) : The command-line arguments making up the query.
+
+    Returns:
+        The root node of the query, or None if args is empty.
+
+    Raises:
+        ValueError if the query is invalid.
+    """
+    tokens = _tokenize(args)
+    if not tokens:
+        return None
+    return _Parser(tokens).parse()
+
+
+def run(node, articles):
+    """
+    Finds the articles matching a query.
+
+    Arguments:
+        node (Node)     : The query, as returned by parse().
+        articles (list) : The articles to search through. The indexes must be
+                          up to date with these.
+
+    Returns:
+        The set of ids of the matching articles.
+    """
+    return _Context(articles).result(node)
+
+
+def rank(node, articles):
+    """
+    Ranks articles by their relevance to the words in a query, with BM25F
+    (see index.TermStats). Words in NOT terms, and regexes, don't count.
+
+    Arguments:
+        node (Node)     : The query, as returned by parse().
+        articles (list) : The articles to rank, which should be the ones
+                          matching the query.
+
+    Returns:
+        Dictionary of {id of article: score}, or None if the query has no
+        words to rank by.
+    """
+    terms = [term for term in node.terms() if term[0]] if node else []
+    if not terms:
+        return None
+    return index.terms.score(articles, terms)
+
+
+def _is_structured(token):
+    # Whether a token can only be part of a query, and not a refno or a
+    # format.
+    if token in _operators or token in "()" or token.startswith('"'):
+        return True
+    m = _field_re.fullmatch(token)
+    return m is not None and m.group(1) in _fields
+
+
+def selection_length(args):
+    """
+    Finds the number of leading arguments which make up a query, for commands
+    which take a selection of articles followed by other arguments (such as
+    formats). Plain words are only counted as part of the query if they come
+    straight after an operator or an opening parenthesis.
+
+    Returns:
+        The number of arguments, which is 0 if args doesn't start with a
+        query.
+    """
+    try:
+        tokens = _tokenize(args)
+    except ValueError:
+        return 0
+    n = 0
+    prev = None
+    for token, end in tokens:
+        if not (_is_structured(token) or prev in _operators or prev == "("):
+            break
+        n = end
+        prev = token
+    return n
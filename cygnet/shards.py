@@ -0,0 +1,295 @@
+"""
+shards.py
+---------
+
+Sharded storage for very large databases, as an alternative to peep.yaml. A
+directory uses this if it contains a peep.shards folder. fileio dispatches to
+the functions here, so the rest of the programme doesn't need to know about
+it.
+
+The articles are split between a fixed number of shards according to a hash
+of their DOI. Each shard is an ordinary YAML file of articles, just like
+peep.yaml. The folder also contains:
+
+    manifest.yaml - the names of the shards, and a hash of each of them
+    order         - the order of the article list, as one line per article
+                    containing its shard and its index within the shard
+
+Shards whose hash didn't change are not rewritten. Autosave goes further, and
+only dumps the shards which contain articles that changed (see
+append_journal()).
+"""
+
+import os
+import shutil
+import zlib
+import hashlib
+from collections import defaultdict
+from math import inf
+
+import yaml
+
+from . import fileio
+from . import index
+
+# Version of the manifest format.
+_version = 1
+# Number of shards for new databases.
+_nshards = 64
+
+
+def _shard_of(doi, nshards):
+    """
+    Returns the name of the shard which an article with the given DOI belongs
+    to. DOIs are case-insensitive, so they are lowercased first.
+    """
+    return f"{zlib.crc32(doi.lower().encode()) % nshards:02x}"
+
+
+def _write_atomic(fname, text):
+    """
+    Writes text to a file by writing it to a temporary file first and then
+    renaming it. Apart from being safer, this means that files are never
+    modified in place, so hard links to them (from backups) stay intact.
+    """
+    tmp = fname.with_name(fname.name + ".tmp")
+    with open(tmp, "w") as fp:
+        fp.write(text)
+    os.replace(tmp, fname)
+
+
+def _read_manifest(dirname):
+    """
+    Reads the manifest of a sharded database.
+
+    Raises:
+        FileNotFoundError: If there is no manifest.
+        yaml.YAMLError   : If it isn't in the appropriate format.
+    """
+    with open(dirname / "manifest.yaml", "r") as fp:
+        manifest = yaml.safe_load(fp)
+    if (not isinstance(manifest, dict)
+            or manifest.get("version") != _version
+            or not isinstance(manifest.get("shards"), dict)):
+        raise yaml.YAMLError(f"The manifest in {dirname} is not in the "
+                             "correct format.")
+    return manifest
+
+
+def read_articles(dirname):
+    """
+    Reads all articles from a sharded database, in order. The text of each
+    article is kept (see fileio.read_fragments()), so that shards which
+    don't change are never dumped again.
+
+    Raises:
+        yaml.YAMLError   : If the database is inconsistent or isn't in the
+                           appropriate format.
+    """
+    manifest = _read_manifest(dirname)
+    shard_articles = {}
+    try:
+        for name in manifest["shards"]:
+            shard_articles[name] = fileio.read_fragments(
+                dirname / f"{name}.yaml")
+            for i, article in enumerate(shard_articles[name]):
+                article._shard, article._shard_index = name, i
+        with open(dirname / "order", "r") as fp:
+            order = [line.split() for line in fp]
+        articles = [shard_articles[name][int(i)] for name, i in order]
+    except (OSError, KeyError, IndexError, ValueError):
+        raise yaml.YAMLError(f"The sharded database {dirname} is "
+                             "inconsistent.")
+    if len(articles) != sum(len(s) for s in shard_articles.values()):
+        raise yaml.YAMLError(f"The sharded database {dirname} is "
+                             "inconsistent.")
+    return articles
+
+
+def _write_shard(dirname, name, members, old_hash, base=None,
+                 base_hash=None):
+    """
+    Writes one shard, unless its hash shows that it hasn't changed. Articles
+    keep their place within the shard, and new articles are added to the
+    end, so that a shard which didn't change produces exactly the same text.
+
+    Arguments:
+        dirname (Path)  : The .shards folder to write to.
+        name (str)      : The name of the shard.
+        members (list)  : The articles in the shard.
+        old_hash (str)  : The hash of the shard as it was last written.
+        base (Path)     : Another sharded database. If the shard is identical
+                          to the one in base, it is hard-linked instead of
+                          being written again.
+        base_hash (str) : The hash of the shard in base.
+
+    Returns:
+        Tuple of (hash of the shard, whether any of the articles moved).
+    """
+    members.sort(key=lambda a: getattr(a, "_shard_index", inf))
+    text = fileio.dump_articles(members)
+    new_hash = hashlib.blake2b(text.encode()).hexdigest()
+    fname = dirname / f"{name}.yaml"
+    if old_hash == new_hash and fname.is_file():
+        pass
+    elif base_hash == new_hash:
+        fname.unlink(missing_ok=True)
+        try:
+            os.link(base / f"{name}.yaml", fname)
+        except OSError:   # e.g. the file system doesn't do hard links
+            shutil.copy2(base / f"{name}.yaml", fname)
+    else:
+        _write_atomic(fname, text)
+    moved = False
+    for i, article in enumerate(members):
+        if (getattr(article, "_shard", None) != name
+                or getattr(article, "_shard_index", None) != i):
+            article._shard, article._shard_index = name, i
+            moved = True
+    return new_hash, moved
+
+
+def _write_order(articles, dirname):
+    _write_atomic(dirname / "order",
+                  "".join(f"{a._shard} {a._shard_index}\n" for a in articles))
+
+
+def _write_manifest(hashes, dirname):
+    _write_atomic(dirname / "manifest.yaml",
+                  yaml.safe_dump({"version": _version, "shards": hashes}))
+
+
+def write_articles(articles, dirname, base=None):
+    """
+    Writes articles to a sharded database, creating it if necessary. Shards
+    which haven't changed since the last write are left untouched.
+
+    Arguments:
+        articles (list): List of articles.
+        dirname (Path) : The .shards folder to write to.
+        base (Path)    : Another sharded database (e.g. the previous backup).
+                         Shards which are identical to those in base are
+                         hard-linked instead of being written again.
+
+    Returns:
+        None.
+    """
+    dirname.mkdir(exist_ok=True)
+    try:
+        old_hashes = _read_manifest(dirname)["shards"]
+    except (FileNotFoundError, yaml.YAMLError):
+        old_hashes = {}
+    try:
+        base_hashes = _read_manifest(base)["shards"] if base else {}
+    except (FileNotFoundError, yaml.YAMLError):
+        base_hashes = {}
+
+    # Work out which shard each article goes in.
+    shard_articles = defaultdict(list)
+    for article in articles:
+        name = getattr(article, "_shard", None)
+        if name is None:
+            name = _shard_of(article.doi, _nshards)
+        shard_articles[name].append(article)
+
+    hashes = {}
+    for name, members in sorted(shard_articles.items()):
+        hashes[name], _ = _write_shard(dirname, name, members,
+                                       old_hashes.get(name), base,
+                                       base_hashes.get(name))
+
+    # Remove shards which are now empty.
+    for name in set(old_hashes) - set(hashes):
+        (dirname / f"{name}.yaml").unlink(missing_ok=True)
+
+    _write_order(articles, dirname)
+    _write_manifest(hashes, dirname)
+
+
+def append_journal(records, articles, dirname):
+    """
+    Saves the changes described by journal records (see _journal()). Sharded
+    databases don't have a separate journal. Instead, only the shards which
+    contain the DOIs in the records are dumped and written again; the other
+    shards aren't touched at all. The order file is only rewritten if an
+    article moved, and the manifest only if a shard changed.
+
+    Arguments:
+        records (list) : Journal records to be saved.
+        articles (list): The current list of articles.
+        dirname (Path) : The .shards folder to write to.
+
+    Returns:
+        None.
+    """
+    try:
+        hashes = _read_manifest(dirname)["shards"]
+    except (FileNotFoundError, yaml.YAMLError):
+        write_articles(articles, dirname)
+        return
+
+    # Every article is in the shard given by its DOI (see _Places), so the
+    # DOIs tell us which shards changed, even for deleted articles.
+    dirty = set()
+    moved = False
+    for record in records:
+        if record[0] == "put":
+            dirty.add(_shard_of(record[1], _nshards))
+            dirty.add(_shard_of(record[2].doi, _nshards))
+        elif record[0] == "insert":
+            dirty.add(_shard_of(record[2].doi, _nshards))
+            moved = True
+        elif record[0] == "delete":
+            dirty.add(_shard_of(record[1], _nshards))
+            moved = True
+        elif record[0] == "order":
+            moved = True
+
+    shard_articles = {name: [] for name in dirty}
+    for article in articles:
+        name = getattr(article, "_shard", None)
+        if name is None:
+            name = _shard_of(article.doi, _nshards)
+        if name in shard_articles:
+            shard_articles[name].append(article)
+
+    new_hashes = dict(hashes)
+    for name, members in sorted(shard_articles.items()):
+        if members:
+            new_hashes[name], shard_moved = _write_shard(dirname, name,
+                                                         members,
+                                                         hashes.get(name))
+            moved = moved or shard_moved
+        elif name in new_hashes:
+            del new_hashes[name]
+            (dirname / f"{name}.yaml").unlink(missing_ok=True)
+
+    if moved:
+        _write_order(articles, dirname)
+    if new_hashes != hashes:
+        _write_manifest(new_hashes, dirname)
+
+
+class _Places(index.Index):
+    """
+    Keeps track of where articles are in their shards. The only thing this
+    needs to do is to give an article which replaces another one (with the
+    same DOI) the same place, so that editing an article doesn't move it.
+    """
+    def clear(self):
+        pass
+
+    def add(self, article):
+        pass
+
+    def remove(self, article):
+        pass
+
+    def replace(self, old, new):
+        if (getattr(old, "_shard", None) is not None
+                and getattr(new, "_shard", None) is None
+                and old.doi.lower() == new.doi.lower()):
+            new._shard, new._shard_index = old._shard, old._shard_index
+
+
+index.register(_Places())
@@ -0,0 +1,251 @@
+"""
+sqlstore.py
+-----------
+
+SQLite storage for very large databases, as an alternative to peep.yaml. A
+directory uses this if it contains a peep.sqlite file. fileio dispatches to
+the functions here, so the rest of the programme doesn't need to know about
+it.
+
+Each article is one row, keyed by its DOI (case-insensitively, as elsewhere).
+The position column stores the order of the article list. Positions only have
+to be in the right order, not consecutive, so that inserting or moving an
+article only changes the position of that article (see _reposition()).
+
+This is only a storage format. As with the other formats, the whole database
+is read into memory when it is loaded, and searching and sorting are done on
+the articles in memory (using the indexes in index.py).
+"""
+
+import json
+import sqlite3
+from bisect import bisect_left
+from contextlib import closing
+from datetime import datetime
+
+from .cygcls import Article
+
+# Version of the schema, stored in the database as PRAGMA user_version.
+_schema_version = 2
+
+_schema = """
+CREATE TABLE IF NOT EXISTS articles (
+    doi           TEXT PRIMARY KEY COLLATE NOCASE,
+    position      REAL,
+    title         TEXT,
+    authors       TEXT,
+    journal_long  TEXT,
+    journal_short TEXT,
+    year          INTEGER,
+    volume,
+    issue,
+    pages         TEXT,
+    time_added    TEXT,
+    time_opened   TEXT
+);
+CREATE INDEX IF NOT EXISTS articles_position ON articles (position);
+"""
+
+# Converts a database from version 1, where DOIs were case-sensitive.
+_migrate_v1 = """
+DROP INDEX IF EXISTS articles_position;
+DROP INDEX IF EXISTS articles_year;
+DROP INDEX IF EXISTS articles_journal;
+ALTER TABLE articles RENAME TO articles_v1;
+""" + _schema + """
+INSERT OR REPLACE INTO articles SELECT * FROM articles_v1 ORDER BY position;
+DROP TABLE articles_v1;
+"""
+
+# Columns in the order used by _to_row() and _from_row().
+_columns = ("doi", "position", "title", "authors", "journal_long",
+            "journal_short", "year", "volume", "issue", "pages",
+            "time_added", "time_opened")
+
+
+def _connect(fname):
+    """
+    Opens a connection to the database, creating the table if necessary.
+    """
+    conn = sqlite3.connect(fname)
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version not in (0, 1, _schema_version):
+        conn.close()
+        raise sqlite3.DatabaseError(f"The database {fname} has an unknown "
+                                    f"schema version {version}.")
+    conn.executescript(_migrate_v1 if version == 1 else _schema)
+    conn.execute(f"PRAGMA user_version = {_schema_version}")
+    return conn
+
+
+def _to_row(article, position):
+    """
+    Converts an Article to a tuple of column values.
+    """
+    def iso(t):
+        return t.isoformat() if t is not None else None
+    authors = article.to_dict()["authors"]
+    return (article.doi, position, article.title,
+            json.dumps(authors, ensure_ascii=False),
+            article.journal_long, article.journal_short, article.year,
+            article.volume, article.issue, article.pages,
+            iso(article.time_added), iso(article.time_opened))
+
+
+def _from_row(row):
+    """
+    Converts a tuple of column values back to an Article.
+    """
+    def dt(s):
+        return datetime.fromisoformat(s) if s is not None else None
+    (doi, _, title, authors, journal_long, journal_short, year, volume,
+     issue, pages, time_added, time_opened) = row
+    return Article(title=title, authors=json.loads(authors),
+                   journal_long=journal_long, journal_short=journal_short,
+                   year=year, volume=volume, issue=issue, pages=pages,
+                   doi=doi, time_added=dt(time_added),
+                   time_opened=dt(time_opened))
+
+
+def read_articles(fname):
+    """
+    Reads all articles from the database, in order.
+
+    Raises:
+        sqlite3.DatabaseError: If the file is not a valid database.
+    """
+    with closing(_connect(fname)) as conn:
+        rows = conn.execute(f"SELECT {', '.join(_columns)} FROM articles "
+                            "ORDER BY position").fetchall()
+    return [_from_row(row) for row in rows]
+
+
+def write_articles(articles, fname):
+    """
+    Replaces the entire contents of the database with the given articles.
+    Saving changes is much cheaper with append_journal(), so this is only
+    used to create a database, or to convert one from another format.
+
+    If several articles have the same DOI, only the last one is kept.
+    """
+    placeholders = ", ".join("?" * len(_columns))
+    with closing(_connect(fname)) as conn, conn:
+        conn.execute("DELETE FROM articles")
+        conn.executemany(f"INSERT OR REPLACE INTO articles "
+                         f"VALUES ({placeholders})",
+                         (_to_row(article, i)
+                          for i, article in enumerate(articles)))
+
+
+def _increasing(values):
+    """
+    Finds a longest strictly increasing subsequence of values, ignoring any
+    which are None.
+
+    Returns:
+        The set of the indices of the values in it.
+    """
+    # The smallest value which ends an increasing run of each length, and
+    # its index.
+    tail_values, tails = [], []
+    previous = {}  # index -> index of the value before it in its run
+    for i, value in enumerate(values):
+        if value is None:
+            continue
+        k = bisect_left(tail_values, value)
+        previous[i] = tails[k - 1] if k > 0 else None
+        if k == len(tails):
+            tail_values.append(value)
+            tails.append(i)
+        else:
+            tail_values[k] = value
+            tails[k] = i
+    keep = set()
+    i = tails[-1] if tails else None
+    while i is not None:
+        keep.add(i)
+        i = previous[i]
+    return keep
+
+
+def _reposition(conn, articles):
+    """
+    Updates the positions in the database to match the order of articles.
+    The articles which are already in order relative to each other (the
+    longest such run) keep their positions, and the others are given
+    positions in between them, so that only the rows which moved are
+    written.
+    """
+    positions = {doi.lower(): position for doi, position
+                 in conn.execute("SELECT doi, position FROM articles")}
+    old = [positions.get(article.doi.lower()) for article in articles]
+    keep = _increasing(old)
+    new = list(old)
+    start = 0   # the first index which hasn't been given a position yet
+    for i in sorted(keep) + [len(articles)]:
+        if i > start:
+            low = new[start - 1] if start > 0 else None
+            high = old[i] if i < len(articles) else None
+            n = i - start
+            if low is None and high is None:
+                low, high = -1, n
+            elif low is None:
+                low = high - n - 1
+            elif high is None:
+                high = low + n + 1
+            for k in range(n):
+                new[start + k] = low + (high - low) * (k + 1) / (n + 1)
+        start = i + 1
+    # Repeatedly inserting in the same place eventually runs out of
+    # floating-point precision, in which case everything is renumbered.
+    if any(a >= b for a, b in zip(new, new[1:])):
+        new = list(range(len(articles)))
+    conn.executemany("UPDATE articles SET position = ? WHERE doi = ?",
+                     ((position, article.doi)
+                      for position, old_position, article
+                      in zip(new, old, articles)
+                      if position != old_position))
+
+
+def append_journal(records, articles, fname):
+    """
+    Applies journal records (see _journal() for the format) directly to the
+    database, instead of keeping a separate journal. Only the rows belonging
+    to the articles which were changed or moved are written.
+
+    Arguments:
+        records (list) : Journal records to be applied.
+        articles (list): The current list of articles. This is only used to
+                         update the positions if the list was reordered, or
+                         an article was inserted.
+        fname (Path)   : The database file.
+    """
+    placeholders = ", ".join("?" * len(_columns))
+    with closing(_connect(fname)) as conn, conn:
+        for record in records:
+            if record[0] == "put":
+                # Replaced articles keep their position, and new ones go to
+                # the end.
+                row = conn.execute("SELECT position FROM articles "
+                                   "WHERE doi = ?", (record[1],)).fetchone()
+                if row is not None:
+                    position = row[0]
+                    conn.execute("DELETE FROM articles WHERE doi = ?",
+                                 (record[1],))
+                else:
+                    position = conn.execute("SELECT COALESCE(MAX(position), "
+                                            "-1) + 1 FROM articles"
+                                            ).fetchone()[0]
+                conn.execute(f"INSERT OR REPLACE INTO articles "
+                             f"VALUES ({placeholders})",
+                             _to_row(record[2], position))
+            elif record[0] == "insert":
+                # The position is set by _reposition() below.
+                conn.execute(f"INSERT OR REPLACE INTO articles "
+                             f"VALUES ({placeholders})",
+                             _to_row(record[2], None))
+            elif record[0] == "delete":
+                conn.execute("DELETE FROM articles WHERE doi = ?",
+                             (record[1],))
+        if any(record[0] in ("insert", "order") for record in records):
+            _reposition(conn, articles)
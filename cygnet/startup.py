@@ -23,6 +23,8 @@ from . import prompt
 from . import fileio
 from . import backup
 from . import commands
+from . import index
+from . import fulltext
 from ._shared import *
 
 
@@ -52,15 +54,17 @@ def main():
     if dir.is_dir():
         # Set current path
         _g.currentPath = dir
-        # Try to load the peep.yaml file, if it exists
+        # Try to load the peep.yaml (or peep.sqlite) file, if it exists
+        fname = fileio.library_path(dir)
         try:
-            _g.articleList = fileio.read_articles(dir / "peep.yaml")
+            _g.articleList = fileio.read_articles(fname, cache=True)
         except FileNotFoundError:
-            pass
+            index.rebuild(_g.articleList)
         except yaml.YAMLError:
-            _error(f"A peep.yaml file was found in {dir}, "
-                   "but it contained invalid YAML.")
+            _error(f"A {fname.name} file was found in {dir}, "
+                   "but it contained invalid data.")
         else:
+            index.rebuild(_g.articleList)
             backup.create_backup()
         # Resize terminal
         cols, rows = os.get_terminal_size()
@@ -81,6 +85,8 @@ async def main_coro():
     """
     # Start autosave task
     t_autosave = asyncio.create_task(backup.autosave())
+    # Start indexing PDFs for full-text search
+    t_fulltext = asyncio.create_task(fulltext.indexer())
 
     # Launch aiohttp session with nice user-agent default header.
     async with aiohttp.ClientSession(connector=_g.ahConnector,
@@ -97,8 +103,9 @@ async def main_coro():
     # Program shutdown code.
     # Backup 
     backup.create_backup()
-    # Stop autosave
+    # Stop autosave and indexing
     t_autosave.cancel()
+    t_fulltext.cancel()
     # prompt_toolkit bug if you spam commands like crazy
     count = 0
     for t in asyncio.all_tasks():
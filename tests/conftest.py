@@ -0,0 +1,11 @@
+import asyncio
+
+
+# _g creates its aiohttp connector when cygnet is imported, and newer versions
+# of aiohttp only allow that inside a running event loop.
+async def _import_cygnet():
+    import cygnet.commands
+    import cygnet.prompt
+
+
+asyncio.run(_import_cygnet())
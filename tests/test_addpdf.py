@@ -0,0 +1,69 @@
+"""
+Tests for the addpdf ('ap') command, run end to end with the file path typed
+at its prompt.
+"""
+
+import asyncio
+import io
+from contextlib import redirect_stdout
+
+import pytest
+from prompt_toolkit.application import create_app_session
+from prompt_toolkit.input import create_pipe_input
+from prompt_toolkit.output import DummyOutput
+
+from cygnet import commands, index
+from cygnet._shared import _g
+from cygnet.cygcls import Article
+
+
+@pytest.fixture
+def library(tmp_path):
+    _g.currentPath = tmp_path
+    _g.articleList = [
+        Article(title="Ultrafast 2D NMR",
+                authors=[{"family": "Yong", "given": "Jonathan R. J."}],
+                journal_long="Journal of Magnetic Resonance",
+                journal_short="J. Magn. Reson.",
+                year=2021, volume="325", issue=None, pages="106931",
+                doi="10.1016/j.jmr.2021.106931"),
+    ]
+    index.rebuild(_g.articleList)
+    yield tmp_path
+    _g.articleList = []
+    index.rebuild(_g.articleList)
+
+
+def run_addpdf(args, typed):
+    async def run():
+        with create_pipe_input() as pipe:
+            with create_app_session(input=pipe, output=DummyOutput()):
+                pipe.send_text(typed)
+                await commands.cli_addpdf(args)
+
+    with redirect_stdout(io.StringIO()) as f:
+        asyncio.run(run())
+    return f.getvalue()
+
+
+def test_addpdf(library):
+    src = library / "download.pdf"
+    src.write_bytes(b"%PDF-1.4 test")
+    article = _g.articleList[0]
+    assert article.get_availability() == [False, False]
+
+    out = run_addpdf(["1"], f"{src}\n")
+    assert "1 PDFs added, 0 failed" in out
+    assert article.to_fname("pdf").read_bytes() == b"%PDF-1.4 test"
+    assert article.get_availability() == [True, False]
+
+    # Adding it again doesn't prompt.
+    out = run_addpdf(["1", "p"], "")
+    assert "PDF is already available." in out
+    assert "0 PDFs added, 0 failed" in out
+
+
+def test_addpdf_missing_file(library):
+    out = run_addpdf(["1"], f"{library / 'nonexistent.pdf'}\n")
+    assert "0 PDFs added, 1 failed" in out
+    assert _g.articleList[0].get_availability() == [False, False]
@@ -0,0 +1,57 @@
+"""
+Tests for the full-text index of the PDFs.
+"""
+
+import asyncio
+import shutil
+import subprocess
+
+from cygnet import fulltext
+
+
+def write_pdf(dirname, doi, text):
+    # Just enough of a PDF for the built-in extractor.
+    fname = dirname / "pdf" / (doi.replace("/", "#") + ".pdf")
+    fname.parent.mkdir(exist_ok=True)
+    fname.write_bytes(b"%PDF-1.4\nstream\nBT (" + text.encode()
+                      + b") Tj ET\nendstream\n%%EOF\n")
+    return fname
+
+
+def test_update_and_search(tmp_path, monkeypatch):
+    monkeypatch.setattr(shutil, "which", lambda cmd: None)
+    write_pdf(tmp_path, "10.1000/a", "pure shift NMR spectroscopy")
+    write_pdf(tmp_path, "10.1000/b", "ultrafast NMR")
+    # Nothing has been indexed yet, and searching doesn't wait for it.
+    assert fulltext.search(tmp_path, "nmr") == ([], 2)
+
+    asyncio.run(fulltext.update(tmp_path))
+    results, pending = fulltext.search(tmp_path, "NMR")
+    assert [name for name, _ in results] == ["pdf/10.1000#a.pdf",
+                                              "pdf/10.1000#b.pdf"]
+    assert pending == 0
+    assert fulltext.doi_of(results[0][0]) == "10.1000/a"
+
+    # Each PDF has its own entry, and only changed ones are saved again.
+    entries = fulltext.index_path(tmp_path) / "pdf"
+    other = (entries / "10.1000#a.json").stat().st_mtime_ns
+    write_pdf(tmp_path, "10.1000/b", "spin echoes")
+    assert fulltext.search(tmp_path, "nmr")[1] == 1
+    asyncio.run(fulltext.update(tmp_path))
+    assert (entries / "10.1000#a.json").stat().st_mtime_ns == other
+    assert fulltext.search(tmp_path, "spin")[0][0][0] == "pdf/10.1000#b.pdf"
+
+    # Deleted PDFs are dropped from the index.
+    (tmp_path / "pdf" / "10.1000#a.pdf").unlink()
+    asyncio.run(fulltext.update(tmp_path))
+    assert fulltext.search(tmp_path, "nmr") == ([], 0)
+    assert not (entries / "10.1000#a.json").exists()
+
+
+def test_pdftotext_timeout(tmp_path, monkeypatch):
+    def run(args, **kwargs):
+        raise subprocess.TimeoutExpired(args, kwargs["timeout"])
+    monkeypatch.setattr(shutil, "which", lambda cmd: "/usr/bin/pdftotext")
+    monkeypatch.setattr(subprocess, "run", run)
+    fname = write_pdf(tmp_path, "10.1000/a", "corrupted")
+    assert fulltext._extract(fname) == ("", set())
@@ -0,0 +1,55 @@
+"""
+Tests for keeping the indexes in sync with the article list.
+"""
+
+import pytest
+
+from cygnet import index, query
+from cygnet.cygcls import Article
+
+
+def make_article(i, family, title):
+    return Article(title=title,
+                   authors=[{"family": family, "given": "A. B."}],
+                   journal_long="Journal of Magnetic Resonance",
+                   journal_short="J. Magn. Reson.",
+                   year=2000 + i, volume=str(i), issue=None, pages=str(i),
+                   doi=f"10.1000/test.{i}")
+
+
+@pytest.fixture
+def articles():
+    # Start from an empty library, as when there is no library file, and then
+    # add articles one at a time, as the add command does.
+    articles = []
+    index.rebuild([])
+    for i, (family, title) in enumerate([("Keeler", "Spin echoes"),
+                                         ("Kealer", "Pure shift NMR"),
+                                         ("Yong", "Ultrafast spin NMR")]):
+        article = make_article(i, family, title)
+        articles.append(article)
+        index.add(article)
+    yield articles
+    index.rebuild([])
+
+
+def search(args, articles):
+    ids = query.run(query.parse(args), articles)
+    return sorted(article.title for article in articles if id(article) in ids)
+
+
+@pytest.mark.parametrize("args, expected", [
+    (["kee.er"], ["Spin echoes"]),
+    (["ke.ler"], ["Pure shift NMR", "Spin echoes"]),
+    (["(?=spin)"], ["Spin echoes", "Ultrafast spin NMR"]),
+    (["nmr"], ["Pure shift NMR", "Ultrafast spin NMR"]),
+])
+def test_search_after_adding(articles, args, expected):
+    assert search(args, articles) == expected
+
+
+def test_search_after_removing(articles):
+    article = articles.pop(0)
+    index.remove(article)
+    assert search(["ke.ler"], articles) == ["Pure shift NMR"]
+    assert search(["(?=spin)"], articles) == ["Ultrafast spin NMR"]
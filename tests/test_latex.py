@@ -0,0 +1,86 @@
+"""
+Tests for the conversion of Unicode text to LaTeX in BibLaTeX citations.
+
+Unless stated otherwise, the expected outputs are what the original
+str.replace() implementation (using _g.unicodeLatexDict) produced.
+"""
+
+import pytest
+
+from cygnet import latex
+from cygnet.cygcls import Article
+
+
+@pytest.mark.parametrize("text, expected", [
+    # Accents.
+    ("Gödel", 'G{\\"o}del'),
+    ("Ångström", '{\\AA}ngstr{\\"o}m'),
+    ("Ćwikliński", "{\\'C}wikli{\\'n}ski"),
+    ("Nuñez", "Nu{\\~n}ez"),
+    ("Émile Brontë", "{\\'E}mile Bront{\\\"e}"),
+    # Letters which aren't accented letters.
+    ("Paweł Łukasiewicz", "Pawe{\\l{}} {\\L{}}ukasiewicz"),
+    ("Øystein Sæther", "{\\O}ystein S{\\ae}ther"),
+    ("Þór Ðuð", "{\\TH}{\\'o}r {\\DH}u{\\dh}"),
+    ("Straße", "Stra{\\ss}e"),
+    # Dashes and maths.
+    ("Müller–Lüdenscheidt", 'M{\\"u}ller--L{\\"u}denscheidt'),
+    ("Chemistry—a review", "Chemistry---a review"),
+    ("Kohn‐Sham", "Kohn-Sham"),
+    ("2 × 3 ÷ 4", "2 \\(\\times\\) 3 \\(\\div\\) 4"),
+    # Braces, backslashes and maths which are already LaTeX are left alone.
+    ("{NMR} $J$ coupling in \\emph{C}_2", "{NMR} $J$ coupling in \\emph{C}_2"),
+])
+def test_encode_as_before(text, expected):
+    assert latex.encode(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    # The original implementation gave the invalid {\cC} and {\cc}.
+    ("Çelik", "{\\c{C}}elik"),
+    ("Français", "Fran{\\c{c}}ais"),
+    # Not in the original table, so these were left as they were.
+    ("Dvořák", "Dvo{\\v{r}}{\\'a}k"),
+    ("Erdős", "Erd{\\H{o}}s"),
+    ("Nguyễn", "Nguy{\\~{\\^e}}n"),
+    ("α-helix", "\\(\\alpha\\)-helix"),
+    ("ΔG", "\\(\\Delta\\)G"),
+    ("Λ-type", "\\(\\Lambda\\)-type"),
+    ("λ, ε, φ", "\\(\\lambda\\), \\(\\varepsilon\\), \\(\\varphi\\)"),
+    ("Β-Ο", "B-O"),
+    ("5 µM", "5 \\(\\mu\\)M"),
+    ("≤ 10 °C", "\\(\\leq\\) 10 {\\textdegree}C"),
+    # Combining accents, with and without a precomposed form.
+    ("Café", "Caf{\\'e}"),
+    ("q̇", "{\\.q}"),
+    # Characters with no LaTeX equivalent.
+    ("中文", "中文"),
+])
+def test_encode_new(text, expected):
+    assert latex.encode(text) == expected
+
+
+def test_encode_all():
+    assert latex.encode_all(["Gödel", "plain", "α"]) == [
+        'G{\\"o}del', "plain", "\\(\\alpha\\)"]
+
+
+def test_bib_citation():
+    article = Article(title="Ultrafast 2D NMR: An Émerging Tool",
+                      authors=[{"family": "Gödel", "given": "Kurt"},
+                               {"family": "Müller", "given": "Ångel"}],
+                      journal_long="Angewandte Chemie International Edition",
+                      journal_short="Angew. Chem. Int. Ed.",
+                      year=2019, volume="58", issue="1", pages="12-34",
+                      doi="10.1002/anie.201812345")
+    assert article.to_citation("bib") == (
+        "@article{Godel2019ACIE,\n"
+        "    doi = {10.1002/anie.201812345},\n"
+        '    author = {G{\\"o}del, Kurt and M{\\"u}ller, {\\AA}ngel},\n'
+        "    journal = {Angew.\\ Chem.\\ Int.\\ Ed.},\n"
+        "    title = {Ultrafast 2D NMR: An {\\'E}merging Tool},\n"
+        "    year = {2019},\n"
+        "    volume = {58},\n"
+        "    issue = {1},\n"
+        "    pages = {12--34},\n"
+        "}")
@@ -0,0 +1,57 @@
+"""
+Tests for the command loop.
+"""
+
+import asyncio
+import io
+from contextlib import redirect_stdout
+from time import perf_counter
+
+import pytest
+import prompt_toolkit as pt
+from prompt_toolkit.application import create_app_session
+from prompt_toolkit.input import create_pipe_input
+from prompt_toolkit.output import DummyOutput
+
+from cygnet import prompt
+from cygnet._shared import _g
+
+
+@pytest.fixture
+def library(monkeypatch, tmp_path):
+    monkeypatch.setattr(_g, "currentPath", tmp_path)
+    monkeypatch.setattr(_g, "articleList", [])
+    return tmp_path
+
+
+def run_loop(commands):
+    """
+    Pipes the commands (and then 'q') through peepPrompt.loop().
+
+    Returns:
+        Tuple of (output, time taken in seconds).
+    """
+    async def run():
+        with create_pipe_input() as pipe:
+            with create_app_session(input=pipe, output=DummyOutput()):
+                pmt = prompt.peepPrompt()
+                pmt.session = pt.PromptSession()
+                pipe.send_text("".join(f"{cmd}\n" for cmd in commands)
+                               + "q\n")
+                now = perf_counter()
+                await pmt.loop()
+                return perf_counter() - now
+
+    with redirect_stdout(io.StringIO()) as f:
+        elapsed = asyncio.run(run())
+    return f.getvalue(), elapsed
+
+
+def test_no_delay_after_commands(library):
+    # The loop used to sleep for 100 ms after every command, so this took
+    # over 100 s. Allowing half of that leaves plenty of room for a slow
+    # machine while still catching any such sleep.
+    n = 1000
+    out, elapsed = run_loop(["pee"] * n)
+    assert out.count("zzzpee...") == n
+    assert elapsed < 0.05 * n
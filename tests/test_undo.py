@@ -0,0 +1,87 @@
+"""
+Tests for the undo history.
+"""
+
+import io
+import subprocess
+from contextlib import redirect_stdout
+from copy import copy
+
+import pytest
+
+from cygnet import commands, index
+from cygnet._shared import (_g, _sort, _record, _saveHist, _endHist,
+                            _clearHist, _undo)
+from cygnet.cygcls import Article
+
+
+@pytest.fixture
+def articles(monkeypatch, tmp_path):
+    articles = [Article(title=f"Title {i}",
+                        authors=[{"family": "Yong", "given": "J. R. J."}],
+                        journal_long="Journal of Magnetic Resonance",
+                        journal_short="J. Magn. Reson.",
+                        year=2020 - i, volume=str(i), issue=None,
+                        pages=str(i), doi=f"10.1000/test.{i}")
+                for i in range(5)]
+    monkeypatch.setattr(_g, "currentPath", tmp_path)
+    monkeypatch.setattr(_g, "articleList", list(articles))
+    monkeypatch.setattr(_g, "changes", [])
+    monkeypatch.setattr(_g, "journal", [])
+    index.rebuild(_g.articleList)
+    _clearHist()
+    yield articles
+    _clearHist()
+    index.rebuild([])
+
+
+def undo():
+    with redirect_stdout(io.StringIO()) as f:
+        _undo()
+    return f.getvalue()
+
+
+def test_command_which_failed_partway(articles):
+    # Delete two articles, but "fail" after the first one.
+    _saveHist("d", ["1", "2"])
+    article = _g.articleList[0]
+    _record("insert", 0, article)
+    del _g.articleList[0]
+    index.remove(article)
+    _endHist()
+    # Changes made after the command has finished aren't part of it.
+    _sort.sort("year", set_mode=False)
+    assert _g.undoRecords is None
+    assert len(_g.history) == 1
+
+    _sort.sort("year", reverse=True, set_mode=False)
+    assert "undid command: d 1 2" in undo()
+    assert _g.articleList == articles
+    assert "no more history" in undo()
+
+
+def test_open_is_not_undoable(articles, monkeypatch):
+    monkeypatch.setattr(subprocess, "run", lambda *args, **kwargs: None)
+    old = _g.articleList[2]
+    old.to_citation("bib")
+    with redirect_stdout(io.StringIO()):
+        commands.cli_open(["3", "w"])
+    opened = _g.articleList[2]
+    # The article is replaced, not modified.
+    assert opened is not old and old.time_opened is None
+    assert opened.time_opened is not None
+    assert index.dois.get(old.doi) is opened
+    assert opened._citations == old._citations
+    assert opened._citations is not old._citations
+    assert "no more history" in undo()
+
+
+def test_copy_has_its_own_caches(articles):
+    article = articles[0]
+    article.format_authors("bib")
+    article.to_citation("bib")
+    new = copy(article)
+    assert new == article
+    assert new._derived == article._derived
+    assert new._derived is not article._derived
+    assert new._citations is not article._citations